@@ -1,142 +1,372 @@
 '''
-App config parameters from config.ini file
+App config parameters from config.ini file.
+config.ini se lee la primera vez que se usa un parámetro (app_config.N_BYTES) y cada valor se convierte
+a su tipo una sola vez. Las listas y booleanos se leen con ast.literal_eval, nunca con eval.
 '''
 
+import ast
 import configparser
 
-config = configparser.ConfigParser()
-config.read('config.ini')
+from functools import lru_cache
+from typing import Callable
 
-# Basic config
+CONFIG_PATH = 'config.ini'
 
-N_BYTES: int = int(config.get('Core', 'n_bytes'))
-ROUND_DIGITS: int = eval(config.get('Core', 'round_digits'))
-NAN_VALUES: list[int] = eval(config.get('Core', 'nan_values')) 
+@lru_cache(maxsize=None)
+def get_config() -> configparser.ConfigParser:
+    config = configparser.ConfigParser(inline_comment_prefixes=('#',))
+    config.read(CONFIG_PATH)
+    return config
 
-# Logs config
+def _bool(value: str) -> bool:
+    if value.strip().lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    if value.strip().lower() in ('0', 'false', 'no', 'off'):
+        return False
+    raise ValueError(f'expected a boolean, received {value}')
 
-ENABLE_LOGS: bool = eval(config.get('Core', 'enable_logs'))
-SHOW_LOGS_PRINT: bool = eval(config.get('Core', 'show_logs_print'))
-LOG_DIR: str = config.get('Core', 'log_dir')
+def _int_list(value: str) -> list[int]:
+    result = ast.literal_eval(value)
+    if not isinstance(result, (list, tuple)) or not all(isinstance(item, int) for item in result):
+        raise ValueError(f'expected a list of integers, received {value}')
+    return list(result)
 
-# Auth config
+_REQUIRED = object()
 
-USERNAME = config.get('Auth', 'username')
-PASSWORD = config.get('Auth', 'password')
+# nombre: (sección, clave, conversión, valor por defecto)
+_SETTINGS: dict[str, tuple[str, str, Callable[[str], object], object]] = {
+    # Basic config
+    'N_BYTES': ('Core', 'n_bytes', int, 3),
+    'ROUND_DIGITS': ('Core', 'round_digits', int, 2),
+    'NAN_VALUES': ('Core', 'nan_values', _int_list, [131067, 131068, 131069, 131070]),
+    'QUARANTINE_PATH': ('Core', 'quarantine_path', str, 'quarantine.jsonl'),
+    # Logs config
+    'ENABLE_LOGS': ('Core', 'enable_logs', _bool, False),
+    'SHOW_LOGS_PRINT': ('Core', 'show_logs_print', _bool, False),
+    'LOG_DIR': ('Core', 'log_dir', str, '__logs__'),
+    # Auth config
+    'USERNAME': ('Auth', 'username', str, _REQUIRED),
+    'PASSWORD': ('Auth', 'password', str, _REQUIRED),
+    # Api config
+    'API_HOST': ('Api', 'host', str, 'https://bumblebee.hive.swarm.space'),
+    'API_CONNECT_TIMEOUT': ('Api', 'connect_timeout', float, 5.0),
+    'API_READ_TIMEOUT': ('Api', 'read_timeout', float, 60.0),
+    'API_MAX_RETRIES': ('Api', 'max_retries', int, 4),
+    'API_BACKOFF_BASE': ('Api', 'backoff_base', float, 0.5),
+    'API_BACKOFF_MAX': ('Api', 'backoff_max', float, 30.0),
+    'API_TOKEN_TTL': ('Api', 'token_ttl', float, 3600.0),
+    'API_TOKEN_CACHE': ('Api', 'token_cache', str, ''),
+    'API_DEVICE_CACHE': ('Api', 'device_cache', str, 'devices_cache.json'),
+    'API_DEVICE_CACHE_TTL': ('Api', 'device_cache_ttl', float, 86400.0),
+    # Metrics config
+    'METRICS_ENABLED': ('Metrics', 'enabled', _bool, True),
+    'METRICS_PATH': ('Metrics', 'path', str, 'metrics.prom'),
+    'METRICS_FORMAT': ('Metrics', 'format', str, 'prometheus'),
+    # Daemon config
+    'DAEMON_POLL_INTERVAL': ('Daemon', 'poll_interval', float, 300.0),
+    'DAEMON_INDEX_DAYS': ('Daemon', 'index_days', float, 30.0),
+    # Coverage config
+    'REFETCH_LAG': ('Coverage', 'refetch_lag', float, 86400.0),
+    'REFETCH_MERGE_GAP': ('Coverage', 'merge_gap', float, 21600.0),
+}
+
+N_BYTES: int
+ROUND_DIGITS: int
+NAN_VALUES: list[int]
+QUARANTINE_PATH: str
+ENABLE_LOGS: bool
+SHOW_LOGS_PRINT: bool
+LOG_DIR: str
+USERNAME: str
+PASSWORD: str
+API_HOST: str
+API_CONNECT_TIMEOUT: float
+API_READ_TIMEOUT: float
+API_MAX_RETRIES: int
+API_BACKOFF_BASE: float
+API_BACKOFF_MAX: float
+API_TOKEN_TTL: float
+API_TOKEN_CACHE: str
+API_DEVICE_CACHE: str
+API_DEVICE_CACHE_TTL: float
+METRICS_ENABLED: bool
+METRICS_PATH: str
+METRICS_FORMAT: str
+DAEMON_POLL_INTERVAL: float
+DAEMON_INDEX_DAYS: float
+REFETCH_LAG: float
+REFETCH_MERGE_GAP: float
+
+def setting(name: str):
+    '''Retorna el parámetro ya convertido a su tipo, lo lee de config.ini la primera vez'''
+    value = globals().get(name, _REQUIRED)
+    if value is not _REQUIRED:
+        return value
+    (section, key, convert, default) = _SETTINGS[name]
+    raw = get_config().get(section, key, fallback=None)
+    if raw is None:
+        if default is _REQUIRED:
+            raise ValueError(f'setting >> Missing [{section}] {key} in {CONFIG_PATH}')
+        value = default
+    else:
+        try:
+            value = convert(raw)
+        except (ValueError, SyntaxError) as e:
+            raise ValueError(f'setting >> Invalid value for [{section}] {key}: {e}') from e
+    globals()[name] = value
+    return value
+
+def __getattr__(name: str):
+    if name in _SETTINGS:
+        return setting(name)
+    raise AttributeError(f"module 'app_config' has no attribute '{name}'")
 
 '''
-Custom logger with date file management
+Custom logger with date file management.
+Los registros se encolan y un solo hilo los formatea y escribe (archivo del día y/o consola),
+el hilo que registra solo revisa el nivel y agrega el registro a la cola.
 '''
 
+import atexit
 import os
 import logging
+import queue
+import sys
+import threading
+import time
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+_LEVEL_PREFIX = {
+    logging.DEBUG: '📘',
+    logging.INFO: '📗',
+    logging.WARNING: '📙',
+    logging.ERROR: '📕',
+    logging.CRITICAL: '😥',
+}
+
+class _PrintFormatter(logging.Formatter):
+    '''Formato de consola: "📘 [DEBUG] (nombre) mensaje"'''
+
+    def format(self, record: logging.LogRecord) -> str:
+        return f'{_LEVEL_PREFIX.get(record.levelno, "")} [{record.levelname}] ({record.name}) {super().format(record)}'
+
+class _LazyQueueHandler(QueueHandler):
+    '''Encola el registro sin formatearlo, el mensaje con sus argumentos se arma en el hilo del listener'''
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
 
-if ENABLE_LOGS:
-    os.makedirs(LOG_DIR, exist_ok=True)
+_queue_handler: QueueHandler | None = None
+
+_listener: QueueListener | None = None
+
+_listener_lock = threading.Lock()
+
+def _get_queue_handler() -> QueueHandler:
+    '''Crea una sola vez la cola, los handlers de salida y el hilo que escribe'''
+    global _queue_handler, _listener
+    with _listener_lock:
+        if _queue_handler is None:
+            handlers: list[logging.Handler] = []
+            if setting('ENABLE_LOGS'):
+                os.makedirs(setting('LOG_DIR'), exist_ok=True)
+                file_handler = logging.FileHandler(os.path.join(setting('LOG_DIR'), f'{datetime.now().strftime("%Y-%m-%d")}.log'))
+                file_handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] (%(name)s): %(message)s'))
+                handlers.append(file_handler)
+            if setting('SHOW_LOGS_PRINT'):
+                print_handler = logging.StreamHandler(sys.stdout)
+                print_handler.setFormatter(_PrintFormatter())
+                handlers.append(print_handler)
+
+            log_queue: queue.SimpleQueue = queue.SimpleQueue()
+            _listener = QueueListener(log_queue, *handlers)
+            _listener.start()
+            _queue_handler = _LazyQueueHandler(log_queue)
+            atexit.register(stop_logging)
+    return _queue_handler
+
+def stop_logging():
+    '''Escribe los registros pendientes y detiene el hilo de escritura'''
+    global _queue_handler, _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+        _listener = None
+        _queue_handler = None
 
 class CustomLogger:
+    '''Logger con argumentos al estilo %: logger.debug('url=%s params=%s', url, params).
+    Si el nivel no está habilitado no se formatea nada.
+    config.ini se lee con el primer registro, crear el logger al importar un módulo no lo lee.'''
+
     def __init__(self, logger_name):
         self.logger = logging.getLogger(logger_name)
-        self.logger.setLevel(logging.DEBUG if ENABLE_LOGS else logging.NOTSET)
-        
-        if ENABLE_LOGS:
-            formatter = logging.Formatter('%(asctime)s [%(levelname)s] (%(name)s): %(message)s')
+        self.logger_name = logger_name
+        self._enabled: bool | None = None
 
-            log_file = os.path.join(LOG_DIR, f'{datetime.now().strftime('%Y-%m-%d')}.log')
+    @property
+    def enabled(self) -> bool:
+        if self._enabled is None:
+            self._enabled = setting('ENABLE_LOGS') or setting('SHOW_LOGS_PRINT')
+            if self._enabled:
+                self.logger.setLevel(logging.DEBUG)
+                self.logger.propagate = False
+                handler = _get_queue_handler()
+                if handler not in self.logger.handlers:
+                    self.logger.addHandler(handler)
+        return self._enabled
 
-            file_handler = logging.FileHandler(log_file)
-            file_handler.setFormatter(formatter)
-            
-            self.logger.addHandler(file_handler)
+    def is_enabled_for(self, level: int) -> bool:
+        return self.enabled and self.logger.isEnabledFor(level)
 
-        self.logger_name = logger_name
+    def debug(self, message, *args, **kwargs):
+        if self.enabled and self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(message, *args, **kwargs)
+
+    def info(self, message, *args, **kwargs):
+        if self.enabled and self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(message, *args, **kwargs)
 
-    def debug(self, message):
-        if ENABLE_LOGS:
-            self.logger.debug(message)
-        if SHOW_LOGS_PRINT:
-            print(f'📘 [DEBUG]', f'({self.logger_name})', message)
-
-    def info(self, message):
-        if ENABLE_LOGS:
-            self.logger.info(message)
-        if SHOW_LOGS_PRINT:
-            print(f'📗 [INFO]', f'({self.logger_name})', message)
-
-    def warning(self, message):
-        if ENABLE_LOGS:
-            self.logger.warning(message)
-        if SHOW_LOGS_PRINT:
-            print(f'📙 [WARNING]', f'({self.logger_name})', message)
-
-    def error(self, message):
-        if ENABLE_LOGS:
-            self.logger.error(message)
-        if SHOW_LOGS_PRINT:
-            print(f'📕 [ERROR]', f'({self.logger_name})', message)
-
-    def critical(self, message):
-        if ENABLE_LOGS:
-            self.logger.critical(message)
-        if SHOW_LOGS_PRINT:
-            print(f'😥 [CRITICAL]', f'({self.logger_name})', message)
+    def warning(self, message, *args, **kwargs):
+        if self.enabled and self.logger.isEnabledFor(logging.WARNING):
+            self.logger.warning(message, *args, **kwargs)
+
+    def error(self, message, *args, **kwargs):
+        if self.enabled and self.logger.isEnabledFor(logging.ERROR):
+            self.logger.error(message, *args, **kwargs)
+
+    def critical(self, message, *args, **kwargs):
+        if self.enabled and self.logger.isEnabledFor(logging.CRITICAL):
+            self.logger.critical(message, *args, **kwargs)
 
 '''
 Devices configuration from files in ./devices directory
 '''
 
+import hashlib
+
 device_logger = CustomLogger('device_config')
 
+DEFAULT_MULT_OFFSET = (1.0, 0.0)
+
+def parse_device_config(text: str) -> list[tuple[float, float]]:
+    '''Compila el contenido de un archivo de calibración en la lista (mult, offset) de cada variable.
+    La primera línea es minutos * 100 + n_vars, luego una línea "mult,offset" por variable.
+    La lista siempre tiene n_vars elementos, las variables sin línea válida usan (1.0, 0.0).'''
+    lines = text.splitlines()
+    if len(lines) == 0:
+        return []
+    n_vars = int(lines[0]) % 100
+
+    if len(lines) - 1 < n_vars:
+        device_logger.warning('n_vars is %s and lines with values are %s', n_vars, len(lines) - 1)
+
+    item: list[tuple[float, float]] = []
+    for value in lines[1:n_vars + 1]:
+        try:
+            (mult, offset) = value.split(',')[0:2]
+            item.append((float(mult), float(offset)))
+        except Exception as e:
+            device_logger.error(e)
+            item.append(DEFAULT_MULT_OFFSET)
+    item.extend([DEFAULT_MULT_OFFSET] * (n_vars - len(item)))
+    return item
+
+def calibration_version(mult_offset: list[tuple[float, float]]) -> str:
+    '''Etiqueta corta de una calibración, la misma lista (mult, offset) siempre tiene la misma etiqueta'''
+    text = ';'.join(f'{float(mult)!r},{float(offset)!r}' for (mult, offset) in mult_offset)
+    return hashlib.sha1(text.encode('ascii')).hexdigest()[:12]
+
 class DeviceConfig:
-    def __init__(self):
+    '''Calibración (mult, offset) por dispositivo, leída de los archivos {directory}/{nombre}.txt.
+    get_mult_offset revisa con os.stat (como máximo cada reload_interval segundos) si algún archivo cambió,
+    se agregó o se eliminó, y vuelve a compilar solo esos archivos.'''
+
+    def __init__(self, directory: str = 'devices', reload_interval: float = 2.0, lazy: bool = False):
+        '''Con lazy=True los archivos se leen la primera vez que se pide una calibración'''
+        self.directory = directory
+        self.reload_interval = reload_interval
         self.init_data_container()
-        self.load_devices_config()
+        if not lazy:
+            self.load_devices_config(directory)
 
     def init_data_container(self):
         self.data: dict[str, list[tuple[float, float]]] = {}
+        self._mtimes: dict[str, int] = {}
+        self._checked_at = 0.0
+        self._loaded = False
 
     def add_data(self, device_id, item: list[tuple[float, float]]):
         self.data[device_id] = item
     
     def clear(self):
         self.data.clear()
+        self._mtimes.clear()
+
+    def _scan(self) -> dict[str, tuple[str, int]]:
+        '''Retorna {nombre: (ruta, mtime_ns)} de los archivos del directorio'''
+        files: dict[str, tuple[str, int]] = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    files[entry.name.split('.')[0]] = (entry.path, entry.stat().st_mtime_ns)
+        return files
+
+    def _load_file(self, device_id: str, file_path: str, mtime: int):
+        try:
+            with open(file_path, 'r') as file:
+                item = parse_device_config(file.read())
+        except Exception as e:
+            device_logger.error('Device config "%s" could not be read: %s', file_path, e)
+            return
+        self._mtimes[device_id] = mtime
+        if len(item) > 0:
+            self.add_data(device_id, item)
 
     def load_devices_config(self, directory = 'devices'):
         device_logger.info('Loading devices config')
+        self.directory = directory
         self.clear()
+        self._loaded = True
+        self._checked_at = time.monotonic()
         try:
-            files = os.listdir(directory)
-
-            for filename in files:
-                file_path = os.path.join(directory, filename)
-                device_id = filename.split('.')[0]
-
-                if os.path.isfile(file_path):
-                    with open(file_path, 'r') as file:
-                        lines = file.readlines()
-                        if len(lines) > 0:
-                            first_line = int(lines[0])
-                            first_line_split = str(round(first_line / 100.0, 2)).split('.')
-                            if len(first_line_split) == 2:
-                                n_vars = int(first_line_split[1])
-                                
-                                if len(lines) - 1 < n_vars:
-                                    device_logger.warning(f'n_vars is {n_vars} and lines with values are {len(lines) - 1}')
-
-                                values = lines[1:n_vars + 1]
-                                item: list[tuple[float, float]] = []
-                                for value in values:
-                                    try:
-                                        value_split = value.split(',')
-                                        mult = float(value_split[0])
-                                        offset = float(value_split[1])
-                                        item.append((mult, offset))
-                                    except Exception as e:
-                                        device_logger.error(e)
-
-                                self.add_data(device_id, item)
-                        file.close()
+            for device_id, (file_path, mtime) in self._scan().items():
+                self._load_file(device_id, file_path, mtime)
+        except FileNotFoundError:
+            device_logger.error('The directory "%s" does not exist.', directory)
 
+    def reload_if_changed(self, force: bool = False) -> bool:
+        '''Vuelve a leer los archivos cuyo mtime cambió. Retorna True si hubo cambios'''
+        if not self._loaded:
+            self.load_devices_config(self.directory)
+            return True
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.reload_interval:
+            return False
+        self._checked_at = now
+        try:
+            files = self._scan()
         except FileNotFoundError:
-            device_logger.error(f'The directory "{directory}" does not exist.')
\ No newline at end of file
+            files = {}
+
+        changed = False
+        for device_id in set(self._mtimes) - set(files):
+            self._mtimes.pop(device_id, None)
+            self.data.pop(device_id, None)
+            changed = True
+        for device_id, (file_path, mtime) in files.items():
+            if self._mtimes.get(device_id) != mtime:
+                self.data.pop(device_id, None)
+                self._load_file(device_id, file_path, mtime)
+                changed = True
+        if changed:
+            device_logger.info('Devices config reloaded devices=%s', len(self.data))
+        return changed
+
+    def get_mult_offset(self, device_id) -> list[tuple[float, float]]:
+        '''Lista (mult, offset) del dispositivo con una entrada por variable, vacía si no tiene calibración'''
+        self.reload_if_changed()
+        return self.data.get(device_id, [])
@@ -0,0 +1,241 @@
+'''
+Decodificación vectorizada (NumPy) de varias tramas de un mismo dispositivo
+'''
+
+from datetime import datetime
+from typing import Callable
+
+import numpy as np
+
+import app_config
+
+from models.decoded_batch_model import RAW_MISSING, DecodedBatchModel, datetime_to_epoch
+
+from models.message_encode_model import MessageDecodeValueModel, MessageValuesView
+
+from pseudo_codec import DIGIT_BITS, DIGIT_TABLE, SIGN_LIMIT, SIGN_OFFSET, julian_day_epoch
+
+DIGIT_LOOKUP = np.frombuffer(DIGIT_TABLE, dtype=np.uint8)
+
+def round_like_python(values: np.ndarray, round_digits: int) -> np.ndarray:
+    '''Redondea igual que round() de Python.
+    np.round escala por 10**n antes de redondear, por lo que en valores muy cercanos a .5 puede
+    elegir otro entero; esos casos se recalculan con round() para obtener el mismo resultado.'''
+    result = np.round(values, round_digits)
+    scaled = values * (10.0 ** round_digits)
+    fraction = scaled - np.floor(scaled)
+    ties = np.flatnonzero(np.abs(fraction - 0.5) < 1e-6)
+    for index in ties.tolist():
+        result.flat[index] = round(float(values.flat[index]), round_digits)
+    return result
+
+def pseudo_to_int_array(codes: np.ndarray, n_bytes: int | None = None) -> np.ndarray:
+    '''Equivalente vectorizado de convert_pseudo_to_int.
+    codes es una matriz uint8 (n x n_bytes) con los caracteres de cada pseudo entero.'''
+    if n_bytes is None:
+        n_bytes = app_config.N_BYTES
+    digits = DIGIT_LOOKUP[codes]
+    result = np.zeros(len(codes), dtype=np.int64)
+    for k in range(n_bytes):
+        result = (result << DIGIT_BITS) | digits[:, k]
+    return np.where(result > SIGN_LIMIT, SIGN_OFFSET - result, result)
+
+def _mult_offset_vectors(mult_offset: list[tuple[float, float]], width: int) -> tuple[np.ndarray, np.ndarray]:
+    '''Retorna los vectores mult y offset de largo width, completando con (1.0, 0.0)'''
+    mult = np.ones(width, dtype=np.float64)
+    offset = np.zeros(width, dtype=np.float64)
+    for index, (item_mult, item_offset) in enumerate(mult_offset[:width]):
+        mult[index] = item_mult
+        offset[index] = item_offset
+    return mult, offset
+
+def raw_mask(raw: np.ndarray) -> np.ndarray:
+    '''Celdas sin valor de la matriz de enteros crudos: ausentes en la trama o con un código NaN'''
+    return (raw == RAW_MISSING) | np.isin(raw, app_config.NAN_VALUES)
+
+def calibrate(raw: np.ndarray, mult_offset: list[tuple[float, float]], round_digits: int | None = None) -> np.ndarray:
+    '''Valores de la matriz de enteros crudos (filas x variables): round(raw * mult + offset), NaN en las celdas sin valor'''
+    if round_digits is None:
+        round_digits = app_config.ROUND_DIGITS
+    mask = raw_mask(raw)
+    (mult, offset) = _mult_offset_vectors(mult_offset, raw.shape[1])
+    values = round_like_python(np.where(mask, 0, raw).astype(np.float64) * mult + offset, round_digits)
+    values[mask] = np.nan
+    return values
+
+def decode_batch(payloads: list[str | bytes],
+                 mult_offset: list[tuple[float, float]],
+                 n_bytes: int | None = None,
+                 round_digits: int | None = None,
+                 packet_ids: list | None = None,
+                 device_ids: list | None = None) -> DecodedBatchModel:
+    '''Decodifica varias tramas (ya decodificadas de base64) de un mismo dispositivo en una sola pasada.
+    Cada trama mantiene su propia cabecera (fecha inicial, minutos, n variables); la matriz de valores
+    tiene tantas columnas como el mayor n_vars del lote.
+    El resultado coincide con decode_message: mismas fechas, mismos valores y NaN donde decode_message usa None.
+    packet_ids y device_ids (opcionales) se guardan por trama en el lote.'''
+    if n_bytes is None:
+        n_bytes = app_config.N_BYTES
+    if round_digits is None:
+        round_digits = app_config.ROUND_DIGITS
+    header_len = 3 * n_bytes
+
+    headers: list[bytes] = []
+    bodies: list[bytes] = []
+    cells_list: list[int] = []
+    lengths: list[int] = []
+
+    for payload in payloads:
+        data = payload.encode('latin-1') if isinstance(payload, str) else payload
+        if len(data) < header_len:
+            raise ValueError(f'decode_batch >> Min data lenght is {header_len}, current is {len(data)}')
+        n_cells = (len(data) - header_len) // n_bytes
+        headers.append(data[:header_len])
+        bodies.append(data[header_len:header_len + n_cells * n_bytes])
+        cells_list.append(n_cells)
+        lengths.append(len(data) - header_len)
+
+    (start_epochs, minutes, n_vars) = decode_headers(b''.join(headers), n_bytes)
+    if np.any(n_vars <= 0):
+        raise ValueError('decode_batch >> Number of variables is 0')
+
+    cells = np.array(cells_list, dtype=np.int64)
+    rows = -(-np.array(lengths, dtype=np.int64) // (n_vars * n_bytes))
+    return _build_batch(b''.join(bodies), start_epochs, minutes * 60, n_vars, cells, rows,
+                        mult_offset, n_bytes, round_digits, packet_ids, device_ids)
+
+def decode_headers(headers: bytes, n_bytes: int | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''Decodifica cabeceras consecutivas de 3 * n_bytes caracteres con aritmética entera.
+    Retorna (segundos epoch de la fecha inicial, minutos, n variables) de cada cabecera.
+    La fecha de cada día distinto se calcula una sola vez (julian_day_epoch guarda los días ya vistos).'''
+    if n_bytes is None:
+        n_bytes = app_config.N_BYTES
+    ints = pseudo_to_int_array(np.frombuffer(headers, dtype=np.uint8).reshape(-1, n_bytes), n_bytes).reshape(-1, 3)
+    (date_ints, time_ints, vars_ints) = (ints[:, 0], ints[:, 1], ints[:, 2])
+
+    (unique_dates, inverse) = np.unique(date_ints, return_inverse=True)
+    day_epochs = np.array([julian_day_epoch(date_int) for date_int in unique_dates.tolist()], dtype=np.int64)
+
+    (hours, rest) = np.divmod(np.abs(time_ints), 10000)
+    (clock_minutes, seconds) = np.divmod(rest, 100)
+    hours = hours + np.where(time_ints < 0, 12, 0)
+    invalid = (hours > 23) | (clock_minutes > 59) | (seconds > 59)
+    if np.any(invalid):
+        raise ValueError(f'decode_headers >> Time {int(time_ints[invalid][0])} not follows the format HHMMSS')
+
+    start_epochs = day_epochs[inverse.reshape(-1)] + hours * 3600 + clock_minutes * 60 + seconds
+    (minutes, n_vars) = np.divmod(np.abs(vars_ints), 100)
+    return start_epochs, minutes, n_vars
+
+def decode_frame(data: str | bytes,
+                 initial_date: datetime,
+                 minutes: int,
+                 n_vars: int,
+                 mult_offset: list[tuple[float, float]],
+                 n_bytes: int | None = None,
+                 round_digits: int | None = None) -> DecodedBatchModel:
+    '''Decodifica los valores de una trama usando la cabecera indicada (no la de la trama). Lote de una sola trama'''
+    if n_bytes is None:
+        n_bytes = app_config.N_BYTES
+    if round_digits is None:
+        round_digits = app_config.ROUND_DIGITS
+    if isinstance(data, str):
+        data = data.encode('latin-1')
+    header_len = 3 * n_bytes
+    n_cells = max(0, (len(data) - header_len) // n_bytes)
+    n_rows = max(0, -(-(len(data) - header_len) // (n_vars * n_bytes)))
+    return _build_batch(data[header_len:header_len + n_cells * n_bytes],
+                        np.array([datetime_to_epoch(initial_date)], dtype=np.int64),
+                        np.array([minutes * 60], dtype=np.int64),
+                        np.array([n_vars], dtype=np.int64),
+                        np.array([n_cells], dtype=np.int64),
+                        np.array([n_rows], dtype=np.int64),
+                        mult_offset, n_bytes, round_digits)
+
+def _build_batch(body: bytes,
+                 start_epochs: np.ndarray,
+                 intervals: np.ndarray,
+                 n_vars: np.ndarray,
+                 cells: np.ndarray,
+                 rows: np.ndarray,
+                 mult_offset: list[tuple[float, float]],
+                 n_bytes: int,
+                 round_digits: int,
+                 packet_ids: list | None = None,
+                 device_ids: list | None = None) -> DecodedBatchModel:
+    '''Arma el lote a partir de los cuerpos concatenados (solo celdas completas) y las columnas de cada trama'''
+    n_frames = len(start_epochs)
+    width = int(n_vars.max()) if n_frames > 0 else 0
+    cell_starts = np.cumsum(cells) - cells
+    row_starts = np.cumsum(rows) - rows
+    total_rows = int(rows.sum())
+
+    # enteros de todas las celdas del lote
+    codes = np.frombuffer(body, dtype=np.uint8).reshape(-1, n_bytes)
+    ints = pseudo_to_int_array(codes, n_bytes)
+
+    # posición (fila, columna) de cada celda
+    cell_frame = np.repeat(np.arange(n_frames), cells)
+    cell_position = np.arange(len(ints)) - cell_starts[cell_frame]
+    cell_n_vars = n_vars[cell_frame]
+    column = cell_position % cell_n_vars
+    row = row_starts[cell_frame] + cell_position // cell_n_vars
+
+    raw = np.full((total_rows, width), RAW_MISSING, dtype=np.int32)
+    raw[row, column] = ints
+    values = calibrate(raw, mult_offset, round_digits)
+
+    row_bounds = np.append(row_starts, total_rows).astype(np.int64)
+
+    return DecodedBatchModel(values, start_epochs.astype(np.int64), intervals.astype(np.int64), n_vars, cells, row_bounds,
+                             list(packet_ids) if packet_ids is not None else None,
+                             list(device_ids) if device_ids is not None else None,
+                             raw, list(mult_offset))
+
+def decode_device_groups(payloads: list[str | bytes | Exception],
+                         device_names: list[str | None],
+                         mult_offset_for: Callable[[str | None], list[tuple[float, float]]],
+                         n_bytes: int | None = None,
+                         packet_ids: list | None = None,
+                         device_ids: list | None = None) -> list[tuple[DecodedBatchModel, int] | Exception]:
+    '''Decodifica tramas de varios dispositivos con un decode_batch por dispositivo.
+    Retorna, en el orden de entrada, el lote y el índice de trama de cada payload. Una trama inválida no detiene
+    el resto: en su posición queda el error (ValueError), igual que los payloads que ya son un error (base64).'''
+    if n_bytes is None:
+        n_bytes = app_config.N_BYTES
+    result: list[tuple[DecodedBatchModel, int] | Exception | None] = [None] * len(payloads)
+    groups: dict[str | None, list[int]] = {}
+    for index, device_name in enumerate(device_names):
+        if isinstance(payloads[index], Exception):
+            result[index] = payloads[index]
+        else:
+            groups.setdefault(device_name, []).append(index)
+
+    for device_name, indexes in groups.items():
+        mult_offset = mult_offset_for(device_name)
+        try:
+            batch = _decode_group(payloads, indexes, mult_offset, n_bytes, packet_ids, device_ids)
+        except ValueError:
+            # se busca cada trama inválida decodificándolas de a una, el resto vuelve a ser un solo lote
+            for index in indexes:
+                try:
+                    decode_batch([payloads[index]], mult_offset, n_bytes)
+                except ValueError as e:
+                    result[index] = e
+            indexes = [index for index in indexes if result[index] is None]
+            if len(indexes) == 0:
+                continue
+            batch = _decode_group(payloads, indexes, mult_offset, n_bytes, packet_ids, device_ids)
+        for frame, index in enumerate(indexes):
+            result[index] = (batch, frame)
+    return result
+
+def _decode_group(payloads: list, indexes: list[int], mult_offset: list[tuple[float, float]], n_bytes: int,
+                  packet_ids: list | None, device_ids: list | None) -> DecodedBatchModel:
+    return decode_batch([payloads[i] for i in indexes], mult_offset, n_bytes,
+                        packet_ids=[packet_ids[i] for i in indexes] if packet_ids is not None else None,
+                        device_ids=[device_ids[i] for i in indexes] if device_ids is not None else None)
+
+def frame_message_values(batch: DecodedBatchModel, frame: int) -> list[MessageDecodeValueModel]:
+    '''Convierte las filas de una trama del lote al formato de decode_message_values (None en lugar de NaN)'''
+    return list(MessageValuesView(batch, frame))
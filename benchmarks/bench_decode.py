@@ -0,0 +1,149 @@
+'''
+Benchmark de las etapas de decodificación con tramas sintéticas.
+Ejecutar desde la raíz del repositorio:
+
+    python -m benchmarks.bench_decode --devices 10 --frames 720 --nan-rate 0.01
+
+Cada ejecución agrega una línea JSON a benchmarks/results.jsonl para comparar resultados en el tiempo.
+'''
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from datetime import datetime
+from typing import Callable
+
+import app_config
+
+import vital_sensor_decode
+
+from batch_decode import decode_batch
+
+from models.message_encode_model import MessageEncodeModel
+
+from benchmarks.synthetic_frames import synthetic_packets
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def _measure(stage: Callable[[], object], repeat: int) -> tuple[float, int]:
+    '''Retorna (mejor tiempo en segundos, memoria máxima en bytes). La memoria se mide en una ejecución aparte'''
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stage()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    stage()
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+def run_benchmark(devices: int, frames: int, n_vars: int, rows: int, nan_rate: float, repeat: int) -> dict:
+    n_bytes = app_config.N_BYTES
+    packets = synthetic_packets(devices, frames, n_vars, rows, nan_rate=nan_rate)
+    payloads = [vital_sensor_decode.decode_payload(packet['data']) for packet in packets]
+    chunks = [payload[i:i + n_bytes] for payload in payloads for i in range(0, len(payload) - n_bytes + 1, n_bytes)]
+    mult_offset = [(0.01, 0.0)] * n_vars
+
+    by_device: dict[int, list[bytes]] = {}
+    for packet, payload in zip(packets, payloads):
+        by_device.setdefault(packet['deviceId'], []).append(payload)
+
+    def message_models() -> list[MessageEncodeModel]:
+        return [MessageEncodeModel(packet['packetId'], payload, packet['deviceType'], packet['deviceId'], None,
+                                   packet['status'], packet['hiveRxTime'], mult_offset=mult_offset)
+                for packet, payload in zip(packets, payloads)]
+
+    decoded = message_models()
+    for message in decoded:
+        vital_sensor_decode.decode_message(message, None, n_bytes)
+
+    def stage_base64():
+        for packet in packets:
+            vital_sensor_decode.decode_payload(packet['data'])
+
+    def stage_convert_pseudo_to_int():
+        for chunk in chunks:
+            vital_sensor_decode.convert_pseudo_to_int(chunk)
+
+    def stage_decode_message_values():
+        for message in message_models():
+            vital_sensor_decode.decode_message(message, None, n_bytes)
+
+    def stage_decode_batch():
+        for device_payloads in by_device.values():
+            decode_batch(device_payloads, mult_offset, n_bytes)
+
+    with tempfile.TemporaryDirectory() as directory:
+        def stage_save_messages_csv():
+            with vital_sensor_decode.MessagesCsvWriter(os.path.join(directory, 'values.csv'),
+                                                       os.path.join(directory, 'times.csv')) as writer:
+                for message in decoded:
+                    writer.write(message)
+
+        stages = {
+            'base64': stage_base64,
+            'convert_pseudo_to_int': stage_convert_pseudo_to_int,
+            'decode_message_values': stage_decode_message_values,
+            'decode_batch': stage_decode_batch,
+            'save_messages_csv': stage_save_messages_csv,
+        }
+
+        n_messages = len(packets)
+        n_values = sum(len(value.values) for message in decoded for value in message.message_values)
+        results: dict[str, dict] = {}
+        for name, stage in stages.items():
+            (seconds, peak) = _measure(stage, repeat)
+            results[name] = {
+                'seconds': seconds,
+                'messages_per_sec': n_messages / seconds if seconds > 0 else None,
+                'values_per_sec': n_values / seconds if seconds > 0 else None,
+                'peak_memory_bytes': peak,
+            }
+
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'params': {'devices': devices, 'frames_per_device': frames, 'n_vars': n_vars, 'rows_per_frame': rows,
+                   'nan_rate': nan_rate, 'repeat': repeat},
+        'messages': n_messages,
+        'values': n_values,
+        'stages': results,
+    }
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Benchmark de decodificación con tramas sintéticas')
+    parser.add_argument('--devices', type=int, default=10)
+    parser.add_argument('--frames', type=int, default=720, help='tramas por dispositivo')
+    parser.add_argument('--n-vars', type=int, default=4)
+    parser.add_argument('--rows', type=int, default=12, help='filas por trama')
+    parser.add_argument('--nan-rate', type=float, default=0.01)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=os.path.join('benchmarks', 'results.jsonl'))
+    args = parser.parse_args(argv)
+
+    result = run_benchmark(args.devices, args.frames, args.n_vars, args.rows, args.nan_rate, args.repeat)
+
+    with open(args.output, 'a') as file:
+        file.write(json.dumps(result) + '\n')
+
+    print(f'{result["messages"]} messages, {result["values"]} values')
+    for name, stage in result['stages'].items():
+        print(f'{name:<24} {stage["seconds"]:>9.4f} s {stage["messages_per_sec"]:>12.0f} msg/s '
+              f'{stage["values_per_sec"]:>14.0f} values/s {stage["peak_memory_bytes"] / 1e6:>9.2f} MB')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
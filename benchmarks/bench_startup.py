@@ -0,0 +1,66 @@
+'''
+Presupuesto de arranque: mide en un proceso nuevo el tiempo de importar vital_sensor_decode y revisa que
+una decodificación sin conexión no cargue módulos de red ni lea config.ini ni la calibración de los dispositivos.
+Ejecutar desde la raíz del repositorio:
+
+    python -m benchmarks.bench_startup --budget-ms 400
+
+Termina con código 1 si la mejor medición supera el presupuesto o se cargó algún módulo no permitido.
+'''
+
+import argparse
+import json
+import subprocess
+import sys
+
+# Módulos que no deben quedar cargados después de importar vital_sensor_decode
+FORBIDDEN_MODULES = ('requests', 'swarm_provider', 'swarm_fetch', 'parallel_decode')
+
+_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import vital_sensor_decode
+elapsed = time.perf_counter() - start
+import app_config
+print(json.dumps({
+    'import_ms': elapsed * 1000,
+    'modules': sorted(name for name in %r if name in sys.modules),
+    'config_read': app_config.get_config.cache_info().currsize > 0,
+    'device_config_loaded': vital_sensor_decode.device_config._loaded,
+}))
+''' % (FORBIDDEN_MODULES,)
+
+def measure(repeat: int) -> dict:
+    '''Ejecuta la prueba repeat veces y retorna la mejor medición'''
+    results = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', _PROBE], capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return min(results, key=lambda item: item['import_ms'])
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description='Presupuesto de tiempo de arranque')
+    parser.add_argument('--budget-ms', type=float, default=400)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    result = measure(args.repeat)
+    print(f'import vital_sensor_decode {result["import_ms"]:.1f} ms (budget {args.budget_ms:.0f} ms)')
+
+    failed = False
+    if result['import_ms'] > args.budget_ms:
+        print('FAIL: startup budget exceeded')
+        failed = True
+    if len(result['modules']) > 0:
+        print(f'FAIL: modules loaded at import: {", ".join(result["modules"])}')
+        failed = True
+    if result['config_read']:
+        print('FAIL: config.ini read at import')
+        failed = True
+    if result['device_config_loaded']:
+        print('FAIL: device config loaded at import')
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,65 @@
+'''
+Generador de tramas sintéticas con el mismo formato que envían los sensores:
+cabecera YYDDD / HHMMSS / minutos-n variables y filas de valores crudos de 3 caracteres.
+'''
+
+import base64
+import random
+
+from datetime import datetime, timedelta
+
+import app_config
+
+import pseudo_codec
+
+def synthetic_raw_rows(rng: random.Random, rows: int, n_vars: int, nan_rate: float) -> list[list[int]]:
+    '''Filas de enteros crudos con una caminata aleatoria por variable y valores NaN con probabilidad nan_rate'''
+    levels = [rng.randint(100, 20000) for _ in range(n_vars)]
+    result: list[list[int]] = []
+    for _ in range(rows):
+        row: list[int] = []
+        for index in range(n_vars):
+            levels[index] = max(-131071, min(131066, levels[index] + rng.randint(-20, 20)))
+            if rng.random() < nan_rate:
+                row.append(rng.choice(app_config.NAN_VALUES))
+            else:
+                row.append(levels[index])
+        result.append(row)
+    return result
+
+def synthetic_packets(devices: int = 10,
+                      frames_per_device: int = 720,
+                      n_vars: int = 4,
+                      rows_per_frame: int = 12,
+                      minutes: int = 5,
+                      nan_rate: float = 0.01,
+                      start_date: datetime = datetime(2024, 4, 1),
+                      seed: int = 1) -> list[dict]:
+    '''Retorna paquetes con el formato JSON del servicio de mensajes (data en base64).
+    Cada dispositivo envía una trama por cada rows_per_frame * minutes minutos a partir de start_date.'''
+    rng = random.Random(seed)
+    frame_span = timedelta(minutes=rows_per_frame * minutes)
+    packets: list[dict] = []
+    packet_id = 7000000000000000
+    for device in range(devices):
+        device_id = 13000 + device
+        for frame in range(frames_per_device):
+            initial_date = start_date + frame * frame_span
+            raw_rows = synthetic_raw_rows(rng, rows_per_frame, n_vars, nan_rate)
+            data = pseudo_codec.encode_frame(initial_date, minutes, raw_rows)
+            rx_time = initial_date + frame_span + timedelta(seconds=rng.randint(60, 4 * 3600))
+            packet_id += 1
+            packets.append({
+                'packetId': packet_id,
+                'messageId': packet_id,
+                'deviceType': 1,
+                'deviceId': device_id,
+                'direction': 1,
+                'dataType': 6,
+                'len': len(data),
+                'data': base64.b64encode(data).decode('ascii'),
+                'ackPacketId': 0,
+                'status': 0,
+                'hiveRxTime': rx_time.strftime('%Y-%m-%dT%H:%M:%S'),
+            })
+    return packets
@@ -0,0 +1,551 @@
+'''
+Almacenamiento columnar por dispositivo y día.
+
+    {root}/{device_id}/meta.json          cantidad de variables y calibraciones usadas (versión, mult/offset)
+    {root}/{device_id}/{YYYY-MM-DD}.ts    int64, segundos epoch de cada muestra
+    {root}/{device_id}/{YYYY-MM-DD}.f64   float64, matriz muestras x variables (NaN = sin valor)
+    {root}/{device_id}/{YYYY-MM-DD}.i32   int32, enteros crudos de la trama (RAW_MISSING = celda ausente)
+    {root}/{device_id}/{YYYY-MM-DD}.cal   uint16, posición en meta.json de la calibración de cada muestra
+    {root}/{device_id}/frames.i64         int64, (packetId, fecha inicial, hiveRxTime) de cada trama
+
+Los archivos solo se agregan al final y se leen con memory map, las lecturas por rango no copian datos
+cuando el día está ordenado. Si un timestamp se repite (muestra reemplazada) se lee el último valor agregado.
+recalibrate vuelve a calcular los valores de todo el historial de un dispositivo desde los enteros crudos.
+'''
+
+import csv
+import json
+import math
+import os
+
+from contextlib import nullcontext
+from datetime import date, datetime, timedelta
+from typing import Iterable, Iterator
+
+import numpy as np
+
+import app_config
+
+import metrics
+
+from app_config import calibration_version
+
+from batch_decode import calibrate
+
+from models.decoded_batch_model import RAW_MISSING, datetime_to_epoch, epoch_to_datetime
+
+from models.message_encode_model import MessageEncodeModel
+
+from quarantine import STAGE_STORE, Quarantine
+
+from sample_index import SampleIndex
+
+from sync_state import parse_hive_time
+
+logger = app_config.CustomLogger('column_store')
+
+SECONDS_PER_DAY = 86400
+
+# Número de calibración de las muestras sin enteros crudos (escritas sin lote o antes de guardarlos)
+CALIBRATION_UNKNOWN = 0xFFFF
+
+VARIABLE_NAMES = ["Nivel de agua", "Temperatura de agua", "Conductividad Eléctrica", "Nivel de bateria"]
+
+def csv_header(n_vars: int) -> list[str]:
+    '''Cabecera del CSV de valores para n_vars variables'''
+    names = VARIABLE_NAMES[:n_vars] + [f'Variable {index + 1}' for index in range(len(VARIABLE_NAMES), n_vars)]
+    return ["Fecha"] + names
+
+def _to_epoch(value: datetime | int | None, default: int) -> int:
+    if value is None:
+        return default
+    if isinstance(value, datetime):
+        return datetime_to_epoch(value)
+    return int(value)
+
+class SampleStore:
+    '''Operaciones comunes de los almacenamientos de muestras (ColumnStore, SQLiteStore).
+    Las subclases implementan devices, n_vars, append, append_frames, iter_range y read_frames.'''
+
+    def transaction(self):
+        '''Contexto que agrupa las escrituras de un flush, sin efecto en los almacenamientos sin transacciones'''
+        return nullcontext()
+
+    def close(self):
+        pass
+
+    def register_calibration(self, device_id, mult_offset: list[tuple[float, float]] | None) -> int:
+        '''Número con el que se guarda la calibración en las muestras, CALIBRATION_UNKNOWN si el almacenamiento no la guarda'''
+        return CALIBRATION_UNKNOWN
+
+    # Export
+
+    def export_csv(self, path: str, device_ids: Iterable | None = None,
+                   start: datetime | int | None = None, end: datetime | int | None = None):
+        '''Exporta las muestras al formato de messages_decode.csv (NaN se escribe vacío)'''
+        device_ids = list(device_ids) if device_ids is not None else self.devices()
+        n_vars = max((self.n_vars(device_id) or 0 for device_id in device_ids), default=0)
+        with open(path, 'w', newline='') as file:
+            csv_writer = csv.writer(file)
+            csv_writer.writerow(csv_header(n_vars))
+            for device_id in device_ids:
+                for (timestamps, values) in self.iter_range(device_id, start, end):
+                    for ts, row in zip(timestamps.tolist(), values.tolist()):
+                        csv_writer.writerow([epoch_to_datetime(ts)] + [None if math.isnan(value) else value for value in row])
+
+    def export_frames_csv(self, path: str, device_ids: Iterable | None = None):
+        '''Exporta las tramas al formato de datatime_compare.csv'''
+        device_ids = list(device_ids) if device_ids is not None else self.devices()
+        with open(path, 'w', newline='') as file:
+            csv_writer = csv.writer(file)
+            csv_writer.writerow(["Fecha Inicial Dato", "Fecha registro mensaje", "idMessage"])
+            for device_id in device_ids:
+                for (packet_id, initial_epoch, rx_epoch) in self.read_frames(device_id).tolist():
+                    csv_writer.writerow([epoch_to_datetime(initial_epoch), epoch_to_datetime(rx_epoch).isoformat(), packet_id])
+
+class ColumnStore(SampleStore):
+    def __init__(self, root: str = 'store'):
+        self.root = root
+        self._sorted_cache: dict[str, tuple[int, bool]] = {}
+        # versión de calibración -> posición en meta.json, por dispositivo
+        self._calibrations: dict[str, dict[str, int]] = {}
+        # packetId ordenados de frames.i64, por dispositivo
+        self._packet_ids: dict[str, np.ndarray] = {}
+
+    # Paths
+
+    def device_dir(self, device_id) -> str:
+        return os.path.join(self.root, str(device_id))
+
+    def _day_paths(self, device_id, day: date) -> tuple[str, str]:
+        base = os.path.join(self.device_dir(device_id), day.isoformat())
+        return f'{base}.ts', f'{base}.f64'
+
+    def _raw_paths(self, device_id, day: date) -> tuple[str, str]:
+        base = os.path.join(self.device_dir(device_id), day.isoformat())
+        return f'{base}.i32', f'{base}.cal'
+
+    def devices(self) -> list[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name)))
+
+    def days(self, device_id) -> list[date]:
+        directory = self.device_dir(device_id)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(date.fromisoformat(name[:-3]) for name in os.listdir(directory) if name.endswith('.ts'))
+
+    # Meta
+
+    def _read_meta(self, device_id) -> dict:
+        path = os.path.join(self.device_dir(device_id), 'meta.json')
+        if not os.path.isfile(path):
+            return {}
+        with open(path, 'r') as file:
+            return json.load(file)
+
+    def _write_meta(self, device_id, meta: dict):
+        os.makedirs(self.device_dir(device_id), exist_ok=True)
+        path = os.path.join(self.device_dir(device_id), 'meta.json')
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump(meta, file)
+        os.replace(f'{path}.tmp', path)
+
+    def n_vars(self, device_id) -> int | None:
+        return self._read_meta(device_id).get('n_vars')
+
+    def _ensure_n_vars(self, device_id, n_vars: int) -> int:
+        '''Retorna la cantidad de columnas del dispositivo, la fija con n_vars la primera vez'''
+        meta = self._read_meta(device_id)
+        current = meta.get('n_vars')
+        if current is None:
+            meta['n_vars'] = n_vars
+            self._write_meta(device_id, meta)
+            return n_vars
+        if n_vars > current:
+            raise ValueError(f'ColumnStore >> Device {device_id} stores {current} variables, received {n_vars}')
+        return current
+
+    def calibrations(self, device_id) -> list[dict]:
+        '''Calibraciones registradas del dispositivo: version, mult_offset y fecha de registro, en orden de registro'''
+        return self._read_meta(device_id).get('calibrations', [])
+
+    def register_calibration(self, device_id, mult_offset: list[tuple[float, float]] | None) -> int:
+        if mult_offset is None:
+            return CALIBRATION_UNKNOWN
+        device_id = str(device_id)
+        version = calibration_version(mult_offset)
+        cached = self._calibrations.setdefault(device_id, {})
+        if version in cached:
+            return cached[version]
+        meta = self._read_meta(device_id)
+        items = meta.setdefault('calibrations', [])
+        for (position, item) in enumerate(items):
+            cached[item['version']] = position
+        if version not in cached:
+            if len(items) >= CALIBRATION_UNKNOWN:
+                raise ValueError(f'ColumnStore >> Device {device_id} has too many calibrations')
+            items.append({'version': version, 'mult_offset': [list(pair) for pair in mult_offset],
+                          'registered': datetime.now().isoformat(timespec='seconds')})
+            self._write_meta(device_id, meta)
+            cached[version] = len(items) - 1
+        return cached[version]
+
+    # Write
+
+    def append(self, device_id, timestamps: np.ndarray, values: np.ndarray, rx_times: np.ndarray | None = None,
+               raw: np.ndarray | None = None, calibration: np.ndarray | None = None):
+        '''Agrega muestras (timestamps int64 epoch, values float64 muestras x variables) a los archivos de cada día,
+        con sus enteros crudos (raw int32) y la posición de su calibración (register_calibration) si se conocen.
+        rx_times no se guarda, los repetidos se resuelven con el SampleIndex'''
+        if len(timestamps) == 0:
+            return
+        timestamps = np.asarray(timestamps, dtype='<i8')
+        values = np.asarray(values, dtype='<f8')
+        width = self._ensure_n_vars(device_id, values.shape[1])
+        if values.shape[1] < width:
+            values = np.hstack([values, np.full((len(values), width - values.shape[1]), np.nan)])
+        raw = np.full(values.shape, RAW_MISSING, dtype='<i4') if raw is None else np.asarray(raw, dtype='<i4')
+        if raw.shape[1] < width:
+            raw = np.hstack([raw, np.full((len(raw), width - raw.shape[1]), RAW_MISSING, dtype='<i4')])
+        calibration = np.full(len(timestamps), CALIBRATION_UNKNOWN, dtype='<u2') if calibration is None else np.asarray(calibration, dtype='<u2')
+
+        day_numbers = timestamps // SECONDS_PER_DAY
+        for day_number in np.unique(day_numbers).tolist():
+            mask = day_numbers == day_number
+            day = date(1970, 1, 1) + timedelta(days=day_number)
+            (ts_path, values_path) = self._day_paths(device_id, day)
+            (raw_path, calibration_path) = self._raw_paths(device_id, day)
+            rows = os.path.getsize(ts_path) // 8 if os.path.isfile(ts_path) else 0
+            # valores primero: si se interrumpe, el lector usa las filas que tienen fecha.
+            # Cada archivo se alinea antes con las filas que tienen fecha (restos de una escritura interrumpida,
+            # o días guardados antes de los enteros crudos)
+            _append_aligned(values_path, rows * width * 8, np.ascontiguousarray(values[mask]).tobytes(), np.float64(np.nan).tobytes())
+            _append_aligned(raw_path, rows * width * 4, np.ascontiguousarray(raw[mask]).tobytes(), np.int32(RAW_MISSING).tobytes())
+            _append_aligned(calibration_path, rows * 2, calibration[mask].tobytes(), np.uint16(CALIBRATION_UNKNOWN).tobytes())
+            with open(ts_path, 'ab') as file:
+                file.write(timestamps[mask].tobytes())
+
+    def _known_packet_ids(self, device_id: str) -> np.ndarray:
+        packet_ids = self._packet_ids.get(device_id)
+        if packet_ids is None:
+            packet_ids = np.unique(self.read_frames(device_id)[:, 0])
+            self._packet_ids[device_id] = packet_ids
+        return packet_ids
+
+    def append_frames(self, device_id, frames: np.ndarray):
+        '''Agrega filas (packetId, fecha inicial epoch, hiveRxTime epoch) al registro de tramas.
+        Las tramas con un packetId ya guardado se descartan (igual que la clave única del SQLiteStore)'''
+        if len(frames) == 0:
+            return
+        device_id = str(device_id)
+        frames = np.asarray(frames, dtype='<i8').reshape(-1, 3)
+        known = self._known_packet_ids(device_id)
+        # primera aparición de cada packetId del bloque, en el orden de llegada
+        (_, first) = np.unique(frames[:, 0], return_index=True)
+        frames = frames[np.sort(first)]
+        frames = frames[~np.isin(frames[:, 0], known)]
+        if len(frames) == 0:
+            return
+        os.makedirs(self.device_dir(device_id), exist_ok=True)
+        with open(os.path.join(self.device_dir(device_id), 'frames.i64'), 'ab') as file:
+            file.write(np.ascontiguousarray(frames).tobytes())
+        self._packet_ids[device_id] = np.union1d(known, frames[:, 0])
+
+    # Read
+
+    def _open_day(self, device_id, day: date) -> tuple[np.ndarray, np.ndarray]:
+        (ts_path, values_path) = self._day_paths(device_id, day)
+        width = self.n_vars(device_id) or 1
+        timestamps = np.memmap(ts_path, dtype='<i8', mode='r') if os.path.getsize(ts_path) > 0 else np.empty(0, dtype='<i8')
+        values = np.memmap(values_path, dtype='<f8', mode='r') if os.path.getsize(values_path) > 0 else np.empty(0, dtype='<f8')
+        rows = min(len(timestamps), len(values) // width)
+        return timestamps[:rows], values[:rows * width].reshape(rows, width)
+
+    def _is_sorted(self, path: str, timestamps: np.ndarray) -> bool:
+        '''Revisa si el día está ordenado y sin repetidos, el resultado se guarda mientras el archivo no cambie de tamaño'''
+        size = os.path.getsize(path)
+        cached = self._sorted_cache.get(path)
+        if cached is not None and cached[0] == size:
+            return cached[1]
+        result = bool(np.all(timestamps[1:] > timestamps[:-1]))
+        self._sorted_cache[path] = (size, result)
+        return result
+
+    def _open_raw(self, device_id, day: date, rows: int) -> tuple[np.ndarray, np.ndarray]:
+        '''Enteros crudos y calibración de las rows filas del día. Las filas sin enteros (días guardados antes
+        de los enteros crudos) se completan con RAW_MISSING y CALIBRATION_UNKNOWN'''
+        (raw_path, calibration_path) = self._raw_paths(device_id, day)
+        width = self.n_vars(device_id) or 1
+        raw = np.full((rows, width), RAW_MISSING, dtype=np.int32)
+        calibration = np.full(rows, CALIBRATION_UNKNOWN, dtype=np.uint16)
+        if os.path.isfile(raw_path) and os.path.isfile(calibration_path):
+            stored = np.fromfile(raw_path, dtype='<i4')
+            stored_calibration = np.fromfile(calibration_path, dtype='<u2')
+            available = min(rows, len(stored) // width, len(stored_calibration))
+            raw[:available] = stored[:available * width].reshape(available, width)
+            calibration[:available] = stored_calibration[:available]
+        return raw, calibration
+
+    def _day_rows(self, device_id, day: date, timestamps: np.ndarray, start_epoch: int, end_epoch: int) -> slice | np.ndarray:
+        '''Filas del día en [start, end) en orden de fecha. En días ordenados es un slice (vista sin copia),
+        si no un arreglo de posiciones donde con timestamps repetidos queda el último agregado'''
+        if self._is_sorted(self._day_paths(device_id, day)[0], timestamps):
+            first = int(np.searchsorted(timestamps, start_epoch, side='left'))
+            last = int(np.searchsorted(timestamps, end_epoch, side='left'))
+            return slice(first, last)
+        positions = np.flatnonzero((timestamps >= start_epoch) & (timestamps < end_epoch))
+        positions = positions[np.argsort(np.asarray(timestamps[positions]), kind='stable')]
+        selected = np.asarray(timestamps[positions])
+        return positions[np.append(selected[1:] != selected[:-1], True)]
+
+    def _iter_days(self, device_id, start: datetime | int | None, end: datetime | int | None) -> Iterator[tuple[date, int, int]]:
+        start_epoch = _to_epoch(start, -2 ** 62)
+        end_epoch = _to_epoch(end, 2 ** 62)
+        for day in self.days(device_id):
+            day_start = datetime_to_epoch(datetime.combine(day, datetime.min.time()))
+            if day_start + SECONDS_PER_DAY <= start_epoch or day_start >= end_epoch:
+                continue
+            yield day, start_epoch, end_epoch
+
+    def iter_range(self, device_id, start: datetime | int | None = None, end: datetime | int | None = None) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        '''Retorna por día (timestamps, values) con las muestras en [start, end).
+        En días ordenados son vistas del memory map, sin copia.'''
+        for (day, start_epoch, end_epoch) in self._iter_days(device_id, start, end):
+            (timestamps, values) = self._open_day(device_id, day)
+            if len(timestamps) == 0:
+                continue
+            rows = self._day_rows(device_id, day, timestamps, start_epoch, end_epoch)
+            yield timestamps[rows], values[rows]
+
+    def iter_raw_range(self, device_id, start: datetime | int | None = None, end: datetime | int | None = None) -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        '''Retorna por día (timestamps, raw int32, calibración uint16) con las muestras en [start, end).
+        Las posiciones de calibración corresponden a la lista de calibrations(device_id)'''
+        for (day, start_epoch, end_epoch) in self._iter_days(device_id, start, end):
+            (timestamps, _) = self._open_day(device_id, day)
+            if len(timestamps) == 0:
+                continue
+            (raw, calibration) = self._open_raw(device_id, day, len(timestamps))
+            rows = self._day_rows(device_id, day, timestamps, start_epoch, end_epoch)
+            yield timestamps[rows], raw[rows], calibration[rows]
+
+    # Recalibration
+
+    def recalibrate(self, device_id, mult_offset: list[tuple[float, float]], round_digits: int | None = None) -> tuple[int, int]:
+        '''Calcula de nuevo los valores de todo el historial del dispositivo con mult_offset desde los enteros crudos,
+        en una sola pasada vectorizada, y marca esas muestras con la nueva calibración.
+        Las muestras sin enteros crudos conservan sus valores. Retorna (muestras recalibradas, muestras sin enteros)'''
+        if round_digits is None:
+            round_digits = app_config.ROUND_DIGITS
+        position = self.register_calibration(device_id, mult_offset)
+        days = []
+        for day in self.days(device_id):
+            (timestamps, values) = self._open_day(device_id, day)
+            (raw, calibration) = self._open_raw(device_id, day, len(timestamps))
+            days.append((day, np.array(values), raw, calibration, calibration != CALIBRATION_UNKNOWN))
+        if len(days) == 0:
+            return 0, 0
+
+        known = np.concatenate([day_known for (_, _, _, _, day_known) in days])
+        measures = calibrate(np.concatenate([raw[day_known] for (_, _, raw, _, day_known) in days]), mult_offset, round_digits)
+        row = 0
+        for (day, values, _, calibration, day_known) in days:
+            count = int(day_known.sum())
+            values[day_known] = measures[row:row + count]
+            calibration[day_known] = position
+            row += count
+            (_, values_path) = self._day_paths(device_id, day)
+            (_, calibration_path) = self._raw_paths(device_id, day)
+            _replace_file(values_path, values.astype('<f8').tobytes())
+            _replace_file(calibration_path, calibration.astype('<u2').tobytes())
+        return int(known.sum()), int((~known).sum())
+
+    def read_range(self, device_id, start: datetime | int | None = None, end: datetime | int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        '''Igual que iter_range pero une los días en un solo par de arreglos'''
+        parts = list(self.iter_range(device_id, start, end))
+        width = self.n_vars(device_id) or 0
+        if len(parts) == 0:
+            return np.empty(0, dtype=np.int64), np.empty((0, width), dtype=np.float64)
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+    def read_frames(self, device_id) -> np.ndarray:
+        '''Retorna la matriz (packetId, fecha inicial, hiveRxTime) de las tramas guardadas'''
+        path = os.path.join(self.device_dir(device_id), 'frames.i64')
+        if not os.path.isfile(path) or os.path.getsize(path) == 0:
+            return np.empty((0, 3), dtype=np.int64)
+        frames = np.memmap(path, dtype='<i8', mode='r')
+        return frames[:len(frames) // 3 * 3].reshape(-1, 3)
+
+def _append_aligned(path: str, size: int, data: bytes, fill: bytes):
+    '''Agrega data al archivo después de dejarlo en size bytes: recorta un resto de una escritura interrumpida
+    o completa con fill las filas que no tienen valor'''
+    with open(path, 'ab') as file:
+        current = file.tell()
+        if current > size:
+            file.truncate(size)
+        elif current < size:
+            file.write(fill * ((size - current) // len(fill)))
+        file.write(data)
+
+def _replace_file(path: str, data: bytes):
+    '''Reemplaza el archivo completo (archivo temporal + os.replace)'''
+    with open(f'{path}.tmp', 'wb') as file:
+        file.write(data)
+    os.replace(f'{path}.tmp', path)
+
+class ColumnStoreWriter:
+    '''Acumula los mensajes decodificados en memoria y los agrega al ColumnStore cada flush_rows muestras'''
+
+    def __init__(self, store: SampleStore, index: SampleIndex | None = None, flush_rows: int = 50000, rollup=None, coverage=None,
+                 quarantine: Quarantine | None = None):
+        '''Con index solo se agregan las muestras que el índice no tenía (o que reemplaza según su política).
+        Con rollup (RollupStore) se actualizan los agregados de las horas escritas en cada flush y con
+        coverage (CoverageIndex) los intervalos cubiertos por las tramas escritas.
+        Las tramas con más variables que las guardadas del dispositivo no se escriben, van a quarantine'''
+        self.store = store
+        self.index = index
+        self.rollup = rollup
+        self.coverage = coverage
+        self.quarantine = quarantine
+        self.flush_rows = flush_rows
+        self.count = 0
+        self.device_ids: set[str] = set()
+        # bloques (timestamps, hiveRxTime, valores, enteros crudos, calibración) por dispositivo
+        self._samples: dict[str, list[tuple[np.ndarray, int, np.ndarray, np.ndarray | None, list | None]]] = {}
+        self._frames: dict[str, list[tuple[int, int, int]]] = {}
+        # (inicio, fin, segundos entre muestras, demora de llegada) de cada trama por dispositivo
+        self._spans: dict[str, list[tuple[int, int, int, int]]] = {}
+        self._pending = 0
+        # variables guardadas por dispositivo (None si aún no tiene), se lee una vez del almacenamiento
+        self._stored_n_vars: dict[str, int | None] = {}
+
+    def write(self, message: MessageEncodeModel):
+        device_id = str(message.device_id)
+        if not self._accepts(device_id, message):
+            return
+        rx_epoch = 0
+        if message.hiveRxTime is not None:
+            rx_epoch = datetime_to_epoch(parse_hive_time(message.hiveRxTime).replace(tzinfo=None))
+        if message.batch is not None:
+            # mensaje asociado a un lote: se copian las filas de la trama sin crear objetos por muestra
+            batch = message.batch
+            rows = batch.frame_rows(message.frame)
+            timestamps = batch.timestamps[rows]
+            values = batch.values[rows, :int(batch.n_vars[message.frame])]
+            raw = batch.raw[rows, :int(batch.n_vars[message.frame])] if batch.raw is not None else None
+            mult_offset = batch.mult_offset
+            step = int(batch.intervals[message.frame])
+        else:
+            # sin lote no se conocen los enteros crudos ni la calibración
+            (raw, mult_offset) = (None, None)
+            step = int(message.minutes or 0) * 60
+            message_values = message.message_values
+            width = max((len(value.values) for value in message_values), default=0)
+            timestamps = np.array([datetime_to_epoch(value.date) for value in message_values], dtype=np.int64)
+            values = np.full((len(message_values), width), np.nan, dtype=np.float64)
+            for row, value in enumerate(message_values):
+                values[row, :len(value.values)] = [np.nan if item is None else item for item in value.values]
+        if len(timestamps) > 0:
+            self._samples.setdefault(device_id, []).append((timestamps, rx_epoch, values, raw, mult_offset))
+            if self.coverage is not None:
+                lag = rx_epoch - int(timestamps[-1]) if rx_epoch > 0 else 0
+                self._spans.setdefault(device_id, []).append((int(timestamps[0]), int(timestamps[-1]) + max(step, 1), step, lag))
+        if message.initial_date is not None and message.hiveRxTime is not None:
+            initial_epoch = datetime_to_epoch(message.initial_date)
+            self._frames.setdefault(device_id, []).append((message.id, initial_epoch, rx_epoch))
+            metrics.observe('ingest_lag_seconds', rx_epoch - initial_epoch, metrics.LAG_BUCKETS, device=device_id)
+        self.device_ids.add(device_id)
+        self.count += 1
+        self._pending += len(timestamps)
+        if self._pending >= self.flush_rows:
+            self.flush()
+
+    def _accepts(self, device_id: str, message: MessageEncodeModel) -> bool:
+        '''False (y la trama en quarantine) si tiene más variables que las guardadas del dispositivo'''
+        if device_id not in self._stored_n_vars:
+            self._stored_n_vars[device_id] = self.store.n_vars(device_id)
+        stored = self._stored_n_vars[device_id]
+        n_vars = int(message.batch.n_vars[message.frame]) if message.batch is not None else \
+            max((len(value.values) for value in message.message_values), default=0)
+        if stored is None or n_vars <= stored:
+            return True
+        error = ValueError(f'ColumnStoreWriter >> Device {device_id} stores {stored} variables, received {n_vars}')
+        if self.quarantine is None:
+            logger.error('Packet %s skipped: %s', message.id, error)
+        else:
+            self.quarantine.add({'packetId': message.id, 'deviceId': message.device_id, 'hiveRxTime': message.hiveRxTime,
+                                 'payload': message.data}, message.device_name, STAGE_STORE, error)
+        return False
+
+    def flush(self):
+        with metrics.timer('store_write_seconds'):
+            self._flush()
+
+    def _flush(self):
+        with self.store.transaction():
+            updates = self._write_blocks()
+        # el índice se actualiza al confirmar la escritura: si falla, el siguiente flush no toma las muestras por repetidas
+        for (device_id, device_updates) in updates:
+            self.index.commit(device_id, device_updates)
+        # los dispositivos nuevos quedan con las variables fijadas por esta escritura
+        for device_id in [key for (key, value) in self._stored_n_vars.items() if value is None]:
+            del self._stored_n_vars[device_id]
+        self._samples.clear()
+        self._frames.clear()
+        self._spans.clear()
+        self._pending = 0
+
+    def _write_blocks(self) -> list[tuple[str, dict]]:
+        '''Escribe los bloques pendientes y retorna los cambios del índice, que se aplican después de la transacción'''
+        updates = []
+        for device_id, blocks in self._samples.items():
+            if len(blocks) == 0:
+                continue
+            width = max(block_values.shape[1] for (_, _, block_values, _, _) in blocks)
+            lengths = [len(block_timestamps) for (block_timestamps, _, _, _, _) in blocks]
+            timestamps = np.concatenate([block_timestamps for (block_timestamps, _, _, _, _) in blocks])
+            values = np.full((len(timestamps), width), np.nan, dtype=np.float64)
+            raw = np.full((len(timestamps), width), RAW_MISSING, dtype=np.int32)
+            row = 0
+            for (_, _, block_values, block_raw, _) in blocks:
+                values[row:row + len(block_values), :block_values.shape[1]] = block_values
+                if block_raw is not None:
+                    raw[row:row + len(block_raw), :block_raw.shape[1]] = block_raw
+                row += len(block_values)
+            rx_times = np.repeat(np.array([rx for (_, rx, _, _, _) in blocks], dtype=np.int64), lengths)
+            calibration = np.repeat(np.array([self.store.register_calibration(device_id, mult_offset)
+                                              for (_, _, _, _, mult_offset) in blocks], dtype=np.uint16), lengths)
+            if self.index is not None:
+                (emit, device_updates) = self.index.prepare(device_id, timestamps, rx_times, values)
+                updates.append((device_id, device_updates))
+                metrics.incr('samples_duplicated_total', len(emit) - int(emit.sum()))
+                (timestamps, values, rx_times, raw, calibration) = (timestamps[emit], values[emit], rx_times[emit], raw[emit], calibration[emit])
+            self.store.append(device_id, timestamps, values, rx_times, raw, calibration)
+            if self.rollup is not None:
+                self.rollup.update(device_id, timestamps)
+            metrics.incr('samples_written_total', len(timestamps))
+        for device_id, frames in self._frames.items():
+            self.store.append_frames(device_id, np.array(frames, dtype=np.int64).reshape(-1, 3))
+        for device_id, spans in self._spans.items():
+            (starts, ends, steps, lags) = np.array(spans, dtype=np.int64).reshape(-1, 4).T
+            steps = steps[steps > 0]
+            self.coverage.add(device_id, starts, ends, int(steps.min()) if len(steps) > 0 else 0, int(lags.max()))
+        return updates
+
+    def close(self):
+        self.flush()
+        if self.index is not None:
+            self.index.save()
+        if self.rollup is not None:
+            self.rollup.save()
+        if self.coverage is not None:
+            self.coverage.save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
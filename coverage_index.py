@@ -0,0 +1,234 @@
+'''
+Índice de cobertura: intervalos [inicio, fin) de muestras recibidas por dispositivo, para encontrar los huecos
+que dejan las tramas perdidas y volver a pedir al servicio solo esos rangos.
+
+    {root}/{device_id}/coverage.npz     starts, ends (epoch) ordenados y sin superponerse, step (segundos entre muestras)
+                                        y lag (mayor demora observada entre la última muestra de una trama y su hiveRxTime)
+
+Cada trama cubre [fecha inicial, última muestra + minutos), los intervalos que se tocan o superponen se unen.
+Los huecos más cortos que step (desfase del reloj entre tramas) no se consideran.
+plan_refetch convierte los huecos en peticiones startDate/endDate/deviceid por hiveRxTime: la trama perdida
+llegó al servicio después de su primera muestra y a lo sumo refetch_lag segundos (o el lag observado, si es mayor)
+después de la última.
+
+    python coverage_index.py --device 13025 --start 2024-04-01 --end 2024-05-01     # huecos y peticiones
+    python coverage_index.py --rebuild                                             # desde las muestras guardadas
+    python main.py --refetch-gaps --start 2024-04-01 --end 2024-05-01        # pide y guarda los huecos
+'''
+
+import argparse
+import os
+import sys
+
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+
+import numpy as np
+
+import app_config
+
+from column_store import SampleStore, _to_epoch
+
+from models.decoded_batch_model import epoch_to_datetime
+
+logger = app_config.CustomLogger('coverage')
+
+# Ventana máxima de una petición al servicio (swarm_fetch.MAX_WINDOW, sin importar el cliente HTTP)
+MAX_WINDOW = timedelta(days=30)
+
+class RefetchRequest(NamedTuple):
+    start_date: datetime
+    end_date: datetime
+    device_id: str
+
+def merge_intervals(starts: np.ndarray, ends: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    '''Ordena y une los intervalos [start, end) que se superponen o se tocan'''
+    if len(starts) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    order = np.argsort(starts, kind='stable')
+    starts = np.asarray(starts, dtype=np.int64)[order]
+    ends = np.maximum.accumulate(np.asarray(ends, dtype=np.int64)[order])
+    # empieza un intervalo nuevo donde el inicio queda después de todo lo anterior
+    first = np.flatnonzero(np.append(True, starts[1:] > ends[:-1]))
+    return starts[first], np.maximum.reduceat(ends, first)
+
+class CoverageIndex:
+    def __init__(self, root: str = 'store'):
+        self.root = root
+        self._devices: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        self._steps: dict[str, int] = {}
+        self._lags: dict[str, int] = {}
+        self._dirty: set[str] = set()
+
+    def _path(self, device_id: str) -> str:
+        return os.path.join(self.root, device_id, 'coverage.npz')
+
+    def devices(self) -> list[str]:
+        if not os.path.isdir(self.root):
+            return sorted(self._devices)
+        stored = {name for name in os.listdir(self.root) if os.path.isfile(self._path(name))}
+        return sorted(stored | set(self._devices))
+
+    def intervals(self, device_id) -> tuple[np.ndarray, np.ndarray]:
+        '''Inicios y fines (epoch) de los intervalos cubiertos, ordenados'''
+        device_id = str(device_id)
+        intervals = self._devices.get(device_id)
+        if intervals is not None:
+            return intervals
+        path = self._path(device_id)
+        if os.path.isfile(path):
+            with np.load(path) as data:
+                intervals = (data['starts'], data['ends'])
+                if int(data['step']) > 0:
+                    self._steps[device_id] = int(data['step'])
+                self._lags[device_id] = int(data['lag'])
+        else:
+            intervals = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        self._devices[device_id] = intervals
+        return intervals
+
+    def step(self, device_id) -> int:
+        '''Segundos entre muestras del dispositivo (el menor observado), 0 si no se conoce'''
+        self.intervals(device_id)
+        return self._steps.get(str(device_id), 0)
+
+    def lag(self, device_id) -> int:
+        '''Mayor demora observada (segundos) entre la última muestra de una trama y su llegada al servicio'''
+        self.intervals(device_id)
+        return self._lags.get(str(device_id), 0)
+
+    # Update
+
+    def add(self, device_id, starts: np.ndarray, ends: np.ndarray, step: int = 0, lag: int = 0):
+        '''Agrega los intervalos [start, end) de muestras recibidas. step son los segundos entre muestras
+        y lag la mayor demora de llegada de esas tramas'''
+        if len(starts) == 0:
+            return
+        device_id = str(device_id)
+        (current_starts, current_ends) = self.intervals(device_id)
+        self._devices[device_id] = merge_intervals(np.concatenate([current_starts, starts]), np.concatenate([current_ends, ends]))
+        if step > 0:
+            self._steps[device_id] = min(step, self._steps.get(device_id, step))
+        self._lags[device_id] = max(lag, self._lags.get(device_id, 0))
+        self._dirty.add(device_id)
+
+    def rebuild(self, store: SampleStore, device_id, step: int | None = None):
+        '''Recalcula la cobertura desde las muestras de store. Sin step se usa la diferencia más común entre muestras.
+        El lag observado se conserva'''
+        device_id = str(device_id)
+        (timestamps, _) = store.read_range(device_id)
+        timestamps = np.unique(np.asarray(timestamps, dtype=np.int64))
+        differences = np.diff(timestamps)
+        if step is None:
+            positive = differences[differences > 0]
+            step = int(np.bincount(positive).argmax()) if len(positive) > 0 else 0
+        self._steps.pop(device_id, None)
+        if step > 0:
+            self._steps[device_id] = step
+        self._dirty.add(device_id)
+        if len(timestamps) == 0:
+            self._devices[device_id] = (timestamps, timestamps)
+            return
+        # un intervalo termina donde la siguiente muestra llega más de un step después
+        breaks = np.flatnonzero(differences > step)
+        self._devices[device_id] = (timestamps[np.append(0, breaks + 1)],
+                                    timestamps[np.append(breaks, len(timestamps) - 1)] + max(step, 1))
+
+    def save(self):
+        '''Guarda los dispositivos modificados'''
+        for device_id in self._dirty:
+            (starts, ends) = self._devices[device_id]
+            os.makedirs(os.path.join(self.root, device_id), exist_ok=True)
+            temp_path = self._path(device_id) + '.tmp.npz'
+            np.savez(temp_path, starts=starts, ends=ends, step=np.int64(self._steps.get(device_id, 0)),
+                     lag=np.int64(self._lags.get(device_id, 0)))
+            os.replace(temp_path, self._path(device_id))
+        self._dirty.clear()
+
+    # Query
+
+    def gaps(self, device_id, start: datetime | int | None = None, end: datetime | int | None = None,
+             min_gap: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        '''Huecos [start, end) sin muestras dentro del rango (por defecto entre la primera y la última muestra).
+        Se descartan los huecos más cortos que min_gap (por defecto step)'''
+        (starts, ends) = self.intervals(device_id)
+        if len(starts) == 0:
+            if start is None or end is None:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+            return np.array([_to_epoch(start, 0)], dtype=np.int64), np.array([_to_epoch(end, 0)], dtype=np.int64)
+        low = _to_epoch(start, int(starts[0]))
+        high = _to_epoch(end, int(ends[-1]))
+        gap_starts = np.maximum(np.append(low, ends), low)
+        gap_ends = np.minimum(np.append(starts, high), high)
+        min_gap = max(self.step(device_id) if min_gap is None else min_gap, 1)
+        keep = gap_ends - gap_starts >= min_gap
+        return gap_starts[keep], gap_ends[keep]
+
+    def missing_samples(self, device_id, start: datetime | int | None = None, end: datetime | int | None = None) -> int:
+        '''Muestras esperadas en los huecos del rango según step (0 si no se conoce step)'''
+        step = self.step(device_id)
+        if step == 0:
+            return 0
+        (gap_starts, gap_ends) = self.gaps(device_id, start, end)
+        return int(((gap_ends - gap_starts) // step).sum())
+
+def plan_refetch(coverage: CoverageIndex,
+                 device_ids: list[str] | None = None,
+                 start: datetime | int | None = None,
+                 end: datetime | int | None = None,
+                 refetch_lag: float | None = None,
+                 merge_gap: float | None = None,
+                 max_window: timedelta = MAX_WINDOW) -> list[RefetchRequest]:
+    '''Peticiones (por hiveRxTime) que cubren los huecos de cada dispositivo: cada hueco [inicio, fin) se pide
+    como [inicio, fin + lag) con el mayor entre refetch_lag y el lag observado, las peticiones a menos de
+    merge_gap segundos se unen en una y las más largas que max_window se dividen'''
+    if refetch_lag is None:
+        refetch_lag = app_config.REFETCH_LAG
+    if merge_gap is None:
+        merge_gap = app_config.REFETCH_MERGE_GAP
+    requests: list[RefetchRequest] = []
+    window = int(max_window.total_seconds())
+    for device_id in (device_ids or coverage.devices()):
+        (gap_starts, gap_ends) = coverage.gaps(device_id, start, end)
+        if len(gap_starts) == 0:
+            continue
+        lag = max(int(refetch_lag), coverage.lag(device_id))
+        (request_starts, request_ends) = merge_intervals(gap_starts, gap_ends + lag + int(merge_gap))
+        request_ends = request_ends - int(merge_gap)
+        for (request_start, request_end) in zip(request_starts.tolist(), request_ends.tolist()):
+            for window_start in range(request_start, request_end, window):
+                # las fechas epoch son UTC (hiveRxTime), con zona para que el cliente no las tome como locales
+                requests.append(RefetchRequest(epoch_to_datetime(window_start).replace(tzinfo=timezone.utc),
+                                               epoch_to_datetime(min(window_start + window, request_end)).replace(tzinfo=timezone.utc),
+                                               str(device_id)))
+    return requests
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Huecos de las muestras recibidas y peticiones para completarlos')
+    parser.add_argument('--store', default='store', help='directorio del almacenamiento columnar y de la cobertura')
+    parser.add_argument('--device', action='append', dest='devices', help='deviceId, se puede repetir (por defecto todos)')
+    parser.add_argument('--rebuild', action='store_true', help='recalcular la cobertura desde las muestras guardadas')
+    parser.add_argument('--step', type=int, help='segundos entre muestras al recalcular (por defecto el más común)')
+    parser.add_argument('--start', type=datetime.fromisoformat, help='fecha inicial (ISO 8601, por defecto la primera muestra)')
+    parser.add_argument('--end', type=datetime.fromisoformat, help='fecha final (ISO 8601, por defecto la última muestra)')
+    args = parser.parse_args(argv)
+
+    coverage = CoverageIndex(args.store)
+    if args.rebuild:
+        from column_store import ColumnStore
+        store = ColumnStore(args.store)
+        for device_id in (args.devices or store.devices()):
+            coverage.rebuild(store, device_id, args.step)
+        coverage.save()
+
+    devices = args.devices or coverage.devices()
+    for device_id in devices:
+        (gap_starts, gap_ends) = coverage.gaps(device_id, args.start, args.end)
+        print(f'{device_id}: {len(gap_starts)} huecos, {coverage.missing_samples(device_id, args.start, args.end)} muestras faltantes')
+        for (gap_start, gap_end) in zip(gap_starts.tolist(), gap_ends.tolist()):
+            print(f'    {epoch_to_datetime(gap_start)} - {epoch_to_datetime(gap_end)}')
+    for request in plan_refetch(coverage, devices, args.start, args.end):
+        print(f'startDate={request.start_date.isoformat()} endDate={request.end_date.isoformat()} deviceid={request.device_id}')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
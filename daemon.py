@@ -0,0 +1,139 @@
+'''
+Modo servicio: consulta al servicio cada poll_interval segundos y agrega al almacenamiento solo los paquetes nuevos.
+
+    python main.py --daemon --interval 300
+
+Entre consultas se mantienen la sesión y el token del cliente, el registro de dispositivos y la calibración
+(device_config se recarga sola cuando cambia un archivo de devices/). La marca de sincronización se guarda
+después de escribir cada consulta en el almacenamiento, así una caída nunca pierde paquetes.
+SIGINT/SIGTERM terminan la consulta en curso, escriben lo pendiente y cierran el proceso.
+'''
+
+import gc
+import signal
+import threading
+import time
+
+from datetime import datetime
+
+import app_config
+import metrics
+import vital_sensor_decode
+
+from column_store import ColumnStoreWriter, SampleStore
+from device_registry import DeviceRegistry
+from sample_index import SampleIndex
+from sync_state import SyncState
+
+logger = app_config.CustomLogger('daemon')
+
+class IngestDaemon:
+    '''Un ciclo (tick) pide los mensajes desde la marca de state, los decodifica, los escribe en store y avanza la marca.
+    index_days limita las muestras que el índice de repetidos mantiene en memoria (sin index, store resuelve los repetidos).
+    Con device_ids se consulta cada dispositivo desde su propia marca, sin ellos todos desde la menor marca.
+    Con rollup (RollupStore) se actualizan los agregados en cada escritura, con archive (FrameArchive) se guardan
+    los paquetes recibidos y con coverage (CoverageIndex) los intervalos cubiertos.'''
+
+    def __init__(self,
+                 store: SampleStore,
+                 index: SampleIndex | None = None,
+                 state_path: str = 'sync_state.json',
+                 start_date: datetime | None = None,
+                 poll_interval: float | None = None,
+                 index_days: float | None = None,
+                 workers: int = 1,
+                 device_ids: list[str] | None = None,
+                 client=None,
+                 rollup=None,
+                 archive=None,
+                 coverage=None):
+        import swarm_provider
+
+        if poll_interval is None:
+            poll_interval = app_config.DAEMON_POLL_INTERVAL
+        if index_days is None:
+            index_days = app_config.DAEMON_INDEX_DAYS
+        if poll_interval <= 0:
+            raise ValueError(f'IngestDaemon >> poll_interval must be positive, received {poll_interval}')
+        self.start_date = start_date
+        self.poll_interval = poll_interval
+        self.index_days = index_days
+        self.workers = workers
+        self.device_ids = device_ids
+        self.client = client or swarm_provider.get_client()
+        self.registry = DeviceRegistry(self.client)
+        self.state = SyncState(state_path)
+        self.store = store
+        self.index = index
+        self.rollup = rollup
+        self.archive = archive
+        self.coverage = coverage
+        self.stop_event = threading.Event()
+        self.ticks = 0
+
+    def stop(self, signum=None, frame=None):
+        '''Pide terminar después de la consulta en curso (se usa también como manejador de señales)'''
+        if signum is not None:
+            logger.info('Signal %s received, stopping', signum)
+        self.stop_event.set()
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+    def tick(self) -> int:
+        '''Procesa los mensajes nuevos y retorna la cantidad de mensajes escritos'''
+        with metrics.timer('daemon_tick_seconds'):
+            raw_messages = [message for device_id in (self.device_ids or [None])
+                            for message in vital_sensor_decode.fetch_new_messages(self.state, self.start_date, device_id, self.client)]
+            if len(raw_messages) == 0:
+                return 0
+            messages = vital_sensor_decode.decode_messages(raw_messages, self.registry, workers=self.workers, archive=self.archive)
+            writer = ColumnStoreWriter(self.store, self.index, rollup=self.rollup, coverage=self.coverage,
+                                       quarantine=vital_sensor_decode.quarantine)
+            for message in messages:
+                writer.write(message)
+            # primero el almacenamiento y el índice, después la marca
+            writer.close()
+            vital_sensor_decode.commit_messages(self.state, raw_messages)
+        if self.index is not None and self.index_days > 0:
+            removed = self.index.prune(int(time.time() - self.index_days * 86400))
+            if removed > 0:
+                self.index.save()
+        metrics.incr('daemon_messages_total', writer.count)
+        return writer.count
+
+    def run(self):
+        '''Repite tick hasta recibir stop(). Un error en una consulta se registra y se reintenta en la siguiente'''
+        logger.info('Daemon started, poll interval %s s', self.poll_interval)
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    count = self.tick()
+                    logger.info('Tick %s: %s new messages', self.ticks, count)
+                except Exception as e:
+                    metrics.incr('daemon_tick_errors_total')
+                    logger.error('Tick %s failed: %s', self.ticks, e)
+                self.ticks += 1
+                metrics.incr('daemon_ticks_total')
+                self._export_metrics()
+                # los mensajes de la consulta ya no se usan, se liberan antes de esperar
+                gc.collect()
+                self.stop_event.wait(self.poll_interval)
+        finally:
+            self.close()
+
+    def _export_metrics(self):
+        try:
+            metrics.export()
+        except OSError as e:
+            logger.error('Metrics could not be exported: %s', e)
+
+    def close(self):
+        if self.index is not None:
+            self.index.save()
+        self.state.save()
+        self.store.close()
+        self._export_metrics()
+        self.client.close()
+        logger.info('Daemon stopped after %s ticks', self.ticks)
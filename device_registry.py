@@ -0,0 +1,112 @@
+'''
+Registro de dispositivos indexado por deviceId y por nombre, con caché en disco
+'''
+
+import json
+import os
+import time
+
+import app_config
+
+from models.device_model import DeviceModel
+
+logger = app_config.CustomLogger('device_registry')
+
+class DeviceRegistry:
+    '''Lista de dispositivos con búsqueda O(1) por deviceId y por nombre sin prefijo.
+    La lista se guarda en cache_path y solo se vuelve a pedir al servicio cuando la caché tiene más de ttl
+    segundos o llega un deviceId desconocido (como máximo una vez cada min_refresh_interval segundos).'''
+
+    def __init__(self, client=None,
+                 cache_path: str | None = None,
+                 ttl: float | None = None,
+                 min_refresh_interval: float = 300):
+        self.client = client
+        self.cache_path = app_config.API_DEVICE_CACHE if cache_path is None else cache_path
+        self.ttl = app_config.API_DEVICE_CACHE_TTL if ttl is None else ttl
+        self.min_refresh_interval = min_refresh_interval
+        self._devices: list[DeviceModel] = []
+        self.by_id: dict = {}
+        self.by_name: dict[str, DeviceModel] = {}
+        self.updated_at = 0.0
+        self._last_refresh = 0.0
+        self._load_cache()
+
+    @classmethod
+    def from_devices(cls, devices: list[DeviceModel]) -> 'DeviceRegistry':
+        '''Registro en memoria (sin caché ni servicio) a partir de una lista de dispositivos'''
+        registry = cls(cache_path='')
+        registry._index(devices)
+        registry.updated_at = time.time()
+        return registry
+
+    def _index(self, devices: list[DeviceModel]):
+        self._devices = list(devices)
+        self.by_id = {}
+        self.by_name = {}
+        for device in devices:
+            self.by_id[device.deviceId] = device
+            self.by_id[str(device.deviceId)] = device
+            self.by_name[device.get_device_name_without_prefix()] = device
+
+    def _load_cache(self):
+        if not self.cache_path or not os.path.isfile(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r') as file:
+                data = json.load(file)
+            self._index([DeviceModel(**item) for item in data['devices']])
+            self.updated_at = float(data['updated_at'])
+        except Exception as e:
+            logger.warning('Device cache "%s" could not be read: %s', self.cache_path, e)
+
+    def _save_cache(self, devices: list[DeviceModel]):
+        if not self.cache_path:
+            return
+        temp_path = f'{self.cache_path}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({'updated_at': self.updated_at, 'devices': [device.to_dict() for device in devices]}, file)
+        os.replace(temp_path, self.cache_path)
+
+    def is_stale(self) -> bool:
+        return time.time() - self.updated_at > self.ttl
+
+    def refresh(self):
+        '''Pide la lista de dispositivos al servicio y actualiza la caché'''
+        if self.client is None:
+            return
+        self._last_refresh = time.time()
+        devices = self.client.get_devices()
+        self._index(devices)
+        self.updated_at = time.time()
+        self._save_cache(devices)
+        logger.info('Device registry refreshed devices=%s', len(devices))
+
+    def ensure_fresh(self):
+        if self.is_stale():
+            self.refresh()
+
+    def devices(self) -> list[DeviceModel]:
+        self.ensure_fresh()
+        return list(self._devices)
+
+    def get(self, device_id) -> DeviceModel | None:
+        '''Retorna el dispositivo por deviceId. Un id desconocido provoca una actualización de la lista'''
+        self.ensure_fresh()
+        device = self.by_id.get(device_id)
+        if device is None and self.client is not None and time.time() - self._last_refresh > self.min_refresh_interval:
+            self.refresh()
+            device = self.by_id.get(device_id)
+        return device
+
+    def get_by_name(self, device_name: str) -> DeviceModel | None:
+        self.ensure_fresh()
+        return self.by_name.get(device_name)
+
+    def device_name(self, device_id) -> str | None:
+        '''Nombre sin prefijo F-0x del dispositivo, None si no existe'''
+        device = self.get(device_id)
+        return None if device is None else device.get_device_name_without_prefix()
+
+    def __len__(self):
+        return len(self._devices)
@@ -0,0 +1,172 @@
+'''
+Archivo local de los paquetes recibidos, para volver a decodificar cualquier rango sin consultar el servicio.
+
+    {root}/packets.bin          registros: cabecera RECORD_HEADER + trama sin base64, solo se agregan al final
+    {root}/index.i64            int64 (deviceId, hiveRxTime, packetId, offset, largo) por registro, en orden de llegada
+    {root}/index.sorted.i64     el mismo índice ordenado por (deviceId, hiveRxTime, packetId)
+
+Los registros se escriben antes que su fila del índice: si el proceso se interrumpe, el lector ignora los bytes
+sin fila. El índice ordenado se regenera cuando index.i64 tiene filas nuevas. Las lecturas usan memory map.
+
+    archive = FrameArchive('archive')
+    archive.append(messages)                                   # mensajes JSON del servicio
+    for message in archive.iter_messages(13025, start, end):   # mismos campos, con payload en lugar de data
+        ...
+'''
+
+import base64
+import binascii
+import mmap
+import os
+import struct
+
+from datetime import datetime
+from itertools import islice
+from typing import Iterable, Iterator
+
+import numpy as np
+
+import app_config
+
+from column_store import _to_epoch
+
+from models.decoded_batch_model import datetime_to_epoch
+
+from sync_state import parse_hive_time
+
+logger = app_config.CustomLogger('frame_archive')
+
+# packetId, deviceId, hiveRxTime (epoch), deviceType, status, largo de la trama
+RECORD_HEADER = struct.Struct('<qqqhhI')
+
+# posición de deviceType y status dentro de la cabecera
+TYPE_STATUS_OFFSET = 24
+
+INDEX_COLUMNS = 5
+
+(DEVICE, RX_TIME, PACKET, OFFSET, LENGTH) = range(INDEX_COLUMNS)
+
+class FrameArchive:
+    def __init__(self, root: str = 'archive'):
+        self.root = root
+        self.data_path = os.path.join(root, 'packets.bin')
+        self.index_path = os.path.join(root, 'index.i64')
+        self.sorted_path = os.path.join(root, 'index.sorted.i64')
+        self._packet_ids: np.ndarray | None = None
+
+    # Index
+
+    def _read_index(self, path: str) -> np.ndarray:
+        if not os.path.isfile(path) or os.path.getsize(path) < INDEX_COLUMNS * 8:
+            return np.empty((0, INDEX_COLUMNS), dtype=np.int64)
+        index = np.memmap(path, dtype='<i8', mode='r')
+        return index[:len(index) // INDEX_COLUMNS * INDEX_COLUMNS].reshape(-1, INDEX_COLUMNS)
+
+    def index(self) -> np.ndarray:
+        '''Índice ordenado por (deviceId, hiveRxTime, packetId), se regenera si llegaron registros nuevos'''
+        arrival = self._read_index(self.index_path)
+        ordered = self._read_index(self.sorted_path)
+        if len(ordered) == len(arrival):
+            return ordered
+        order = np.lexsort((arrival[:, PACKET], arrival[:, RX_TIME], arrival[:, DEVICE]))
+        ordered = np.ascontiguousarray(arrival[order])
+        temp_path = f'{self.sorted_path}.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(ordered.astype('<i8').tobytes())
+        os.replace(temp_path, self.sorted_path)
+        return self._read_index(self.sorted_path)
+
+    def __len__(self):
+        return len(self._read_index(self.index_path))
+
+    def _known_packet_ids(self) -> np.ndarray:
+        if self._packet_ids is None:
+            self._packet_ids = np.unique(self._read_index(self.index_path)[:, PACKET])
+        return self._packet_ids
+
+    # Write
+
+    def append(self, messages: Iterable[dict]) -> int:
+        '''Agrega los paquetes que no estén en el archivo (por packetId). Retorna la cantidad agregada'''
+        records: list[bytes] = []
+        rows: list[tuple[int, int, int, int]] = []
+        known = self._known_packet_ids()
+        seen: set[int] = set()
+        for message in messages:
+            if not isinstance(message, dict) or message.get('data') is None:
+                continue
+            packet_id = int(message['packetId'])
+            position = int(np.searchsorted(known, packet_id))
+            if packet_id in seen or (position < len(known) and known[position] == packet_id):
+                continue
+            try:
+                payload = base64.b64decode(message['data'])
+                rx_epoch = datetime_to_epoch(parse_hive_time(message['hiveRxTime']).replace(tzinfo=None))
+            except (binascii.Error, ValueError, TypeError, KeyError) as e:
+                logger.warning('Packet %s not archived: %s', packet_id, e)
+                continue
+            seen.add(packet_id)
+            records.append(RECORD_HEADER.pack(packet_id, int(message['deviceId']), rx_epoch,
+                                              int(message.get('deviceType', 0)), int(message.get('status', 0)), len(payload)))
+            records.append(payload)
+            rows.append((int(message['deviceId']), rx_epoch, packet_id, len(payload)))
+        if len(rows) == 0:
+            return 0
+
+        os.makedirs(self.root, exist_ok=True)
+        with open(self.data_path, 'ab') as file:
+            offset = file.tell()
+            file.write(b''.join(records))
+        index = np.empty((len(rows), INDEX_COLUMNS), dtype='<i8')
+        for row, (device_id, rx_epoch, packet_id, length) in enumerate(rows):
+            index[row] = (device_id, rx_epoch, packet_id, offset + RECORD_HEADER.size, length)
+            offset += RECORD_HEADER.size + length
+        with open(self.index_path, 'ab') as file:
+            file.write(index.tobytes())
+        self._packet_ids = np.union1d(known, index[:, PACKET])
+        return len(rows)
+
+    def record(self, messages: Iterable[dict], block_size: int = 1000) -> Iterator[dict]:
+        '''Retorna los mismos mensajes y los agrega al archivo en bloques de block_size'''
+        iterator = iter(messages)
+        while True:
+            block = list(islice(iterator, block_size))
+            if len(block) == 0:
+                return
+            self.append(block)
+            yield from block
+
+    # Read
+
+    def select(self, device_id=None, start: datetime | int | None = None, end: datetime | int | None = None) -> np.ndarray:
+        '''Filas del índice ordenado con hiveRxTime en [start, end), de un dispositivo o de todos'''
+        index = self.index()
+        start_epoch = _to_epoch(start, -2 ** 62)
+        end_epoch = _to_epoch(end, 2 ** 62)
+        if device_id is not None:
+            device_id = int(device_id)
+            first = int(np.searchsorted(index[:, DEVICE], device_id, side='left'))
+            last = int(np.searchsorted(index[:, DEVICE], device_id, side='right'))
+            rx_times = index[first:last, RX_TIME]
+            return index[first + int(np.searchsorted(rx_times, start_epoch, side='left')):
+                         first + int(np.searchsorted(rx_times, end_epoch, side='left'))]
+        return index[(index[:, RX_TIME] >= start_epoch) & (index[:, RX_TIME] < end_epoch)]
+
+    def iter_messages(self, device_id=None, start: datetime | int | None = None, end: datetime | int | None = None) -> Iterator[dict]:
+        '''Paquetes del rango como diccionarios con los campos del servicio y payload (trama sin base64) en lugar de data'''
+        rows = self.select(device_id, start, end)
+        if len(rows) == 0:
+            return
+        with open(self.data_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            # deviceType y status se leen de las cabeceras en un solo paso, las fechas se formatean juntas
+            buffer = np.frombuffer(data, dtype=np.uint8)
+            positions = rows[:, OFFSET] - RECORD_HEADER.size + TYPE_STATUS_OFFSET
+            (device_types, statuses) = buffer[positions[:, None] + np.arange(4)].view('<i2').T.tolist()
+            rx_times = np.datetime_as_string(rows[:, RX_TIME].astype('datetime64[s]')).tolist()
+            # el mmap no se puede cerrar mientras exista una vista de NumPy
+            del buffer
+            for (device, packet_id, offset, length, device_type, status, rx_time) in zip(
+                    rows[:, DEVICE].tolist(), rows[:, PACKET].tolist(), rows[:, OFFSET].tolist(), rows[:, LENGTH].tolist(),
+                    device_types, statuses, rx_times):
+                yield {'packetId': packet_id, 'deviceId': device, 'deviceType': device_type, 'status': status,
+                       'hiveRxTime': rx_time, 'payload': data[offset:offset + length]}
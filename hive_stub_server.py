@@ -0,0 +1,127 @@
+'''
+Servidor local que imita los servicios de Hive (login, logout, devices, messages) para probar
+swarm_provider sin red. Los mensajes se leen de un archivo JSON con la respuesta del servicio.
+
+    python hive_stub_server.py --port 8080 --messages response_1713907924096.json --fail-rate 0.2
+
+y en config.ini: [Api] host=http://127.0.0.1:8080
+'''
+
+import argparse
+import json
+import random
+import secrets
+
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from sync_state import parse_hive_time
+
+def _device_item(device_id: int) -> dict:
+    '''Dispositivo con los campos que espera DeviceModel, el nombre es F-0x + device_id en hexadecimal'''
+    return {
+        'deviceType': 1, 'deviceId': device_id, 'deviceName': f'F-0x{device_id:05x}', 'comments': '',
+        'hiveCreationTime': None, 'hiveFirstheardTime': None, 'hiveLastheardTime': None,
+        'firmwareVersion': None, 'hardwareVersion': None, 'lastTelemetryReportPacketId': None,
+        'lastHeardByDeviceType': None, 'lastHeardByDeviceId': None, 'counter': 0, 'dayofyear': 0,
+        'lastHeardCounter': 0, 'lastHeardDayofyear': 0, 'lastHeardByGroundstationId': None,
+        'status': 0, 'twoWayEnabled': False, 'dataEncryptionEnabled': False, 'metadata': {},
+    }
+
+class HiveStub:
+    def __init__(self, messages: list[dict], fail_rate: float = 0.0):
+        self.messages = messages
+        self.devices = [_device_item(device_id) for device_id in sorted({m['deviceId'] for m in messages})]
+        self.fail_rate = fail_rate
+        self.tokens: set[str] = set()
+        self.requests = 0
+
+    def select_messages(self, query: dict[str, list[str]]) -> list[dict]:
+        start = query.get('startDate', [None])[0]
+        end = query.get('endDate', [None])[0]
+        device_id = query.get('deviceid', [None])[0]
+        start_date = None if start is None else parse_hive_time(start)
+        end_date = None if end is None else parse_hive_time(end)
+        result = []
+        for message in self.messages:
+            rx_time = parse_hive_time(message['hiveRxTime'])
+            if start_date is not None and rx_time < start_date:
+                continue
+            if end_date is not None and rx_time > end_date:
+                continue
+            if device_id is not None and str(message['deviceId']) != device_id:
+                continue
+            result.append(message)
+        return result
+
+def make_handler(stub: HiveStub):
+    class Handler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, body=None):
+            data = b'' if body is None else json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _fail(self) -> bool:
+            stub.requests += 1
+            if random.random() < stub.fail_rate:
+                self._send_json(random.choice([429, 503]), {'message': 'stub failure'})
+                return True
+            return False
+
+        def _authorized(self) -> bool:
+            token = self.headers.get('Authorization', '').removeprefix('Bearer ')
+            if token not in stub.tokens:
+                self._send_json(401, {'message': 'Unauthorized'})
+                return False
+            return True
+
+        def do_POST(self):
+            if self._fail():
+                return
+            path = urlparse(self.path).path
+            if path == '/hive/login':
+                token = secrets.token_hex(16)
+                stub.tokens.add(token)
+                self._send_json(200, {'token': token})
+            elif path == '/hive/logout':
+                stub.tokens.discard(self.headers.get('Authorization', '').removeprefix('Bearer '))
+                self._send_json(204)
+            else:
+                self._send_json(404, {'message': 'Not found'})
+
+        def do_GET(self):
+            if self._fail() or not self._authorized():
+                return
+            url = urlparse(self.path)
+            if url.path == '/hive/api/v1/devices':
+                self._send_json(200, stub.devices)
+            elif url.path == '/hive/api/v1/messages':
+                self._send_json(200, stub.select_messages(parse_qs(url.query)))
+            else:
+                self._send_json(404, {'message': 'Not found'})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def serve(messages_path: str, host: str = '127.0.0.1', port: int = 8080, fail_rate: float = 0.0) -> ThreadingHTTPServer:
+    '''Crea el servidor (sin iniciarlo). Usar serve_forever() o ejecutarlo en un hilo'''
+    with open(messages_path, 'r') as file:
+        messages = json.load(file)
+    return ThreadingHTTPServer((host, port), make_handler(HiveStub(messages, fail_rate)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Servidor local que imita los servicios de Hive')
+    parser.add_argument('--messages', default='response_1713907924096.json')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='proporción de respuestas 429/503')
+    args = parser.parse_args()
+    server = serve(args.messages, args.host, args.port, args.fail_rate)
+    print(f'Hive stub listening on http://{args.host}:{args.port} ({datetime.now()})')
+    server.serve_forever()
@@ -0,0 +1,91 @@
+'''
+Lectura incremental de un arreglo JSON: retorna un elemento a la vez sin cargar todo el archivo
+'''
+
+import json
+
+from typing import Iterator, TextIO
+
+_decoder = json.JSONDecoder()
+
+_WHITESPACE = ' \t\n\r'
+
+_NUMBER_CHARS = '0123456789.eE+-'
+
+def iter_json_array(file: TextIO, chunk_size: int = 64 * 1024) -> Iterator:
+    '''Retorna los elementos del arreglo JSON de nivel superior uno por uno.
+    Solo mantiene en memoria el bloque leído y el elemento actual.'''
+    buffer = ''
+    position = 0
+    eof = False
+    started = False
+    # después de "[" se espera un elemento o "]", después de "," un elemento y después de un elemento "," o "]"
+    expect_value = True
+    after_comma = False
+
+    def fill() -> bool:
+        nonlocal buffer, position, eof
+        chunk = file.read(chunk_size)
+        if chunk == '':
+            eof = True
+            return False
+        buffer = buffer[position:] + chunk
+        position = 0
+        return True
+
+    while True:
+        # saltar espacios y separadores
+        while True:
+            while position < len(buffer) and buffer[position] in _WHITESPACE:
+                position += 1
+            if position < len(buffer) or not fill():
+                break
+
+        if position >= len(buffer):
+            if not started:
+                raise ValueError('iter_json_array >> Empty JSON document')
+            raise ValueError('iter_json_array >> Unterminated JSON array')
+
+        c = buffer[position]
+        if not started:
+            if c != '[':
+                raise ValueError(f'iter_json_array >> Expected "[" at the start of the document, found "{c}"')
+            started = True
+            position += 1
+            continue
+        if c == ']':
+            if after_comma:
+                raise json.JSONDecodeError('iter_json_array >> Expecting value after ","', buffer, position)
+            # después del arreglo solo puede haber espacios
+            position += 1
+            while True:
+                rest = buffer[position:].lstrip(_WHITESPACE)
+                if rest != '':
+                    raise ValueError(f'iter_json_array >> Extra data after the JSON array: "{rest[:20]}"')
+                if not fill():
+                    return
+        if c == ',':
+            if expect_value:
+                raise json.JSONDecodeError('iter_json_array >> Expecting value before ","', buffer, position)
+            expect_value = True
+            after_comma = True
+            position += 1
+            continue
+        if not expect_value:
+            raise json.JSONDecodeError('iter_json_array >> Expecting "," or "]" delimiter', buffer, position)
+
+        try:
+            item, end = _decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof or not fill():
+                raise
+            continue
+
+        # un número al final del bloque puede estar incompleto ("2." o "2.5e" se leen como 2 y 2.5)
+        if not eof and buffer[end:].lstrip(_NUMBER_CHARS) == '' and fill():
+            continue
+
+        position = end
+        expect_value = False
+        after_comma = False
+        yield item
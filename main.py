@@ -1,20 +1,140 @@
+import argparse
+import itertools
+import sys
+
+import app_config
+
+import metrics
+
 import vital_sensor_decode
 from datetime import datetime, time
 
 from app_config import CustomLogger
 
+from sync_state import SyncState
+
+from column_store import ColumnStore, ColumnStoreWriter, SampleStore
+
+from sample_index import SampleIndex
+
+from device_registry import DeviceRegistry
+
 logger = CustomLogger('main')
 
+def open_store(args) -> tuple[SampleStore, SampleIndex | None]:
+    '''Almacenamiento elegido en los argumentos y el índice de repetidos que necesita (SQLite usa su clave primaria)'''
+    if args.sqlite:
+        from sqlite_store import SQLiteStore
+        return SQLiteStore(args.sqlite, args.policy), None
+    return ColumnStore(args.store), SampleIndex(args.store, args.policy)
+
+def open_rollups(args, store: SampleStore):
+    if not args.rollups:
+        return None
+    from rollup import RollupStore
+    return RollupStore(store, args.store)
+
+def open_archive(args):
+    if not args.archive:
+        return None
+    from frame_archive import FrameArchive
+    return FrameArchive(args.archive)
+
+def open_coverage(args):
+    if not (args.coverage or args.refetch_gaps):
+        return None
+    from coverage_index import CoverageIndex
+    return CoverageIndex(args.store)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Decodificación de mensajes Sensor Vital')
+    parser.add_argument('--file', default='response_1713907924096.json', help='archivo JSON con la respuesta del servicio de mensajes')
+    parser.add_argument('--incremental', action='store_true', help='consultar al servicio solo los mensajes nuevos desde la última ejecución')
+    parser.add_argument('--state', default='sync_state.json', help='archivo con el estado de la sincronización incremental')
+    parser.add_argument('--backfill', action='store_true', help='consultar al servicio todos los mensajes entre --start y --end')
+    parser.add_argument('--start', type=datetime.fromisoformat, help='fecha inicial del backfill o de la primera consulta incremental o del daemon (ISO 8601)')
+    parser.add_argument('--end', type=datetime.fromisoformat, help='fecha final del backfill (ISO 8601, por defecto ahora) o de los huecos de --refetch-gaps (por defecto la última muestra)')
+    parser.add_argument('--device', action='append', dest='devices', help='deviceId a consultar, se puede repetir')
+    parser.add_argument('--concurrency', type=int, default=4, help='peticiones simultáneas al servicio en el backfill')
+    parser.add_argument('--store', default='store', help='directorio del almacenamiento columnar')
+    parser.add_argument('--sqlite', metavar='PATH', help='guardar las muestras en la base SQLite PATH en lugar del almacenamiento columnar')
+    parser.add_argument('--rollups', action='store_true', help='actualizar los agregados por hora, día y mes (rollup.py) con las muestras nuevas')
+    parser.add_argument('--archive', metavar='DIR', help='guardar los paquetes recibidos en el archivo local DIR (frame_archive.py)')
+    parser.add_argument('--coverage', action='store_true', help='actualizar el índice de cobertura (coverage_index.py) con las tramas nuevas')
+    parser.add_argument('--refetch-gaps', action='store_true', help='consultar al servicio solo los huecos del índice de cobertura entre --start y --end')
+    parser.add_argument('--redecode', action='store_true', help='decodificar de nuevo los paquetes de --archive entre --start y --end, sin consultar al servicio')
+    parser.add_argument('--quarantine', metavar='PATH', help='archivo de los paquetes que no se pudieron decodificar (por defecto [Core] quarantine_path)')
+    parser.add_argument('--name', help='nombre del dispositivo (calibración devices/{nombre}.txt) de los paquetes de --redecode, por defecto se busca en la caché del registro')
+    parser.add_argument('--policy', choices=['newest', 'first'], default='newest', help='muestra que se conserva cuando un timestamp se repite con otros valores')
+    parser.add_argument('--workers', type=int, default=1, help='procesos para decodificar en paralelo (1 = en serie)')
+    parser.add_argument('--daemon', action='store_true', help='consultar al servicio cada --interval segundos hasta recibir SIGINT/SIGTERM')
+    parser.add_argument('--interval', type=float, help='segundos entre consultas del modo daemon (por defecto [Daemon] poll_interval)')
+    return parser.parse_args()
+
 if __name__ == '__main__':
+    args = parse_args()
     try:
+        if args.quarantine:
+            vital_sensor_decode.quarantine.path = args.quarantine
         start_date = datetime.combine(datetime.now(), time(0, 0, 0))
         #messages = vital_sensor_decode.get_messages(start_date=start_date)
         #vital_sensor_decode.print_decode_messages(messages)
-        response = vital_sensor_decode.process_json_message()
+        if args.daemon:
+            import daemon
+            (store, index) = open_store(args)
+            service = daemon.IngestDaemon(store, index, args.state, start_date=args.start or start_date,
+                                          poll_interval=args.interval or app_config.DAEMON_POLL_INTERVAL,
+                                          workers=args.workers, device_ids=args.devices,
+                                          rollup=open_rollups(args, store), archive=open_archive(args),
+                                          coverage=open_coverage(args))
+            service.install_signal_handlers()
+            service.run()
+            sys.exit(0)
+        archive = open_archive(args)
+        coverage = open_coverage(args)
+        if args.redecode:
+            if archive is None:
+                raise ValueError('main >> --redecode requires --archive')
+            registry = DeviceRegistry()
+            response = itertools.chain.from_iterable(
+                vital_sensor_decode.redecode_archive(archive, registry, device_id, args.start, args.end, device_name=args.name,
+                                                     workers=args.workers)
+                for device_id in (args.devices or [None]))
+        elif args.refetch_gaps:
+            response = vital_sensor_decode.refetch_gaps(coverage, args.start, args.end, args.devices,
+                                                        concurrency=args.concurrency, workers=args.workers, archive=archive)
+        elif args.backfill:
+            response = vital_sensor_decode.backfill_messages(args.start or start_date, args.end or datetime.now(), args.devices,
+                                                             concurrency=args.concurrency, workers=args.workers, archive=archive)
+        elif args.incremental:
+            state = SyncState(args.state)
+            (response, new_messages) = vital_sensor_decode.get_new_messages(state, start_date=args.start or start_date,
+                                                                            workers=args.workers, archive=archive)
+        else:
+            response = vital_sensor_decode.stream_json_messages(args.file, workers=args.workers, archive=archive)
         #vital_sensor_decode.print_decode_messages(response)
-        vital_sensor_decode.save_messages_csv(response)
+        (store, index) = open_store(args)
+        with ColumnStoreWriter(store, index, rollup=open_rollups(args, store), coverage=coverage,
+                               quarantine=vital_sensor_decode.quarantine) as writer:
+            for message in response:
+                writer.write(message)
+        if args.incremental:
+            # la marca avanza solo con los mensajes ya escritos en el almacenamiento
+            vital_sensor_decode.commit_messages(state, new_messages)
+        logger.info('numero de mensajes= %s', writer.count)
+        quarantine = vital_sensor_decode.quarantine
+        if len(quarantine) > 0:
+            logger.warning('%s packets quarantined in %s: %s', len(quarantine), quarantine.path, dict(quarantine.counts))
+        # los CSV se exportan desde el almacenamiento con todo el historial de todos los dispositivos,
+        # también los que no recibieron paquetes en esta ejecución
+        device_ids = store.devices()
+        store.export_csv('messages_decode.csv', device_ids)
+        store.export_frames_csv('datatime_compare.csv', device_ids)
+        store.close()
         #for message_data in response:
             #for message in message_data.message_values:
                 #print(message.date, "" ,message.values)
     except Exception as e:
-        logger.error(e)
\ No newline at end of file
+        logger.error(e)
+    finally:
+        metrics.export()
@@ -0,0 +1,204 @@
+'''
+Contadores, tiempos e histogramas del proceso, exportados a un archivo local.
+
+    with metrics.timer('decode_seconds'):
+        ...
+    metrics.incr('messages_decoded_total', len(block))
+    metrics.observe('ingest_lag_seconds', lag, metrics.LAG_BUCKETS, device='13025')
+    metrics.export()    # formato y ruta de [Metrics] en config.ini
+
+Formato prometheus: se reescribe el archivo completo (compatible con el textfile collector de node_exporter).
+Formato jsonl: se agrega una línea con el estado de todas las métricas en cada exportación.
+'''
+
+import json
+import math
+import os
+import threading
+import time
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Iterator
+
+import app_config
+
+FORMAT_PROMETHEUS = 'prometheus'
+
+FORMAT_JSONL = 'jsonl'
+
+# Segundos, para los tiempos de las etapas
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+
+# Segundos entre la fecha inicial de la trama y su hiveRxTime
+LAG_BUCKETS = (60, 300, 900, 1800, 3600, 7200, 14400, 21600, 43200, 86400, 172800, 604800)
+
+Labels = tuple[tuple[str, str], ...]
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.counts[index] += 1
+
+    def cumulative(self) -> list[int]:
+        total = 0
+        result = []
+        for count in self.counts:
+            total += count
+            result.append(total)
+        return result
+
+class Metrics:
+    '''Registro de métricas en memoria, se puede usar desde varios hilos.
+    Sin enabled se usa [Metrics] enabled de config.ini, leído con la primera métrica.'''
+
+    def __init__(self, enabled: bool | None = None):
+        self._enabled = enabled
+        self._lock = threading.Lock()
+        self._counters: dict[str, dict[Labels, float]] = {}
+        self._histograms: dict[str, dict[Labels, Histogram]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        if self._enabled is None:
+            self._enabled = app_config.METRICS_ENABLED
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value: bool):
+        self._enabled = value
+
+    def incr(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = _labels(labels) if labels else ()
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: tuple = TIME_BUCKETS, **labels):
+        if not self.enabled:
+            return
+        key = _labels(labels) if labels else ()
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        '''Mide el tiempo del bloque en el histograma name (segundos), también cuando el bloque falla'''
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, TIME_BUCKETS, **labels)
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    # Export
+
+    def snapshot(self) -> list[dict]:
+        '''Estado de todas las métricas como lista de diccionarios'''
+        result: list[dict] = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                for key, value in series.items():
+                    result.append({'name': name, 'type': 'counter', 'labels': dict(key), 'value': value})
+            for name, series in sorted(self._histograms.items()):
+                for key, histogram in series.items():
+                    result.append({'name': name, 'type': 'histogram', 'labels': dict(key),
+                                   'count': histogram.count, 'sum': histogram.sum,
+                                   'buckets': dict(zip((str(bound) for bound in histogram.buckets), histogram.cumulative()))})
+        return result
+
+    def to_prometheus(self) -> str:
+        lines: list[str] = []
+        typed: set[str] = set()
+        for item in self.snapshot():
+            name = item['name']
+            labels = item['labels']
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} {item["type"]}')
+            if item['type'] == 'counter':
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(item["value"])}')
+                continue
+            for bound, count in item['buckets'].items():
+                lines.append(f'{name}_bucket{_format_labels(labels, le=bound)} {count}')
+            lines.append(f'{name}_bucket{_format_labels(labels, le="+Inf")} {item["count"]}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(item["sum"])}')
+            lines.append(f'{name}_count{_format_labels(labels)} {item["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str):
+        '''Reescribe el archivo completo (archivo temporal + os.replace)'''
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as file:
+            file.write(self.to_prometheus())
+        os.replace(temp_path, path)
+
+    def write_jsonl(self, path: str):
+        '''Agrega una línea con la fecha y el estado de todas las métricas'''
+        line = json.dumps({'time': time.time(), 'metrics': self.snapshot()})
+        with open(path, 'a') as file:
+            file.write(line + '\n')
+
+    def export(self, path: str | None = None, format: str | None = None):
+        path = path or app_config.METRICS_PATH
+        format = format or app_config.METRICS_FORMAT
+        if not self.enabled or not path:
+            return
+        if format == FORMAT_JSONL:
+            self.write_jsonl(path)
+        elif format == FORMAT_PROMETHEUS:
+            self.write_prometheus(path)
+        else:
+            raise ValueError(f'Metrics.export >> Unknown format "{format}"')
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int) or (math.isfinite(value) and value == int(value)):
+        return str(int(value))
+    return repr(float(value))
+
+def _format_labels(labels: dict, **extra) -> str:
+    items = {**labels, **extra}
+    if len(items) == 0:
+        return ''
+    escaped = (f'{key}="{_escape(value)}"' for key, value in items.items())
+    return '{' + ','.join(escaped) + '}'
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+registry = Metrics()
+
+incr = registry.incr
+
+observe = registry.observe
+
+timer = registry.timer
+
+export = registry.export
@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+EPOCH = datetime(1970, 1, 1)
+
+# Entero crudo de las celdas que la trama no trae
+RAW_MISSING = np.iinfo(np.int32).min
+
+def datetime_to_epoch(date: datetime) -> int:
+    '''Segundos desde 1970-01-01 de un datetime sin zona horaria (la hora de la trama se toma tal cual)'''
+    return (date - EPOCH) // timedelta(seconds=1)
+
+def epoch_to_datetime(epoch: int) -> datetime:
+    '''Inverso de datetime_to_epoch'''
+    return EPOCH + timedelta(seconds=int(epoch))
+
+class DecodedBatchModel:
+    '''Resultado compacto de decodificar varias tramas.
+
+    Por trama: start_epochs (segundos epoch de la primera fila), intervals (segundos entre filas), n_vars,
+    n_cells (valores presentes en la trama), row_starts (primera fila de la trama en values), packet_ids y device_ids.
+    values: matriz float64 (filas x variables), NaN en lugar de None. Las celdas que la trama no trae también son NaN.
+    raw: matriz int32 con los enteros sin calibrar (RAW_MISSING en las celdas que la trama no trae) y mult_offset
+    la calibración con la que se calcularon values.
+    Las fechas de cada fila se calculan a partir de start_epochs e intervals.'''
+
+    def __init__(self, values: np.ndarray, start_epochs: np.ndarray, intervals: np.ndarray,
+                 n_vars: np.ndarray, n_cells: np.ndarray, row_starts: np.ndarray,
+                 packet_ids: list | None = None, device_ids: list | None = None,
+                 raw: np.ndarray | None = None, mult_offset: list[tuple[float, float]] | None = None):
+        self.values = values
+        self.raw = raw
+        self.mult_offset = mult_offset
+        self.start_epochs = start_epochs
+        self.intervals = intervals
+        self.n_vars = n_vars
+        self.n_cells = n_cells
+        self.row_starts = row_starts
+        self.packet_ids = packet_ids if packet_ids is not None else [None] * len(start_epochs)
+        self.device_ids = device_ids if device_ids is not None else [None] * len(start_epochs)
+        self._frame_index: np.ndarray | None = None
+        self._timestamps: np.ndarray | None = None
+
+    @property
+    def n_frames(self) -> int:
+        return len(self.start_epochs)
+
+    def frame_rows(self, frame: int) -> slice:
+        '''Retorna el slice de filas que pertenecen a la trama indicada'''
+        return slice(int(self.row_starts[frame]), int(self.row_starts[frame + 1]))
+
+    @property
+    def frame_index(self) -> np.ndarray:
+        '''Índice de la trama de cada fila'''
+        if self._frame_index is None:
+            self._frame_index = np.repeat(np.arange(self.n_frames), np.diff(self.row_starts))
+        return self._frame_index
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        '''Segundos epoch de cada fila: fecha inicial de la trama + n * intervalo'''
+        if self._timestamps is None:
+            frame_index = self.frame_index
+            row_position = np.arange(len(frame_index)) - self.row_starts[frame_index]
+            self._timestamps = self.start_epochs[frame_index] + row_position * self.intervals[frame_index]
+        return self._timestamps
+
+    @property
+    def row_lengths(self) -> np.ndarray:
+        '''Cantidad de valores presentes en cada fila'''
+        frame_index = self.frame_index
+        row_position = np.arange(len(frame_index)) - self.row_starts[frame_index]
+        n_vars = self.n_vars[frame_index]
+        return np.minimum(n_vars, self.n_cells[frame_index] - row_position * n_vars)
+
+    @property
+    def initial_dates(self) -> list[datetime]:
+        return [epoch_to_datetime(epoch) for epoch in self.start_epochs.tolist()]
+
+    @property
+    def minutes(self) -> list[int]:
+        return (self.intervals // 60).tolist()
+
+    def row_frame(self, row: int) -> int:
+        '''Trama a la que pertenece la fila'''
+        return int(np.searchsorted(self.row_starts, row, side='right')) - 1
+
+    def row_date(self, row: int, frame: int | None = None) -> datetime:
+        if frame is None:
+            frame = self.row_frame(row)
+        return epoch_to_datetime(int(self.start_epochs[frame]) + (row - int(self.row_starts[frame])) * int(self.intervals[frame]))
+
+    def row_values(self, row: int, frame: int | None = None) -> list[float | None]:
+        '''Valores de la fila como en decode_message_values: None en lugar de NaN y sin las celdas faltantes'''
+        if frame is None:
+            frame = self.row_frame(row)
+        n_vars = int(self.n_vars[frame])
+        length = min(n_vars, int(self.n_cells[frame]) - (row - int(self.row_starts[frame])) * n_vars)
+        return [None if value != value else value for value in self.values[row, :length].tolist()]
+
+    def dates(self) -> list[datetime]:
+        '''Fechas de cada fila como objetos datetime'''
+        return [epoch_to_datetime(ts) for ts in self.timestamps.tolist()]
+
+    def __len__(self):
+        return len(self.values)
+
+    def __str__(self):
+        return f'DecodedBatchModel(frames={self.n_frames}, rows={len(self)}, columns={self.values.shape[1]})'
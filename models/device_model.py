@@ -1,4 +1,10 @@
 class DeviceModel:
+    __slots__ = ('deviceType', 'deviceId', 'deviceName', 'comments', 'hiveCreationTime', 'hiveFirstheardTime',
+                 'hiveLastheardTime', 'firmwareVersion', 'hardwareVersion', 'lastTelemetryReportPacketId',
+                 'lastHeardByDeviceType', 'lastHeardByDeviceId', 'counter', 'dayofyear', 'lastHeardCounter',
+                 'lastHeardDayofyear', 'lastHeardByGroundstationId', 'status', 'twoWayEnabled',
+                 'dataEncryptionEnabled', 'metadata')
+
     def __init__(self, deviceType, deviceId, deviceName, comments, hiveCreationTime, hiveFirstheardTime,
                  hiveLastheardTime, firmwareVersion, hardwareVersion, lastTelemetryReportPacketId,
                  lastHeardByDeviceType, lastHeardByDeviceId, counter, dayofyear, lastHeardCounter,
@@ -35,6 +41,10 @@ class DeviceModel:
         else:
             return self.deviceName
 
+    def to_dict(self) -> dict:
+        '''Retorna los campos con el mismo formato de la respuesta del servicio'''
+        return {name: getattr(self, name) for name in self.__slots__}
+
     def __str__(self):
         return (
             f'DeviceModel(\n'
@@ -1,11 +1,74 @@
+from collections.abc import Sequence
 from datetime import datetime
 
+from models.decoded_batch_model import epoch_to_datetime
+
 class MessageDecodeValueModel:
-    '''Set date and values of decode message. Values can be float or None.'''
+    '''Set date and values of decode message. Values can be float or None.
+    Cuando se crea con from_batch no guarda nada propio: fecha y valores se leen del lote al pedirlos.'''
+
+    __slots__ = ('_batch', '_row', '_frame', '_date', '_values')
 
     def __init__(self, date: datetime, values: list[float | None]):
-        self.date = date
-        self.values = values
+        self._batch = None
+        self._row = 0
+        self._frame = None
+        self._date = date
+        self._values = values
+
+    @classmethod
+    def from_batch(cls, batch, row: int, frame: int | None = None) -> 'MessageDecodeValueModel':
+        item = cls.__new__(cls)
+        item._batch = batch
+        item._row = row
+        item._frame = frame
+        item._date = None
+        item._values = None
+        return item
+
+    @property
+    def date(self) -> datetime:
+        if self._date is None and self._batch is not None:
+            return self._batch.row_date(self._row, self._frame)
+        return self._date
+
+    @date.setter
+    def date(self, value: datetime):
+        self._date = value
+
+    @property
+    def values(self) -> list[float | None]:
+        if self._values is None and self._batch is not None:
+            self._values = self._batch.row_values(self._row, self._frame)
+        return self._values
+
+    @values.setter
+    def values(self, value: list[float | None]):
+        self._values = value
+
+class MessageValuesView(Sequence):
+    '''Lista de solo lectura de las filas de una trama de un DecodedBatchModel'''
+
+    __slots__ = ('batch', 'frame', 'start', 'stop')
+
+    def __init__(self, batch, frame: int):
+        self.batch = batch
+        self.frame = frame
+        rows = batch.frame_rows(frame)
+        self.start = rows.start
+        self.stop = rows.stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('MessageValuesView >> Index out of range')
+        return MessageDecodeValueModel.from_batch(self.batch, self.start + index, self.frame)
 
 class MessageEncodeModel:
     def __init__(self, id, data, device_type, device_id, device_name, status, hiveRxTime,
@@ -13,7 +76,7 @@ class MessageEncodeModel:
                  minutes: int = 0, 
                  n_vars: int = 0,
                  initial_date: datetime | None = None,
-                 message_values: list[MessageDecodeValueModel] = []):
+                 message_values: list[MessageDecodeValueModel] | None = None):
         self._id = id
         self._device_type = device_type
         self._device_id = device_id
@@ -26,7 +89,29 @@ class MessageEncodeModel:
         self.minutes = minutes
         self.n_vars = n_vars
         self.initial_date = initial_date
-        self.message_values = message_values
+        self.batch = None
+        self.frame = 0
+        self._message_values = message_values if message_values is not None else []
+
+    def attach(self, batch, frame: int):
+        '''Asocia el mensaje a la trama frame de un DecodedBatchModel; message_values pasa a ser una vista del lote'''
+        self.batch = batch
+        self.frame = frame
+        self.initial_date = epoch_to_datetime(batch.start_epochs[frame])
+        self.minutes = int(batch.intervals[frame]) // 60
+        self.n_vars = int(batch.n_vars[frame])
+        self._message_values = None
+
+    @property
+    def message_values(self) -> Sequence[MessageDecodeValueModel]:
+        if self._message_values is None:
+            return MessageValuesView(self.batch, self.frame)
+        return self._message_values
+
+    @message_values.setter
+    def message_values(self, value: Sequence[MessageDecodeValueModel]):
+        self.batch = None
+        self._message_values = value
     
     @property
     def id(self):
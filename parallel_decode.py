@@ -0,0 +1,86 @@
+'''
+Decodificación en paralelo (ProcessPoolExecutor) de listas grandes de mensajes
+'''
+
+import math
+
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, NamedTuple
+
+import app_config
+
+from batch_decode import decode_device_groups
+
+from quarantine import STAGE_DECODE, STAGE_PAYLOAD
+
+from models.decoded_batch_model import DecodedBatchModel
+
+from vital_sensor_decode import decode_payload
+
+_worker_mult_offset: dict[str, list[tuple[float, float]]] = {}
+
+class PacketError(NamedTuple):
+    '''Error de un paquete que no se pudo decodificar y la etapa de quarantine donde falló'''
+    stage: str
+    error: Exception
+
+def _init_worker(mult_offset_data: dict[str, list[tuple[float, float]]]):
+    '''Recibe la tabla de calibración (DeviceConfig.data) una sola vez por proceso'''
+    global _worker_mult_offset
+    _worker_mult_offset = mult_offset_data
+
+def _decode_chunk(packets: list[tuple[str | bytes, str | None]], n_bytes: int) -> list[tuple[DecodedBatchModel, int] | PacketError]:
+    '''Decodifica un bloque de paquetes (data base64 o trama ya decodificada, nombre del dispositivo) agrupando por dispositivo.
+    Retorna (lote, trama) por paquete, o PacketError para los paquetes que no se pudieron decodificar;
+    cada lote se serializa una sola vez al volver al proceso principal.'''
+    payloads: list[bytes | Exception] = []
+    for (data, _) in packets:
+        try:
+            payloads.append(data if isinstance(data, bytes) else decode_payload(data))
+        except (TypeError, ValueError) as e:
+            payloads.append(e)
+    decoded = decode_device_groups(payloads, [device_name for (_, device_name) in packets],
+                                   lambda device_name: _worker_mult_offset.get(device_name, []), n_bytes)
+    return [PacketError(STAGE_PAYLOAD, payload) if isinstance(payload, Exception) else
+            PacketError(STAGE_DECODE, item) if isinstance(item, Exception) else item
+            for (payload, item) in zip(payloads, decoded)]
+
+def iter_decode_packets(packets: Iterable[tuple[str, str | None]],
+                        mult_offset_data: dict[str, list[tuple[float, float]]],
+                        workers: int,
+                        n_bytes: int | None = None,
+                        chunk_size: int = 1000) -> Iterator[tuple[DecodedBatchModel, int] | PacketError]:
+    '''Decodifica los paquetes (data base64, nombre del dispositivo) en workers procesos a medida que llegan.
+    Mantiene como máximo 2 bloques por worker en proceso y retorna los pares (lote, trama) en el mismo orden de entrada
+    (PacketError en lugar del par para los paquetes que no se pudieron decodificar).'''
+    if n_bytes is None:
+        n_bytes = app_config.N_BYTES
+    pending: deque[Future] = deque()
+    iterator = iter(packets)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(mult_offset_data,)) as executor:
+        while True:
+            while len(pending) < workers * 2:
+                chunk = list(islice(iterator, chunk_size))
+                if len(chunk) == 0:
+                    break
+                pending.append(executor.submit(_decode_chunk, chunk, n_bytes))
+            if len(pending) == 0:
+                return
+            yield from pending.popleft().result()
+
+def decode_packets(packets: list[tuple[str, str | None]],
+                   mult_offset_data: dict[str, list[tuple[float, float]]],
+                   workers: int,
+                   n_bytes: int | None = None,
+                   chunks_per_worker: int = 4) -> list[tuple[DecodedBatchModel, int] | PacketError]:
+    '''Decodifica los paquetes (data base64, nombre del dispositivo) en workers procesos.
+    Retorna los pares (lote, trama) en el mismo orden de entrada (PacketError para los paquetes inválidos).'''
+    if n_bytes is None:
+        n_bytes = app_config.N_BYTES
+    if len(packets) == 0:
+        return []
+
+    chunk_size = max(1, math.ceil(len(packets) / (workers * chunks_per_worker)))
+    return list(iter_decode_packets(packets, mult_offset_data, workers, n_bytes, chunk_size))
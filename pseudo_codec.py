@@ -0,0 +1,119 @@
+'''
+Codificación/decodificación de pseudo enteros directamente sobre bytes.
+Cada caracter de la trama aporta 6 bits (bits bajos del código ASCII, '?' equivale a 127),
+el primer caracter es el más significativo.
+'''
+
+import calendar
+
+from datetime import date, datetime
+from functools import lru_cache
+
+import app_config
+
+DIGIT_BITS = 6
+
+DIGIT_MASK = 0x3F
+
+SIGN_LIMIT = 131071
+
+SIGN_OFFSET = 131072
+
+# Valor de 6 bits de cada byte posible. '?' (63) representa 127 en la trama
+DIGIT_TABLE = bytes(((127 if c == 63 else c) & DIGIT_MASK) for c in range(256))
+
+# Caracter usado para cada valor de 6 bits al codificar. El 63 se escribe como '?' en lugar de DEL (127)
+CHAR_TABLE = bytes((63 if d == DIGIT_MASK else 64 + d) for d in range(DIGIT_MASK + 1))
+
+def decode_pseudo_int(buffer: bytes | bytearray | memoryview, start: int = 0, n_bytes: int | None = None) -> int:
+    '''Decodifica el pseudo entero de n_bytes que inicia en la posición start del buffer'''
+    if n_bytes is None:
+        n_bytes = app_config.N_BYTES
+    n = 0
+    for c in buffer[start:start + n_bytes]:
+        n = (n << DIGIT_BITS) | DIGIT_TABLE[c]
+    if n > SIGN_LIMIT:
+        n = SIGN_OFFSET - n
+    return n
+
+def decode_pseudo_ints(buffer: bytes | bytearray | memoryview, start: int, count: int, n_bytes: int | None = None) -> list[int]:
+    '''Decodifica count pseudo enteros consecutivos a partir de la posición start'''
+    if n_bytes is None:
+        n_bytes = app_config.N_BYTES
+    return [decode_pseudo_int(buffer, i, n_bytes) for i in range(start, start + count * n_bytes, n_bytes)]
+
+# Cabecera: fecha juliana YYDDD, hora HHMMSS (negativa = +12 horas) y minutos * 100 + n variables
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+@lru_cache(maxsize=4096)
+def julian_date(date_int: int) -> date:
+    '''Fecha de un entero YYDDD (año 2000 + YY, día juliano DDD). Las tramas de un mismo día comparten el valor'''
+    (year, julian_day) = divmod(date_int, 1000)
+    year += 2000
+    days_in_year = 366 if calendar.isleap(year) else 365
+    if date_int < 0 or not 1 <= julian_day <= days_in_year:
+        raise ValueError(f'julian_date >> Value {date_int} not follows the format YYDDD')
+    return date.fromordinal(date(year, 1, 1).toordinal() + julian_day - 1)
+
+def julian_day_epoch(date_int: int) -> int:
+    '''Segundos epoch del inicio del día YYDDD'''
+    return (julian_date(date_int).toordinal() - EPOCH_ORDINAL) * 86400
+
+def split_time(time_int: int) -> tuple[int, int, int]:
+    '''(hora, minuto, segundo) de un entero HHMMSS, si es negativo se suman 12 horas'''
+    (hour, rest) = divmod(abs(time_int), 10000)
+    (minute, second) = divmod(rest, 100)
+    if time_int < 0:
+        hour += 12
+    if hour > 23 or minute > 59 or second > 59:
+        raise ValueError(f'split_time >> Value {time_int} not follows the format HHMMSS')
+    return hour, minute, second
+
+def split_minutes_n_vars(value: int) -> tuple[int, int]:
+    '''(minutos, n variables) de un entero MMVV'''
+    return divmod(abs(value), 100)
+
+def decode_header(buffer: bytes | bytearray | memoryview, start: int = 0, n_bytes: int | None = None) -> tuple[int, int, int]:
+    '''Retorna (segundos epoch de la fecha inicial, minutos, n variables) de la cabecera que inicia en start'''
+    if n_bytes is None:
+        n_bytes = app_config.N_BYTES
+    (date_int, time_int, vars_int) = decode_pseudo_ints(buffer, start, 3, n_bytes)
+    (hour, minute, second) = split_time(time_int)
+    (minutes, n_vars) = split_minutes_n_vars(vars_int)
+    return julian_day_epoch(date_int) + hour * 3600 + minute * 60 + second, minutes, n_vars
+
+def encode_pseudo_int(value: int, n_bytes: int | None = None) -> bytes:
+    '''Inverso de decode_pseudo_int. Los valores negativos se guardan como SIGN_OFFSET - value'''
+    if n_bytes is None:
+        n_bytes = app_config.N_BYTES
+    raw = value if value >= 0 else SIGN_OFFSET - value
+    if value > SIGN_LIMIT or raw >= 1 << (DIGIT_BITS * n_bytes):
+        raise ValueError(f'encode_pseudo_int >> Value {value} out of range for {n_bytes} bytes')
+    result = bytearray(n_bytes)
+    for k in range(n_bytes - 1, -1, -1):
+        result[k] = CHAR_TABLE[raw & DIGIT_MASK]
+        raw >>= DIGIT_BITS
+    return bytes(result)
+
+def encode_header(initial_date: datetime, minutes: int, n_vars: int, n_bytes: int | None = None) -> bytes:
+    '''Codifica la cabecera de la trama: fecha juliana YYDDD, hora HHMMSS y minutos/n variables (MMVV).
+    Las horas que no entran en el rango positivo se envían negativas con 12 horas menos'''
+    if n_bytes is None:
+        n_bytes = app_config.N_BYTES
+    date_int = (initial_date.year - 2000) * 1000 + initial_date.timetuple().tm_yday
+    time_int = initial_date.hour * 10000 + initial_date.minute * 100 + initial_date.second
+    if time_int > SIGN_LIMIT:
+        time_int = -(time_int - 120000)
+    return (encode_pseudo_int(date_int, n_bytes) +
+            encode_pseudo_int(time_int, n_bytes) +
+            encode_pseudo_int(minutes * 100 + n_vars, n_bytes))
+
+def encode_frame(initial_date: datetime, minutes: int, raw_rows: list[list[int]], n_bytes: int | None = None) -> bytes:
+    '''Construye una trama completa (sin base64) a partir de las filas de enteros crudos.
+    Todas las filas deben tener la misma cantidad de variables.'''
+    if n_bytes is None:
+        n_bytes = app_config.N_BYTES
+    n_vars = len(raw_rows[0]) if len(raw_rows) > 0 else 0
+    body = b''.join(encode_pseudo_int(value, n_bytes) for row in raw_rows for value in row)
+    return encode_header(initial_date, minutes, n_vars, n_bytes) + body
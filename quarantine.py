@@ -0,0 +1,60 @@
+'''
+Paquetes que no se pudieron decodificar, guardados con el motivo para revisarlos o decodificarlos de nuevo.
+
+    {path}    JSON lines: packetId, deviceId, deviceName, hiveRxTime, stage, reason, data (trama en base64), time
+
+stage indica dónde falló el paquete: payload (base64 o campos del mensaje), decode (cabecera o valores de la trama),
+message (campos del mensaje al crear el MessageEncodeModel), calibration (dispositivo sin calibración al
+decodificar de nuevo el FrameArchive) o store (trama con más variables que las guardadas del dispositivo).
+Cada registro se agrega al final del archivo,
+una interrupción no pierde los registros anteriores.
+'''
+
+import base64
+import json
+
+from collections import Counter
+from datetime import datetime
+
+import app_config
+import metrics
+
+logger = app_config.CustomLogger('quarantine')
+
+STAGE_PAYLOAD = 'payload'
+
+STAGE_DECODE = 'decode'
+
+STAGE_MESSAGE = 'message'
+
+STAGE_CALIBRATION = 'calibration'
+
+STAGE_STORE = 'store'
+
+class Quarantine:
+    def __init__(self, path: str | None = None):
+        '''Sin path se usa [Core] quarantine_path de config.ini (se lee al guardar el primer paquete)'''
+        self.path = path
+        self.counts: Counter = Counter()
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def add(self, message, device_name: str | None, stage: str, error: Exception):
+        '''Guarda el paquete (diccionario del servicio o del FrameArchive) con el motivo del error'''
+        if self.path is None:
+            self.path = app_config.QUARANTINE_PATH
+        self.counts[stage] += 1
+        metrics.incr('messages_quarantined_total', stage=stage)
+        record = {'packetId': None, 'deviceId': None, 'hiveRxTime': None}
+        if isinstance(message, dict):
+            record = {key: message.get(key) for key in record}
+            data = message.get('payload')
+            record['data'] = base64.b64encode(data).decode('ascii') if isinstance(data, (bytes, bytearray)) else message.get('data')
+        else:
+            record['data'] = None
+        record.update({'deviceName': device_name, 'stage': stage, 'reason': f'{type(error).__name__}: {error}',
+                       'time': datetime.now().isoformat(timespec='seconds')})
+        logger.warning('Packet %s quarantined (%s): %s', record['packetId'], stage, record['reason'])
+        with open(self.path, 'a') as file:
+            file.write(json.dumps(record, default=str) + '\n')
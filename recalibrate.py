@@ -0,0 +1,86 @@
+'''
+Recalibración del historial de un dispositivo: aplica una nueva lista (mult, offset) a los enteros crudos guardados
+en el almacenamiento columnar, en una sola pasada vectorizada, y marca cada muestra con la versión de la calibración.
+
+    python recalibrate.py --device 13025                          # calibración actual de devices/{nombre}.txt
+    python recalibrate.py --device 13025 --config nueva.txt --rollups
+    python recalibrate.py --device 13025 --list                   # versiones registradas y muestras de cada una
+
+Las muestras guardadas sin enteros crudos (antes de guardarlos, o sin lote) conservan sus valores.
+El SampleIndex conserva los valores anteriores: una trama que llegue de nuevo con la calibración nueva se
+vuelve a emitir (policy newest) con los mismos valores que ya tiene el almacenamiento.
+La base SQLite guarda solo valores calibrados y no se puede recalibrar.
+'''
+
+import argparse
+import sys
+
+from collections import Counter
+
+import numpy as np
+
+import app_config
+
+from column_store import CALIBRATION_UNKNOWN, ColumnStore
+
+logger = app_config.CustomLogger('recalibrate')
+
+def load_mult_offset(device_id: str, config_path: str | None = None, device_name: str | None = None) -> list[tuple[float, float]]:
+    '''Calibración del archivo config_path, o la de devices/{nombre}.txt (el nombre se busca en la caché del registro)'''
+    if config_path is not None:
+        with open(config_path, 'r') as file:
+            mult_offset = app_config.parse_device_config(file.read())
+    else:
+        if device_name is None:
+            from device_registry import DeviceRegistry
+            device_name = DeviceRegistry().device_name(device_id)
+        if device_name is None:
+            raise ValueError(f'load_mult_offset >> Unknown name for device {device_id}, use --name or --config')
+        mult_offset = app_config.DeviceConfig(lazy=True).get_mult_offset(device_name)
+    if len(mult_offset) == 0:
+        raise ValueError(f'load_mult_offset >> No calibration found for device {device_id}')
+    return mult_offset
+
+def calibration_counts(store: ColumnStore, device_id) -> Counter:
+    '''Cantidad de muestras por posición de calibración (CALIBRATION_UNKNOWN = sin enteros crudos)'''
+    counts: Counter = Counter()
+    for (_, _, calibration) in store.iter_raw_range(device_id):
+        (positions, sizes) = np.unique(calibration, return_counts=True)
+        counts.update(dict(zip(positions.tolist(), sizes.tolist())))
+    return counts
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Recalibración del historial de un dispositivo')
+    parser.add_argument('--device', required=True, help='deviceId del almacenamiento')
+    parser.add_argument('--name', help='nombre del dispositivo en devices/ (por defecto se busca en la caché del registro)')
+    parser.add_argument('--config', metavar='PATH', help='archivo de calibración a aplicar en lugar de devices/{nombre}.txt')
+    parser.add_argument('--store', default='store', help='directorio del almacenamiento columnar')
+    parser.add_argument('--rollups', action='store_true', help='recalcular los agregados (rollup.py) después de recalibrar')
+    parser.add_argument('--list', action='store_true', help='mostrar las calibraciones registradas y sus muestras')
+    args = parser.parse_args(argv)
+
+    store = ColumnStore(args.store)
+    if args.device not in store.devices():
+        raise ValueError(f'main >> Device {args.device} not found in "{args.store}"')
+
+    if args.list:
+        counts = calibration_counts(store, args.device)
+        for (position, item) in enumerate(store.calibrations(args.device)):
+            print(f'{item["version"]}  {item["registered"]}  {counts.get(position, 0)} muestras')
+        print(f'sin enteros crudos  {counts.get(CALIBRATION_UNKNOWN, 0)} muestras')
+        return
+
+    mult_offset = load_mult_offset(args.device, args.config, args.name)
+    (count, skipped) = store.recalibrate(args.device, mult_offset)
+    version = app_config.calibration_version(mult_offset)
+    logger.info('Device %s: %s samples recalibrated to %s, %s without raw counts', args.device, count, version, skipped)
+
+    if args.rollups:
+        from rollup import RollupStore
+        rollups = RollupStore(store, args.store)
+        rollups.rebuild(args.device)
+        rollups.save()
+        logger.info('Rollups rebuilt for device %s', args.device)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,234 @@
+'''
+Comparación de las series decodificadas con las series de referencia de la agencia.
+
+Formatos soportados (se detectan por la cabecera):
+    DatosSEDC.csv                        separador ";", coma decimal, BOM UTF-8, una columna por variable
+    *_Dato_crudo.csv / *_Dato_validado.csv  "fecha,valor,maximo,minimo", la variable se toma del nombre del archivo
+    messages_decode.csv                  salida de la decodificación (separador ",", punto decimal)
+
+    python reference_compare.py messages_decode.csv DatosSEDC.csv
+    python reference_compare.py --store store --device 13025 JTU01HQ43-Jatunhuaycu43_Temperatura_de_agua_Dato_validado.csv
+
+Las series se alinean por el timestamp más cercano (dentro de tolerance segundos) con una mezcla lineal
+de los dos arreglos ordenados. Por variable se reporta sesgo (decodificado - referencia), RMSE, cobertura
+(muestras de referencia con valor decodificado) y el desfase que minimiza el RMSE. Un desfase solo se acepta
+si une al menos MIN_LAG_PAIRS_FRACTION de los pares sin desfase, y se marca cuando queda en el límite de la búsqueda
+(el mínimo real puede estar más lejos, o las series no tienen un desfase claro).
+'''
+
+import argparse
+import io
+import json
+import math
+import os
+import re
+import sys
+
+import numpy as np
+
+from column_store import VARIABLE_NAMES, ColumnStore
+
+# Columnas de los archivos de la agencia por variable (fecha,valor,maximo,minimo)
+AGENCY_VALUE_COLUMN = 'valor'
+
+AGENCY_FILE_PATTERN = re.compile(r'^[^_]+_(?P<variable>.+)_Dato_(?P<kind>crudo|validado)$')
+
+# Fracción mínima de los pares sin desfase que debe unir un desfase para compararlo por RMSE
+MIN_LAG_PAIRS_FRACTION = 0.9
+
+class TimeSeries:
+    '''Serie ordenada por tiempo: timestamps (int64 epoch) y values (float64 muestras x variables, NaN = sin valor)'''
+
+    def __init__(self, timestamps: np.ndarray, values: np.ndarray, names: list[str]):
+        order = np.argsort(timestamps, kind='stable')
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)[order]
+        self.values = np.asarray(values, dtype=np.float64)[order]
+        self.names = names
+
+    def column(self, name: str) -> np.ndarray | None:
+        if name not in self.names:
+            return None
+        return self.values[:, self.names.index(name)]
+
+    def __len__(self):
+        return len(self.timestamps)
+
+# Hora sin cero a la izquierda ("2024-01-11 0:05:00") y celdas vacías, se normalizan antes de convertir
+_SHORT_HOUR = re.compile(r'(?m)^(\d{4}-\d{2}-\d{2})[ T](\d):')
+
+_EMPTY_CELL = re.compile(r'(?m)(?:^|(?<=;))[ \t]*(?=;|$)')
+
+def load_series_csv(path: str, variable: str | None = None) -> TimeSeries:
+    '''Lee un CSV con la fecha en la primera columna. Con separador ";" los decimales usan coma.
+    En los archivos de la agencia (fecha,valor,maximo,minimo) la columna valor toma el nombre de la variable,
+    indicado en variable o tomado del nombre del archivo.
+    Fechas y valores se convierten con NumPy en un solo paso (datetime64 y loadtxt), las celdas vacías son NaN.'''
+    with open(path, 'r', encoding='utf-8-sig') as file:
+        text = file.read()
+    (header, _, body) = text.partition('\n')
+    if header.strip() == '':
+        raise ValueError(f'load_series_csv >> File "{path}" is empty')
+
+    delimiter = ';' if header.count(';') > header.count(',') else ','
+    names = [name.strip() for name in header.split(delimiter)[1:]]
+    if AGENCY_VALUE_COLUMN in names:
+        if variable is None:
+            match = AGENCY_FILE_PATTERN.match(os.path.splitext(os.path.basename(path))[0])
+            variable = match.group('variable').replace('_', ' ') if match else AGENCY_VALUE_COLUMN
+        names[names.index(AGENCY_VALUE_COLUMN)] = variable
+
+    # a partir de aquí todo usa ";" como separador y "." como decimal
+    body = body.replace(',', '.') if delimiter == ';' else body.replace(',', ';')
+    body = _SHORT_HOUR.sub(r'\1 0\2:', body)
+    rows = [line.partition(';') for line in body.splitlines() if line.strip() != '']
+
+    timestamps = np.array([row[0].strip() for row in rows], dtype='datetime64[s]').astype(np.int64)
+    cells = _EMPTY_CELL.sub('nan', '\n'.join(row[2] for row in rows))
+    values = np.loadtxt(io.StringIO(cells), delimiter=';', dtype=np.float64, ndmin=2) if len(rows) > 0 else np.empty((0, len(names)))
+    return TimeSeries(timestamps, values.reshape(len(rows), len(names)), names)
+
+def load_store_series(store: ColumnStore, device_id, start=None, end=None) -> TimeSeries:
+    '''Serie decodificada de un dispositivo guardada en el ColumnStore'''
+    (timestamps, values) = store.read_range(device_id, start, end)
+    n_vars = values.shape[1]
+    names = VARIABLE_NAMES[:n_vars] + [f'Variable {index + 1}' for index in range(len(VARIABLE_NAMES), n_vars)]
+    return TimeSeries(np.asarray(timestamps), np.asarray(values), names)
+
+def nearest_join(left: np.ndarray, right: np.ndarray, tolerance: int) -> np.ndarray:
+    '''Para cada timestamp de left (ordenado) retorna el índice del timestamp más cercano de right (ordenado),
+    -1 si el más cercano está a más de tolerance segundos.
+    Los dos arreglos se mezclan con un sort estable (timsort, que une dos secuencias ya ordenadas en tiempo lineal)
+    y el vecino anterior/siguiente de cada elemento se obtiene con un acumulado.'''
+    result = np.full(len(left), -1, dtype=np.int64)
+    if len(left) == 0 or len(right) == 0:
+        return result
+
+    merged = np.concatenate([right, left])
+    order = np.argsort(merged, kind='stable')
+    is_right = order < len(right)
+
+    # índice en right del último elemento de right visto hasta cada posición (incluido un empate exacto)
+    previous = np.maximum.accumulate(np.where(is_right, order, -1))
+    # índice en right del siguiente elemento de right desde cada posición
+    following = np.where(is_right, order, len(right))
+    following = np.minimum.accumulate(following[::-1])[::-1]
+
+    left_positions = np.flatnonzero(~is_right)
+    left_index = order[left_positions] - len(right)
+    before = previous[left_positions]
+    after = following[left_positions]
+
+    distance_before = np.where(before >= 0, left[left_index] - right[np.maximum(before, 0)], np.iinfo(np.int64).max)
+    distance_after = np.where(after < len(right), right[np.minimum(after, len(right) - 1)] - left[left_index], np.iinfo(np.int64).max)
+    nearest = np.where(distance_before <= distance_after, before, after)
+    distance = np.minimum(distance_before, distance_after)
+    result[left_index] = np.where(distance <= tolerance, nearest, -1)
+    return result
+
+def _typical_interval(timestamps: np.ndarray) -> int:
+    steps = np.diff(timestamps)
+    steps = steps[steps > 0]
+    return int(np.median(steps)) if len(steps) > 0 else 0
+
+def _errors(decoded_column: np.ndarray, reference_column: np.ndarray, match: np.ndarray) -> np.ndarray:
+    '''Diferencias decodificado - referencia de los pares unidos con valor en las dos series'''
+    matched = match >= 0
+    errors = decoded_column[match[matched]] - reference_column[matched]
+    return errors[~np.isnan(errors)]
+
+def compare_series(decoded: TimeSeries, reference: TimeSeries, tolerance: int | None = None, max_lag: int = 3600,
+                   min_lag_fraction: float = MIN_LAG_PAIRS_FRACTION) -> dict[str, dict]:
+    '''Métricas por variable presente en las dos series.
+    tolerance por defecto es la mitad del intervalo de la referencia. El desfase se busca en múltiplos del
+    intervalo de la referencia entre -max_lag y max_lag segundos (positivo = la serie decodificada está adelantada),
+    solo entre los que unen al menos min_lag_fraction de los pares sin desfase.
+    lag_at_limit indica que el mejor desfase es el mayor buscado.'''
+    interval = _typical_interval(reference.timestamps)
+    if tolerance is None:
+        tolerance = interval // 2
+    steps = max_lag // interval if interval > 0 else 0
+
+    columns = {name: (decoded.column(name), reference.column(name)) for name in reference.names if decoded.column(name) is not None}
+
+    report: dict[str, dict] = {}
+    match = nearest_join(reference.timestamps, decoded.timestamps, tolerance)
+    for name, (decoded_column, reference_column) in columns.items():
+        errors = _errors(decoded_column, reference_column, match)
+        n_reference = int(np.count_nonzero(~np.isnan(reference_column)))
+        report[name] = {
+            'pairs': len(errors),
+            'reference_samples': n_reference,
+            'coverage': len(errors) / n_reference if n_reference > 0 else 0.0,
+            'bias': float(np.mean(errors)) if len(errors) > 0 else None,
+            'rmse': float(np.sqrt(np.mean(errors ** 2))) if len(errors) > 0 else None,
+            'lag_seconds': None,
+            'lag_rmse': None,
+            'lag_pairs': None,
+            'lag_at_limit': False,
+        }
+    # sin pares sin desfase no hay con qué validar un desfase
+    min_pairs = {name: math.ceil(min_lag_fraction * item['pairs']) if item['pairs'] > 0 else None
+                 for name, item in report.items()}
+
+    # desfases en orden 0, -1, 1, -2, 2... la unión se calcula una vez por desfase para todas las variables.
+    # Un desfase reemplaza al anterior solo si mejora el RMSE más allá del error de redondeo
+    for step in sorted(range(-steps, steps + 1), key=abs):
+        shifted = match if step == 0 else nearest_join(reference.timestamps, decoded.timestamps - step * interval, tolerance)
+        for name, (decoded_column, reference_column) in columns.items():
+            if min_pairs[name] is None:
+                continue
+            errors = _errors(decoded_column, reference_column, shifted)
+            if len(errors) == 0 or len(errors) < min_pairs[name]:
+                continue
+            rmse = float(np.sqrt(np.mean(errors ** 2)))
+            best = report[name]['lag_rmse']
+            if best is None or rmse < best - 1e-9 * max(1.0, best):
+                report[name]['lag_seconds'] = step * interval
+                report[name]['lag_rmse'] = rmse
+                report[name]['lag_pairs'] = len(errors)
+                report[name]['lag_at_limit'] = steps > 0 and abs(step) == steps
+    return report
+
+def format_report(report: dict[str, dict]) -> str:
+    lines = [f'{"Variable":<26} {"pares":>8} {"cobertura":>10} {"sesgo":>10} {"RMSE":>10} {"desfase s":>10} {"RMSE desf.":>10} {"pares desf.":>11}']
+    for name, item in report.items():
+        def number(value):
+            return f'{value:>10.4f}' if value is not None else f'{"-":>10}'
+        lag = f'{str(item["lag_seconds"]) + ("*" if item["lag_at_limit"] else ""):>10}' if item['lag_seconds'] is not None else f'{"-":>10}'
+        lag_pairs = f'{item["lag_pairs"]:>11}' if item['lag_pairs'] is not None else f'{"-":>11}'
+        lines.append(f'{name:<26} {item["pairs"]:>8} {item["coverage"]:>10.1%} {number(item["bias"])} {number(item["rmse"])} {lag} '
+                     f'{number(item["lag_rmse"])} {lag_pairs}')
+    if any(item['lag_at_limit'] for item in report.values()):
+        lines.append('* desfase en el límite de la búsqueda (--max-lag), no es un desfase confiable')
+    return '\n'.join(lines)
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Compara la serie decodificada con una serie de referencia')
+    parser.add_argument('files', nargs='+', help='[serie decodificada] serie de referencia')
+    parser.add_argument('--store', help='leer la serie decodificada del almacenamiento columnar en lugar de un CSV')
+    parser.add_argument('--device', help='deviceId a leer del almacenamiento')
+    parser.add_argument('--variable', help='variable de los archivos fecha,valor,maximo,minimo')
+    parser.add_argument('--tolerance', type=int, help='distancia máxima en segundos para unir dos muestras')
+    parser.add_argument('--max-lag', type=int, default=3600, help='desfase máximo buscado en segundos')
+    parser.add_argument('--min-lag-fraction', type=float, default=MIN_LAG_PAIRS_FRACTION,
+                        help='fracción mínima de los pares sin desfase que debe unir un desfase')
+    parser.add_argument('--json', action='store_true', help='imprimir el reporte en JSON')
+    args = parser.parse_args(argv)
+
+    if args.store is not None:
+        if args.device is None or len(args.files) != 1:
+            parser.error('--store requires --device and a single reference file')
+        decoded = load_store_series(ColumnStore(args.store), args.device)
+        reference_path = args.files[0]
+    else:
+        if len(args.files) != 2:
+            parser.error('expected the decoded CSV and the reference CSV')
+        decoded = load_series_csv(args.files[0])
+        reference_path = args.files[1]
+
+    reference = load_series_csv(reference_path, args.variable)
+    report = compare_series(decoded, reference, args.tolerance, args.max_lag, args.min_lag_fraction)
+    print(json.dumps(report, indent=2, ensure_ascii=False) if args.json else format_report(report))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,311 @@
+'''
+Agregados por hora, día y mes de las muestras de cada dispositivo, para consultar rangos largos sin leer
+todas las muestras.
+
+    {root}/{device_id}/rollup_1h.npz     inicio del intervalo y count/sum/min/max por variable
+    {root}/{device_id}/rollup_1d.npz
+    {root}/{device_id}/rollup_1mo.npz
+
+Los agregados ignoran NaN (count es la cantidad de valores por variable). Se actualizan con cada flush del
+ColumnStoreWriter: las horas tocadas se recalculan leyendo el almacenamiento (así una muestra reemplazada no
+se cuenta dos veces), los días se recalculan desde las horas y los meses desde los días.
+
+    python rollup.py --device 13025 --start 2024-01-01 --end 2024-07-01 --resolution 1d
+    python rollup.py --rebuild
+'''
+
+import argparse
+import os
+import sys
+
+from datetime import datetime
+
+import numpy as np
+
+import app_config
+
+from column_store import ColumnStore, SampleStore, _to_epoch, csv_header
+
+from models.decoded_batch_model import epoch_to_datetime
+
+logger = app_config.CustomLogger('rollup')
+
+TIER_HOUR = '1h'
+
+TIER_DAY = '1d'
+
+TIER_MONTH = '1mo'
+
+# De la más fina a la más gruesa, con la duración nominal del intervalo en segundos
+TIERS = {TIER_HOUR: 3600, TIER_DAY: 86400, TIER_MONTH: 30 * 86400}
+
+def bucket_starts(timestamps: np.ndarray, tier: str) -> np.ndarray:
+    '''Inicio (epoch) del intervalo del tier que contiene cada timestamp'''
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    if tier == TIER_MONTH:
+        return timestamps.astype('datetime64[s]').astype('datetime64[M]').astype('datetime64[s]').astype(np.int64)
+    return timestamps // TIERS[tier] * TIERS[tier]
+
+def bucket_ends(starts: np.ndarray, tier: str) -> np.ndarray:
+    '''Fin (inicio del intervalo siguiente) de los intervalos del tier que inician en starts'''
+    starts = np.asarray(starts, dtype=np.int64)
+    if tier == TIER_MONTH:
+        return (starts.astype('datetime64[s]').astype('datetime64[M]') + 1).astype('datetime64[s]').astype(np.int64)
+    return starts + TIERS[tier]
+
+def bucket_spans(starts: np.ndarray, tier: str) -> tuple[np.ndarray, np.ndarray]:
+    '''Une los intervalos consecutivos (starts ordenado y sin repetidos) en rangos [inicio, fin)'''
+    ends = bucket_ends(starts, tier)
+    breaks = np.flatnonzero(starts[1:] != ends[:-1]) + 1
+    return starts[np.append(0, breaks)], ends[np.append(breaks, len(starts)) - 1]
+
+class Aggregates:
+    '''Intervalos ordenados por inicio con count (int64) y sum/min/max (float64), matrices intervalos x variables'''
+
+    __slots__ = ('starts', 'count', 'sum', 'min', 'max')
+
+    def __init__(self, starts: np.ndarray, count: np.ndarray, sum: np.ndarray, min: np.ndarray, max: np.ndarray):
+        self.starts = starts
+        self.count = count
+        self.sum = sum
+        self.min = min
+        self.max = max
+
+    @classmethod
+    def empty(cls, n_vars: int) -> 'Aggregates':
+        return cls(np.empty(0, dtype=np.int64), np.empty((0, n_vars), dtype=np.int64),
+                   *(np.empty((0, n_vars), dtype=np.float64) for _ in range(3)))
+
+    @classmethod
+    def from_samples(cls, starts: np.ndarray, values: np.ndarray) -> 'Aggregates':
+        '''Agrega muestras ordenadas por starts (inicio del intervalo de cada muestra)'''
+        if len(starts) == 0:
+            return cls.empty(values.shape[1])
+        first = np.flatnonzero(np.append(True, starts[1:] != starts[:-1]))
+        present = ~np.isnan(values)
+        return cls(starts[first],
+                   np.add.reduceat(present.astype(np.int64), first, axis=0),
+                   np.add.reduceat(np.where(present, values, 0.0), first, axis=0),
+                   np.fmin.reduceat(values, first, axis=0),
+                   np.fmax.reduceat(values, first, axis=0))
+
+    def regroup(self, starts: np.ndarray) -> 'Aggregates':
+        '''Une los intervalos consecutivos con el mismo inicio nuevo (starts debe estar ordenado)'''
+        if len(starts) == 0:
+            return Aggregates.empty(self.count.shape[1])
+        first = np.flatnonzero(np.append(True, starts[1:] != starts[:-1]))
+        # fmin/fmax ignoran los NaN de los intervalos sin valores
+        return Aggregates(starts[first],
+                          np.add.reduceat(self.count, first, axis=0),
+                          np.add.reduceat(self.sum, first, axis=0),
+                          np.fmin.reduceat(self.min, first, axis=0),
+                          np.fmax.reduceat(self.max, first, axis=0))
+
+    def slice(self, start: int, end: int) -> 'Aggregates':
+        '''Intervalos con inicio en [start, end)'''
+        first = int(np.searchsorted(self.starts, start, side='left'))
+        last = int(np.searchsorted(self.starts, end, side='left'))
+        return Aggregates(*(array[first:last] for array in self.arrays()))
+
+    def in_spans(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        '''Máscara de los intervalos con inicio en algún [starts[i], ends[i]) (rangos ordenados y sin solaparse)'''
+        first = np.searchsorted(self.starts, starts, side='left')
+        last = np.searchsorted(self.starts, ends, side='left')
+        # +1 al entrar en un rango y -1 al salir
+        delta = np.zeros(len(self.starts) + 1, dtype=np.int64)
+        np.add.at(delta, first, 1)
+        np.add.at(delta, last, -1)
+        return np.cumsum(delta[:-1]) > 0
+
+    def select(self, mask: np.ndarray) -> 'Aggregates':
+        return Aggregates(*(array[mask] for array in self.arrays()))
+
+    def replace_spans(self, starts: np.ndarray, ends: np.ndarray, other: 'Aggregates') -> 'Aggregates':
+        '''Reemplaza los intervalos con inicio en cada [starts[i], ends[i]) por los de other, en una sola pasada'''
+        keep = ~self.in_spans(starts, ends)
+        width = max(self.count.shape[1], other.count.shape[1])
+        order = np.argsort(np.concatenate([self.starts[keep], other.starts]), kind='stable')
+        return Aggregates(*(np.concatenate([_widen(array[keep], width), _widen(new, width)])[order]
+                            for array, new in zip(self.arrays(), other.arrays())))
+
+    def arrays(self) -> tuple[np.ndarray, ...]:
+        return self.starts, self.count, self.sum, self.min, self.max
+
+    @property
+    def mean(self) -> np.ndarray:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 0, self.sum / np.maximum(self.count, 1), np.nan)
+
+    def __len__(self):
+        return len(self.starts)
+
+def _widen(array: np.ndarray, width: int) -> np.ndarray:
+    '''Agrega columnas de variables faltantes (count 0, NaN en el resto)'''
+    if array.ndim == 1 or array.shape[1] == width:
+        return array
+    fill = 0 if array.dtype == np.int64 else np.nan
+    return np.hstack([array, np.full((len(array), width - array.shape[1]), fill, dtype=array.dtype)])
+
+class RollupStore:
+    '''Agregados de las muestras de store guardados en root (por defecto el directorio del ColumnStore)'''
+
+    def __init__(self, store: SampleStore, root: str = 'store'):
+        self.store = store
+        self.root = root
+        self._tiers: dict[tuple[str, str], Aggregates] = {}
+        self._dirty: set[tuple[str, str]] = set()
+
+    def _path(self, device_id: str, tier: str) -> str:
+        return os.path.join(self.root, device_id, f'rollup_{tier}.npz')
+
+    def tier(self, device_id, tier: str) -> Aggregates:
+        device_id = str(device_id)
+        key = (device_id, tier)
+        aggregates = self._tiers.get(key)
+        if aggregates is not None:
+            return aggregates
+        path = self._path(device_id, tier)
+        if os.path.isfile(path):
+            with np.load(path) as data:
+                aggregates = Aggregates(data['starts'], data['count'], data['sum'], data['min'], data['max'])
+        else:
+            aggregates = Aggregates.empty(self.store.n_vars(device_id) or 0)
+        self._tiers[key] = aggregates
+        return aggregates
+
+    def _set(self, device_id: str, tier: str, aggregates: Aggregates):
+        self._tiers[(device_id, tier)] = aggregates
+        self._dirty.add((device_id, tier))
+
+    # Update
+
+    def update(self, device_id, timestamps: np.ndarray):
+        '''Recalcula solo las horas que contienen timestamps (muestras ya escritas en store), cada grupo de horas
+        consecutivas con una lectura de store, y luego los días y meses que contienen esas horas'''
+        if len(timestamps) == 0:
+            return
+        device_id = str(device_id)
+        starts = np.unique(bucket_starts(timestamps, TIER_HOUR))
+        (span_starts, span_ends) = bucket_spans(starts, TIER_HOUR)
+        parts = [self.store.read_range(device_id, int(start), int(end)) for (start, end) in zip(span_starts, span_ends)]
+        hours = Aggregates.from_samples(bucket_starts(np.concatenate([samples for (samples, _) in parts]), TIER_HOUR),
+                                        np.concatenate([values for (_, values) in parts]))
+        self._set(device_id, TIER_HOUR, self.tier(device_id, TIER_HOUR).replace_spans(span_starts, span_ends, hours))
+
+        finer = TIER_HOUR
+        for coarser in (TIER_DAY, TIER_MONTH):
+            starts = np.unique(bucket_starts(starts, coarser))
+            (span_starts, span_ends) = bucket_spans(starts, coarser)
+            finer_tier = self.tier(device_id, finer)
+            source = finer_tier.select(finer_tier.in_spans(span_starts, span_ends))
+            regrouped = source.regroup(bucket_starts(source.starts, coarser))
+            self._set(device_id, coarser, self.tier(device_id, coarser).replace_spans(span_starts, span_ends, regrouped))
+            finer = coarser
+
+    def rebuild(self, device_id):
+        '''Recalcula todos los agregados del dispositivo desde store'''
+        device_id = str(device_id)
+        (timestamps, values) = self.store.read_range(device_id)
+        aggregates = Aggregates.from_samples(bucket_starts(timestamps, TIER_HOUR), np.asarray(values))
+        self._set(device_id, TIER_HOUR, aggregates)
+        for tier in (TIER_DAY, TIER_MONTH):
+            aggregates = aggregates.regroup(bucket_starts(aggregates.starts, tier))
+            self._set(device_id, tier, aggregates)
+
+    def save(self):
+        '''Guarda los agregados modificados'''
+        for (device_id, tier) in self._dirty:
+            aggregates = self._tiers[(device_id, tier)]
+            os.makedirs(os.path.join(self.root, device_id), exist_ok=True)
+            temp_path = self._path(device_id, tier) + '.tmp.npz'
+            np.savez(temp_path, starts=aggregates.starts, count=aggregates.count, sum=aggregates.sum,
+                     min=aggregates.min, max=aggregates.max)
+            os.replace(temp_path, self._path(device_id, tier))
+        self._dirty.clear()
+
+    # Query
+
+    def select_tier(self, start: int, end: int, resolution: int) -> str:
+        '''Tier más grueso cuyo intervalo no supera resolution y cuyos límites coinciden con start y end.
+        Si ninguno coincide se usa el de horas (los intervalos de los extremos pueden incluir muestras fuera del rango)'''
+        for tier in reversed(TIERS):
+            if TIERS[tier] > resolution:
+                continue
+            aligned = bucket_starts(np.array([start, end]), tier)
+            if aligned[0] == start and aligned[1] == end:
+                return tier
+        return TIER_HOUR
+
+    def query(self, device_id, start: datetime | int, end: datetime | int, resolution: int | str = TIER_HOUR) -> tuple[str, Aggregates]:
+        '''Agregados del rango [start, end) con intervalos de resolution segundos (o el nombre de un tier).
+        Retorna el tier leído y los agregados; si resolution es mayor que el tier, los intervalos se unen
+        en bloques de resolution segundos desde start.'''
+        start = _to_epoch(start, 0)
+        end = _to_epoch(end, 0)
+        if isinstance(resolution, str):
+            if resolution not in TIERS:
+                raise ValueError(f'RollupStore.query >> Unknown resolution "{resolution}"')
+            tier = resolution
+            resolution = TIERS[tier]
+        else:
+            tier = self.select_tier(start, end, resolution)
+        first = int(bucket_starts(np.array([start]), tier)[0])
+        result = self.tier(device_id, tier).slice(first, end)
+        if resolution > TIERS[tier] and tier != TIER_MONTH:
+            result = result.regroup(start + (result.starts - start) // resolution * resolution)
+        return tier, result
+
+def format_aggregates(aggregates: Aggregates) -> list[list]:
+    '''Filas fecha, y por variable media/min/max (vacío si el intervalo no tiene valores)'''
+    rows = []
+    mean = aggregates.mean
+    for row, start in enumerate(aggregates.starts.tolist()):
+        cells = [epoch_to_datetime(start)]
+        for column in range(aggregates.count.shape[1]):
+            if aggregates.count[row, column] == 0:
+                cells += [None, None, None]
+            else:
+                cells += [round(float(mean[row, column]), 4), float(aggregates.min[row, column]), float(aggregates.max[row, column])]
+        rows.append(cells)
+    return rows
+
+def main(argv: list[str] | None = None):
+    import csv
+
+    parser = argparse.ArgumentParser(description='Agregados por hora, día y mes del almacenamiento')
+    parser.add_argument('--store', default='store', help='directorio del almacenamiento columnar y de los agregados')
+    parser.add_argument('--sqlite', metavar='PATH', help='leer las muestras de la base SQLite PATH')
+    parser.add_argument('--device', action='append', dest='devices', help='deviceId, se puede repetir (por defecto todos)')
+    parser.add_argument('--rebuild', action='store_true', help='recalcular los agregados desde las muestras')
+    parser.add_argument('--start', type=datetime.fromisoformat, help='fecha inicial de la consulta (ISO 8601)')
+    parser.add_argument('--end', type=datetime.fromisoformat, help='fecha final de la consulta (ISO 8601)')
+    parser.add_argument('--resolution', default=TIER_DAY, help='1h, 1d, 1mo o segundos')
+    args = parser.parse_args(argv)
+
+    if args.sqlite:
+        from sqlite_store import SQLiteStore
+        store = SQLiteStore(args.sqlite)
+    else:
+        store = ColumnStore(args.store)
+    rollups = RollupStore(store, args.store)
+    devices = args.devices or store.devices()
+
+    if args.rebuild:
+        for device_id in devices:
+            rollups.rebuild(device_id)
+        rollups.save()
+        logger.info('Rollups rebuilt for %s devices', len(devices))
+    if args.start is None or args.end is None:
+        return
+
+    resolution = args.resolution if args.resolution in TIERS else int(args.resolution)
+    csv_writer = csv.writer(sys.stdout)
+    for device_id in devices:
+        (tier, aggregates) = rollups.query(device_id, args.start, args.end, resolution)
+        names = csv_header(aggregates.count.shape[1])[1:]
+        csv_writer.writerow(['Fecha'] + [f'{name} {stat}' for name in names for stat in ('media', 'min', 'max')])
+        csv_writer.writerows(format_aggregates(aggregates))
+        logger.info('Device %s: %s intervals from tier %s', device_id, len(aggregates), tier)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,121 @@
+'''
+Índice de muestras por dispositivo (timestamp -> hiveRxTime, valores) para descartar las muestras repetidas
+de tramas que se superponen. Se guarda en {root}/{device_id}/index.npz y se actualiza en cada ejecución.
+'''
+
+import os
+
+import numpy as np
+
+import app_config
+
+logger = app_config.CustomLogger('sample_index')
+
+POLICY_NEWEST = 'newest'
+
+POLICY_FIRST = 'first'
+
+class SampleIndex:
+    '''Política de conflicto cuando llega una muestra con un timestamp ya indexado y valores distintos:
+    newest: gana la trama con hiveRxTime más reciente (la muestra se emite de nuevo con los valores nuevos).
+    first: se conserva la primera muestra recibida.
+    Las muestras con los mismos valores nunca se emiten dos veces.'''
+
+    def __init__(self, root: str = 'store', policy: str = POLICY_NEWEST):
+        if policy not in (POLICY_NEWEST, POLICY_FIRST):
+            raise ValueError(f'SampleIndex >> Unknown policy "{policy}"')
+        self.root = root
+        self.policy = policy
+        self._devices: dict[str, dict[int, tuple[int, bytes]]] = {}
+        self._widths: dict[str, int] = {}
+        self._dirty: set[str] = set()
+
+    def _path(self, device_id: str) -> str:
+        return os.path.join(self.root, device_id, 'index.npz')
+
+    def _load(self, device_id: str) -> dict[int, tuple[int, bytes]]:
+        index = self._devices.get(device_id)
+        if index is not None:
+            return index
+        index = {}
+        path = self._path(device_id)
+        if os.path.isfile(path):
+            with np.load(path) as data:
+                values = data['values']
+                self._widths[device_id] = values.shape[1]
+                for ts, rx, row in zip(data['timestamps'].tolist(), data['rx_times'].tolist(), values):
+                    index[ts] = (rx, row.tobytes())
+        self._devices[device_id] = index
+        return index
+
+    def __len__(self):
+        return sum(len(index) for index in self._devices.values())
+
+    def merge(self, device_id, timestamps: np.ndarray, rx_times: np.ndarray, values: np.ndarray) -> np.ndarray:
+        '''Agrega las muestras al índice y retorna la máscara de las que se deben emitir (nuevas o reemplazadas)'''
+        (emit, updates) = self.prepare(device_id, timestamps, rx_times, values)
+        self.commit(device_id, updates)
+        return emit
+
+    def prepare(self, device_id, timestamps: np.ndarray, rx_times: np.ndarray, values: np.ndarray) -> tuple[np.ndarray, dict[int, tuple[int, bytes]]]:
+        '''Igual que merge pero sin modificar el índice: retorna la máscara y los cambios que aplica commit.
+        Permite agregar las muestras al índice solo después de escribirlas en el almacenamiento'''
+        device_id = str(device_id)
+        index = self._load(device_id)
+        values = np.ascontiguousarray(values, dtype=np.float64)
+        width = self._widths.setdefault(device_id, values.shape[1])
+        if values.shape[1] > width:
+            raise ValueError(f'SampleIndex >> Device {device_id} indexes {width} variables, received {values.shape[1]}')
+        if values.shape[1] < width:
+            values = np.hstack([values, np.full((len(values), width - values.shape[1]), np.nan)])
+
+        emit = np.zeros(len(timestamps), dtype=bool)
+        newest = self.policy == POLICY_NEWEST
+        # los cambios se ven entre las muestras del mismo bloque, el índice no se toca
+        updates: dict[int, tuple[int, bytes]] = {}
+        for row, (ts, rx) in enumerate(zip(timestamps.tolist(), rx_times.tolist())):
+            key = values[row].tobytes()
+            current = updates.get(ts) or index.get(ts)
+            if current is None:
+                updates[ts] = (rx, key)
+                emit[row] = True
+            elif current[1] != key and newest and rx >= current[0]:
+                updates[ts] = (rx, key)
+                emit[row] = True
+        return emit, updates
+
+    def commit(self, device_id, updates: dict[int, tuple[int, bytes]]):
+        '''Aplica los cambios retornados por prepare'''
+        if len(updates) == 0:
+            return
+        device_id = str(device_id)
+        self._load(device_id).update(updates)
+        self._dirty.add(device_id)
+
+    def prune(self, before_epoch: int) -> int:
+        '''Quita de los dispositivos cargados las muestras anteriores a before_epoch (también del archivo al guardar).
+        Limita la memoria de un proceso de larga duración; si llega de nuevo una muestra tan antigua se vuelve a
+        agregar al almacenamiento y el lector conserva el último valor. Retorna la cantidad de muestras quitadas.'''
+        removed = 0
+        for device_id, index in self._devices.items():
+            old = [ts for ts in index if ts < before_epoch]
+            for ts in old:
+                del index[ts]
+            if len(old) > 0:
+                removed += len(old)
+                self._dirty.add(device_id)
+        return removed
+
+    def save(self):
+        '''Guarda los dispositivos modificados'''
+        for device_id in self._dirty:
+            index = self._devices[device_id]
+            width = self._widths[device_id]
+            timestamps = np.fromiter(index.keys(), dtype=np.int64, count=len(index))
+            rx_times = np.fromiter((item[0] for item in index.values()), dtype=np.int64, count=len(index))
+            values = np.frombuffer(b''.join(item[1] for item in index.values()), dtype=np.float64).reshape(-1, width)
+            os.makedirs(os.path.join(self.root, device_id), exist_ok=True)
+            temp_path = self._path(device_id) + '.tmp.npz'
+            np.savez(temp_path, timestamps=timestamps, rx_times=rx_times, values=values)
+            os.replace(temp_path, self._path(device_id))
+        self._dirty.clear()
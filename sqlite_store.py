@@ -0,0 +1,210 @@
+'''
+Almacenamiento de muestras en SQLite, alternativo al ColumnStore, para consultas por dispositivo y rango de fechas.
+
+    samples(device_id, ts, rx_time, v1..vN)     clave primaria (device_id, ts), NaN se guarda como NULL
+    frames(device_id, packet_id, initial_ts, rx_time)   packet_id único por dispositivo, en orden de llegada
+    devices(device_id, n_vars)
+
+    store = SQLiteStore('store.sqlite')
+    (timestamps, values) = store.read_range('13025', datetime(2024, 4, 1), datetime(2024, 5, 1))
+
+La base usa WAL: los lectores (tableros) no bloquean al proceso que escribe.
+Cada flush del ColumnStoreWriter es una transacción con un executemany por dispositivo. Una muestra con un
+timestamp ya guardado reemplaza a la anterior (policy newest) o se descarta (policy first), así las tramas
+que se superponen no necesitan el SampleIndex.
+'''
+
+import sqlite3
+
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import repeat
+from typing import Iterator
+
+import numpy as np
+
+import app_config
+
+from column_store import SampleStore, _to_epoch
+
+from sample_index import POLICY_FIRST, POLICY_NEWEST
+
+logger = app_config.CustomLogger('sqlite_store')
+
+# Columnas de valores creadas al inicio, se agregan más si un dispositivo envía más variables
+DEFAULT_COLUMNS = 4
+
+# Filas por lectura del cursor en iter_range
+FETCH_ROWS = 100000
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS devices (
+    device_id TEXT PRIMARY KEY,
+    n_vars INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS samples (
+    device_id TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    rx_time INTEGER,
+    {columns},
+    PRIMARY KEY (device_id, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS frames (
+    device_id TEXT NOT NULL,
+    packet_id INTEGER NOT NULL,
+    initial_ts INTEGER NOT NULL,
+    rx_time INTEGER NOT NULL,
+    UNIQUE (device_id, packet_id)
+);
+'''
+
+class SQLiteStore(SampleStore):
+    def __init__(self, path: str = 'store.sqlite', policy: str = POLICY_NEWEST):
+        if policy not in (POLICY_NEWEST, POLICY_FIRST):
+            raise ValueError(f'SQLiteStore >> Unknown policy "{policy}"')
+        self.path = path
+        self.policy = policy
+        # autocommit: las transacciones se abren explícitamente en transaction()
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self._depth = 0
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        columns = ',\n    '.join(f'v{index + 1} REAL' for index in range(DEFAULT_COLUMNS))
+        self.connection.executescript(_SCHEMA.format(columns=columns))
+        self._columns = self._count_columns()
+        self._n_vars: dict[str, int] = dict(self.connection.execute('SELECT device_id, n_vars FROM devices'))
+
+    def _count_columns(self) -> int:
+        names = [row[1] for row in self.connection.execute('PRAGMA table_info(samples)')]
+        return sum(1 for name in names if name.startswith('v'))
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        '''Agrupa las escrituras en una transacción (las transacciones anidadas se unen a la externa)'''
+        if self._depth > 0:
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+            return
+        self.connection.execute('BEGIN IMMEDIATE')
+        self._depth = 1
+        try:
+            yield
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            # los dispositivos agregados en la transacción se descartan también del caché
+            self._columns = self._count_columns()
+            self._n_vars = dict(self.connection.execute('SELECT device_id, n_vars FROM devices'))
+            raise
+        else:
+            self.connection.execute('COMMIT')
+        finally:
+            self._depth = 0
+
+    # Meta
+
+    def devices(self) -> list[str]:
+        return sorted(self._n_vars)
+
+    def n_vars(self, device_id) -> int | None:
+        return self._n_vars.get(str(device_id))
+
+    def _ensure_n_vars(self, device_id: str, n_vars: int) -> int:
+        '''Retorna la cantidad de variables del dispositivo, la fija con n_vars la primera vez'''
+        current = self._n_vars.get(device_id)
+        if current is not None:
+            if n_vars > current:
+                raise ValueError(f'SQLiteStore >> Device {device_id} stores {current} variables, received {n_vars}')
+            return current
+        for index in range(self._columns, n_vars):
+            self.connection.execute(f'ALTER TABLE samples ADD COLUMN v{index + 1} REAL')
+        self._columns = max(self._columns, n_vars)
+        self.connection.execute('INSERT INTO devices (device_id, n_vars) VALUES (?, ?)', (device_id, n_vars))
+        self._n_vars[device_id] = n_vars
+        return n_vars
+
+    # Write
+
+    def _insert_sql(self, width: int) -> str:
+        names = [f'v{index + 1}' for index in range(width)]
+        sql = (f'INSERT INTO samples (device_id, ts, rx_time, {", ".join(names)}) '
+               f'VALUES (?, ?, ?, {", ".join("?" * width)}) ON CONFLICT (device_id, ts) DO ')
+        if self.policy == POLICY_FIRST:
+            return sql + 'NOTHING'
+        # igual que el SampleIndex: no reemplaza una muestra recibida después (hiveRxTime mayor)
+        return (sql + 'UPDATE SET rx_time = excluded.rx_time, ' + ', '.join(f'{name} = excluded.{name}' for name in names) +
+                ' WHERE excluded.rx_time IS NULL OR samples.rx_time IS NULL OR excluded.rx_time >= samples.rx_time')
+
+    def append(self, device_id, timestamps: np.ndarray, values: np.ndarray, rx_times: np.ndarray | None = None,
+               raw: np.ndarray | None = None, calibration: np.ndarray | None = None):
+        '''Agrega o reemplaza muestras (timestamps int64 epoch, values float64 muestras x variables).
+        La base guarda solo los valores calibrados, raw y calibration se ignoran'''
+        if len(timestamps) == 0:
+            return
+        device_id = str(device_id)
+        values = np.asarray(values, dtype=np.float64)
+        with self.transaction():
+            width = self._ensure_n_vars(device_id, values.shape[1])
+            if values.shape[1] < width:
+                values = np.hstack([values, np.full((len(values), width - values.shape[1]), np.nan)])
+            rx_column = repeat(None) if rx_times is None else np.asarray(rx_times, dtype=np.int64).tolist()
+            # sqlite3 guarda NaN como NULL
+            rows = zip(repeat(device_id), np.asarray(timestamps, dtype=np.int64).tolist(), rx_column, *values.T.tolist())
+            self.connection.executemany(self._insert_sql(width), rows)
+
+    def append_frames(self, device_id, frames: np.ndarray):
+        '''Agrega filas (packetId, fecha inicial epoch, hiveRxTime epoch) al registro de tramas'''
+        if len(frames) == 0:
+            return
+        rows = zip(repeat(str(device_id)), *np.asarray(frames, dtype=np.int64).reshape(-1, 3).T.tolist())
+        with self.transaction():
+            # igual que el ColumnStore: se conserva la primera fila de cada packetId, en el orden de llegada
+            self.connection.executemany('INSERT OR IGNORE INTO frames (device_id, packet_id, initial_ts, rx_time) '
+                                        'VALUES (?, ?, ?, ?)', rows)
+
+    # Read
+
+    def iter_range(self, device_id, start: datetime | int | None = None, end: datetime | int | None = None) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        '''Retorna por bloques de FETCH_ROWS (timestamps, values) con las muestras en [start, end), ordenadas'''
+        device_id = str(device_id)
+        width = self._n_vars.get(device_id)
+        if width is None:
+            return
+        columns = ', '.join(f'v{index + 1}' for index in range(width))
+        cursor = self.connection.execute(f'SELECT ts, {columns} FROM samples WHERE device_id = ? AND ts >= ? AND ts < ? ORDER BY ts',
+                                         (device_id, _to_epoch(start, -2 ** 62), _to_epoch(end, 2 ** 62)))
+        while True:
+            rows = cursor.fetchmany(FETCH_ROWS)
+            if len(rows) == 0:
+                break
+            # None (NULL) se convierte en NaN
+            matrix = np.array(rows, dtype=np.float64).reshape(len(rows), width + 1)
+            timestamps = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+            yield timestamps, matrix[:, 1:]
+
+    def read_range(self, device_id, start: datetime | int | None = None, end: datetime | int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        '''Igual que iter_range pero une los bloques en un solo par de arreglos'''
+        parts = list(self.iter_range(device_id, start, end))
+        width = self.n_vars(device_id) or 0
+        if len(parts) == 0:
+            return np.empty(0, dtype=np.int64), np.empty((0, width), dtype=np.float64)
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+    def read_frames(self, device_id) -> np.ndarray:
+        '''Retorna la matriz (packetId, fecha inicial, hiveRxTime) de las tramas guardadas, en el orden en que llegaron'''
+        rows = self.connection.execute('SELECT packet_id, initial_ts, rx_time FROM frames WHERE device_id = ? ORDER BY rowid',
+                                       (str(device_id),)).fetchall()
+        return np.array(rows, dtype=np.int64).reshape(-1, 3)
@@ -0,0 +1,81 @@
+'''
+Descarga concurrente de mensajes: divide el rango de fechas en ventanas aceptadas por el servicio
+y por dispositivo, consulta con un límite de concurrencia y une los resultados sin repetidos.
+'''
+
+import asyncio
+
+from datetime import datetime, timedelta
+from typing import Iterable
+
+import app_config
+
+from swarm_provider import SwarmClient
+
+logger = app_config.CustomLogger('swarm_fetch')
+
+MAX_WINDOW = timedelta(days=30)
+
+def split_windows(start_date: datetime, end_date: datetime, window: timedelta = MAX_WINDOW) -> list[tuple[datetime, datetime]]:
+    '''Divide [start_date, end_date] en ventanas consecutivas de máximo window'''
+    if end_date < start_date:
+        raise ValueError('split_windows >> end_date is before start_date')
+    windows: list[tuple[datetime, datetime]] = []
+    current = start_date
+    while True:
+        window_end = min(current + window, end_date)
+        windows.append((current, window_end))
+        if window_end >= end_date:
+            return windows
+        current = window_end
+
+def merge_messages(results: Iterable[list[dict]]) -> list[dict]:
+    '''Une las respuestas descartando paquetes repetidos (packetId) y las ordena por hiveRxTime'''
+    merged: dict[int, dict] = {}
+    for messages in results:
+        for message in messages:
+            if isinstance(message, dict):
+                merged.setdefault(message['packetId'], message)
+    return sorted(merged.values(), key=lambda message: (message['hiveRxTime'], message['packetId']))
+
+async def fetch_windows_async(client: SwarmClient,
+                              windows: Iterable[tuple[datetime, datetime, str | None]],
+                              concurrency: int = 4) -> list[dict]:
+    '''Consulta las ventanas (inicio, fin, deviceId) con a lo sumo concurrency peticiones en curso'''
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(window_start: datetime, window_end: datetime, device_id: str | None) -> list[dict]:
+        async with semaphore:
+            messages = await asyncio.to_thread(client.get_messages, window_start, window_end, device_id)
+            logger.debug('fetch window start=%s end=%s device_id=%s messages=%s', window_start, window_end, device_id, len(messages))
+            return messages if isinstance(messages, list) else []
+
+    tasks = [fetch(window_start, window_end, device_id) for (window_start, window_end, device_id) in windows]
+    return merge_messages(await asyncio.gather(*tasks))
+
+async def fetch_messages_async(client: SwarmClient,
+                               start_date: datetime,
+                               end_date: datetime,
+                               device_ids: list[str] | None = None,
+                               concurrency: int = 4,
+                               window: timedelta = MAX_WINDOW) -> list[dict]:
+    '''Consulta todas las ventanas (rango x dispositivo) con a lo sumo concurrency peticiones en curso'''
+    windows = [(window_start, window_end, device_id)
+               for (window_start, window_end) in split_windows(start_date, end_date, window)
+               for device_id in (device_ids or [None])]
+    return await fetch_windows_async(client, windows, concurrency)
+
+def fetch_messages(client: SwarmClient,
+                   start_date: datetime,
+                   end_date: datetime,
+                   device_ids: list[str] | None = None,
+                   concurrency: int = 4,
+                   window: timedelta = MAX_WINDOW) -> list[dict]:
+    '''Versión bloqueante de fetch_messages_async'''
+    return asyncio.run(fetch_messages_async(client, start_date, end_date, device_ids, concurrency, window))
+
+def fetch_windows(client: SwarmClient,
+                  windows: Iterable[tuple[datetime, datetime, str | None]],
+                  concurrency: int = 4) -> list[dict]:
+    '''Versión bloqueante de fetch_windows_async'''
+    return asyncio.run(fetch_windows_async(client, windows, concurrency))
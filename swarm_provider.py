@@ -1,20 +1,46 @@
+import base64
+import json
+import os
+import random
+import threading
+import time
+
 import requests
 
+from requests.adapters import HTTPAdapter
+
 from datetime import datetime, timezone
 
 from models.device_model import DeviceModel
 
 import app_config
 
-API_HOST = 'https://bumblebee.hive.swarm.space'
+import metrics
+
+LOGIN_PATH = '/hive/login'
+
+LOGOUT_PATH = '/hive/logout'
+
+DEVICES_PATH = '/hive/api/v1/devices'
 
-LOGIN_URL = f'{API_HOST}/hive/login'
+MESSAGES_PATH = '/hive/api/v1/messages'
 
-LOGOUT_URL = f'{API_HOST}/hive/logout'
+_URL_PATHS = {
+    'LOGIN_URL': LOGIN_PATH,
+    'LOGOUT_URL': LOGOUT_PATH,
+    'DEVICES_URL': DEVICES_PATH,
+    'MESSAGES_URL': MESSAGES_PATH,
+}
 
-DEVICES_URL = f'{API_HOST}/hive/api/v1/devices'
+def __getattr__(name: str):
+    '''API_HOST y las URL (LOGIN_URL, ...) se arman con [Api] host de config.ini al usarlas, no al importar'''
+    if name == 'API_HOST':
+        return app_config.API_HOST
+    if name in _URL_PATHS:
+        return f'{app_config.API_HOST}{_URL_PATHS[name]}'
+    raise AttributeError(f"module 'swarm_provider' has no attribute '{name}'")
 
-MESSAGES_URL = f'{API_HOST}/hive/api/v1/messages'
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
 
 logger = app_config.CustomLogger('swarm_provider')
 
@@ -27,67 +53,231 @@ def _get_utc_ISO_8601_datetime_str(date: datetime | None) -> str | None:
     utc_time = date.astimezone(timezone.utc)
     return utc_time.isoformat()
 
-def login(username=app_config.USERNAME, password=app_config.PASSWORD):
-    session = requests.Session()
-    login_data = {
-        'username': username,
-        'password': password
-    }
+def _get_token_expiration(token: str, default_ttl: float) -> float:
+    '''Retorna el instante (time.time()) en que expira el token. Usa el campo exp del JWT si existe'''
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload))['exp']
+        return float(exp)
+    except Exception:
+        return time.time() + default_ttl
+
+def _response_message(response: requests.Response) -> str | None:
     try:
-        response = session.post(LOGIN_URL, data=login_data)
+        return response.json().get('message')
+    except Exception:
+        return None
+
+class SwarmClient:
+    '''Cliente de los servicios swarm.
+    Mantiene una sola sesión con conexiones reutilizables, guarda el token hasta que expira (o el servicio
+    responde 401) y reintenta los errores 429/5xx con espera exponencial aleatoria.
+    Se puede usar desde varios hilos a la vez (pool_size conexiones).'''
+
+    def __init__(self,
+                 username: str | None = None,
+                 password: str | None = None,
+                 api_host: str | None = None,
+                 connect_timeout: float | None = None,
+                 read_timeout: float | None = None,
+                 max_retries: int | None = None,
+                 backoff_base: float | None = None,
+                 backoff_max: float | None = None,
+                 token_ttl: float | None = None,
+                 token_cache: str | None = None,
+                 pool_size: int = 10):
+        '''Los parámetros sin valor se leen de config.ini'''
+        self.username = app_config.USERNAME if username is None else username
+        self.password = app_config.PASSWORD if password is None else password
+        self.api_host = (app_config.API_HOST if api_host is None else api_host).rstrip('/')
+        self.timeout = (app_config.API_CONNECT_TIMEOUT if connect_timeout is None else connect_timeout,
+                        app_config.API_READ_TIMEOUT if read_timeout is None else read_timeout)
+        self.max_retries = app_config.API_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = app_config.API_BACKOFF_BASE if backoff_base is None else backoff_base
+        self.backoff_max = app_config.API_BACKOFF_MAX if backoff_max is None else backoff_max
+        self.token_ttl = app_config.API_TOKEN_TTL if token_ttl is None else token_ttl
+        self.token_cache = app_config.API_TOKEN_CACHE if token_cache is None else token_cache
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._token: str | None = None
+        self._token_expiration: float = 0.0
+        self._token_lock = threading.Lock()
+        self._load_token_cache()
+
+    def url(self, path: str) -> str:
+        return f'{self.api_host}{path}'
+
+    # Token
+
+    def _load_token_cache(self):
+        if not self.token_cache or not os.path.isfile(self.token_cache):
+            return
+        try:
+            with open(self.token_cache, 'r') as file:
+                data = json.load(file)
+            self._token = data['token']
+            self._token_expiration = float(data['expiration'])
+        except Exception as e:
+            logger.warning('Token cache "%s" could not be read: %s', self.token_cache, e)
+
+    def _save_token_cache(self):
+        if not self.token_cache:
+            return
+        data = {'token': self._token, 'expiration': self._token_expiration}
+        temp_path = f'{self.token_cache}.tmp'
+        with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as file:
+            json.dump(data, file)
+        os.replace(temp_path, self.token_cache)
+
+    def invalidate_token(self):
+        self._token = None
+        self._token_expiration = 0.0
+        if self.token_cache and os.path.isfile(self.token_cache):
+            os.remove(self.token_cache)
+
+    def token(self) -> str | None:
+        '''Retorna el token guardado o inicia sesión si no existe o expira en menos de un minuto'''
+        with self._token_lock:
+            if self._token is None or time.time() > self._token_expiration - 60:
+                self.login()
+            return self._token
+
+    def _discard_token(self, token: str):
+        '''Descarta el token rechazado por el servicio, salvo que otro hilo ya lo haya renovado'''
+        with self._token_lock:
+            if self._token == token:
+                self.invalidate_token()
+
+    def login(self) -> str | None:
+        login_data = {
+            'username': self.username,
+            'password': self.password
+        }
+        with metrics.timer('swarm_login_seconds'):
+            response = self._send('POST', self.url(LOGIN_PATH), data=login_data)
+        if response is None:
+            metrics.incr('swarm_logins_total', result='error')
+            return None
         if response.status_code == 200:
-            data = response.json()
-            token = data['token']
+            token = response.json().get('token')
             if token is not None:
+                metrics.incr('swarm_logins_total', result='ok')
                 logger.info('Login successful!')
+                self._token = token
+                self._token_expiration = _get_token_expiration(token, self.token_ttl)
+                self._save_token_cache()
                 return token
             return None
-        else:
-            logger.warning("Login failed. Status code:", response.status_code)
-            return None
-    except requests.exceptions.RequestException as e:
-        logger.error("An error occurred during login:", e)
+        metrics.incr('swarm_logins_total', result='failed')
+        logger.warning('Login failed. Status code: %s', response.status_code)
         return None
-    
-def logout(token):
-    headers = _get_auth_headers(token)
-    try:
-        response = requests.post(LOGOUT_URL, headers=headers)
-        if response.status_code == 204:
-            logger.info("Logout successful!")
+
+    def logout(self, token: str | None = None) -> bool:
+        '''Cierra la sesión del token guardado, o la de token si se indica (el guardado se descarta si es el mismo)'''
+        if token is None:
+            token = self._token
+        if token is None:
+            return False
+        response = self._send('POST', self.url(LOGOUT_PATH), headers=_get_auth_headers(token))
+        self._discard_token(token)
+        if response is not None and response.status_code == 204:
+            logger.info('Logout successful!')
             return True
-        else:
-            logger.warning("Logout failed. Status code:", response.status_code)
-    except requests.exceptions.RequestException as e:
-        logger.error("An error occurred during logout:", e)
-    return False
+        logger.warning('Logout failed. Status code: %s', None if response is None else response.status_code)
+        return False
 
-def make_authenticated_request(url, token, method='GET', data=None, params=None) -> requests.Response:
-    '''Función genérica para realizar request a servicios swarm'''
-    headers = _get_auth_headers(token)
-    headers['accept'] = 'application/json'
-    
-    response = requests.Response()
-    response.status_code = 500
-    response.reason = 'Internal error'
+    # Requests
 
-    logger.debug(f'make_authenticated_request url={url}, method={method}, data={data}, params={params}')
+    def _backoff(self, attempt: int, response: requests.Response | None) -> float:
+        '''Espera antes del siguiente intento: Retry-After si el servicio lo indica, si no exponencial con jitter'''
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after is not None and retry_after.isdigit():
+                return min(float(retry_after), self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
 
-    try:
-        if (method == 'GET'):
-            response = requests.get(url, headers=headers, params=params)
-        if (method == 'POST'):
-            response = requests.post(url, headers=headers, data=data, params=params)
-        if (method == 'PUT'):
-            response = requests.put(url, headers=headers, data=data, params=params)
+    def _send(self, method: str, url: str, **kwargs) -> requests.Response | None:
+        '''Envía la petición reintentando errores de conexión y respuestas 429/5xx'''
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                metrics.incr('swarm_responses_total', status=response.status_code)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return response
+                logger.warning('%s %s status_code=%s attempt=%s', method, url, response.status_code, attempt + 1)
+            except requests.exceptions.RequestException as e:
+                metrics.incr('swarm_request_errors_total')
+                logger.warning('%s %s request error attempt=%s: %s', method, url, attempt + 1, e)
+            if attempt < self.max_retries:
+                metrics.incr('swarm_retries_total')
+                time.sleep(self._backoff(attempt, response))
         return response
-    except requests.exceptions.RequestException as e:
-        logger.error("Request error:", e)
+
+    def request(self, path: str, method: str = 'GET', data=None, params=None) -> requests.Response:
+        '''Petición autenticada. Si el servicio responde 401 inicia sesión de nuevo y reintenta una vez,
+        un segundo 401 se retorna tal cual'''
+        response = None
+        for _ in range(2):
+            token = self.token()
+            if token is None:
+                break
+            headers = _get_auth_headers(token)
+            headers['accept'] = 'application/json'
+            response = self._send(method, self.url(path), headers=headers, data=data, params=params)
+            if response is None or response.status_code != 401:
+                break
+            self._discard_token(token)
+        if response is not None:
+            return response
+
+        response = requests.Response()
+        response.status_code = 500
+        response.reason = 'Internal error'
         return response
 
-def get_devices(token: str) -> list[DeviceModel]:
-    '''Retorna los dispositivos registrados'''
-    response = make_authenticated_request(DEVICES_URL, token)
+    def get_devices(self) -> list[DeviceModel]:
+        '''Retorna los dispositivos registrados'''
+        with metrics.timer('swarm_fetch_seconds', endpoint='devices'):
+            return _parse_devices(self.request(DEVICES_PATH))
+
+    def get_messages(self, start_date: datetime | None = None, end_date: datetime | None = None, device_id: str | None = None):
+        '''Retorna los mensajes de los dispositivos (rango máximo de 30 días)'''
+        params = {
+            'startDate': _get_utc_ISO_8601_datetime_str(start_date),
+            'endDate': _get_utc_ISO_8601_datetime_str(end_date),
+            'deviceid': device_id,
+        }
+        with metrics.timer('swarm_fetch_seconds', endpoint='messages'):
+            messages = _parse_messages(self.request(MESSAGES_PATH, params=params))
+        if isinstance(messages, list):
+            metrics.incr('swarm_messages_fetched_total', len(messages))
+        return messages
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+_default_client: SwarmClient | None = None
+
+def get_client() -> SwarmClient:
+    '''Cliente compartido por las funciones del módulo'''
+    global _default_client
+    if _default_client is None:
+        _default_client = SwarmClient()
+    return _default_client
+
+def _parse_devices(response: requests.Response) -> list[DeviceModel]:
     if response.status_code == 200:
         data = response.json()
         if isinstance(data, list):
@@ -97,11 +287,54 @@ def get_devices(token: str) -> list[DeviceModel]:
         else:
             return []
     else:
-        response_message = response.json()['message']
+        response_message = _response_message(response)
+        if (response_message is None):
+            logger.error('get devices error status_code=%s response=%s', response.status_code, response)
+        raise ValueError(response_message if response_message is not None else f'request get devices error {response.reason}')
+
+def _parse_messages(response: requests.Response):
+    if response.status_code == 200:
+        return response.json()
+    else:
+        response_message = _response_message(response)
         if (response_message is None):
-            logger.error(f'get messages error status_code={response.status_code} response={response} json={response.json()}')
+            logger.error('get messages error status_code=%s response=%s', response.status_code, response)
         raise ValueError(response_message if response_message is not None else f'request get messages error {response.reason}')
 
+def login(username=None, password=None):
+    '''Retorna el token del cliente compartido, solo inicia sesión si no hay un token vigente'''
+    if username is None:
+        username = app_config.USERNAME
+    if password is None:
+        password = app_config.PASSWORD
+    client = get_client()
+    if (client.username, client.password) != (username, password):
+        client.username = username
+        client.password = password
+        client.invalidate_token()
+    return client.token()
+
+def logout(token):
+    return get_client().logout(token)
+
+def make_authenticated_request(url, token, method='GET', data=None, params=None) -> requests.Response:
+    '''Función genérica para realizar request a servicios swarm'''
+    headers = _get_auth_headers(token)
+    headers['accept'] = 'application/json'
+
+    logger.debug('make_authenticated_request url=%s, method=%s, data=%s, params=%s', url, method, data, params)
+
+    response = get_client()._send(method, url, headers=headers, data=data, params=params)
+    if response is None:
+        response = requests.Response()
+        response.status_code = 500
+        response.reason = 'Internal error'
+    return response
+
+def get_devices(token: str) -> list[DeviceModel]:
+    '''Retorna los dispositivos registrados'''
+    return _parse_devices(make_authenticated_request(f'{app_config.API_HOST}{DEVICES_PATH}', token))
+
 def get_messages(token: str, start_date: datetime | None = None, end_date: datetime | None = None, device_id: str | None = None,):
     '''Retorna los mensajes de los dispositivos. Retorna todos los registros dentro
     de un rango de 30 días, documentación por swarm https://bumblebee.hive.swarm.space/apiDocs'''
@@ -110,12 +343,4 @@ def get_messages(token: str, start_date: datetime | None = None, end_date: datet
         'endDate': _get_utc_ISO_8601_datetime_str(end_date),
         'deviceid': device_id,
     }
-    response = make_authenticated_request(MESSAGES_URL, token, params=params)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        response_message = response.json()['message']
-        if (response_message is None):
-            logger.error(f'get messages error status_code={response.status_code} response={response} json={response.json()}')
-        raise ValueError(response_message if response_message is not None else f'request get messages error {response.reason}')
-
+    return _parse_messages(make_authenticated_request(f'{app_config.API_HOST}{MESSAGES_PATH}', token, params=params))
@@ -0,0 +1,78 @@
+'''
+Estado de sincronización incremental: último hiveRxTime procesado por dispositivo
+'''
+
+import json
+import os
+
+from datetime import datetime, timezone
+
+import app_config
+
+logger = app_config.CustomLogger('sync_state')
+
+def parse_hive_time(value: str) -> datetime:
+    '''Convierte hiveRxTime (ISO 8601 en UTC, con o sin zona) a datetime con zona UTC'''
+    result = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if result.tzinfo is None:
+        result = result.replace(tzinfo=timezone.utc)
+    return result
+
+class SyncState:
+    '''Guarda por dispositivo el último hiveRxTime procesado y los packetId recibidos en ese mismo instante,
+    para pedir al servicio solo los mensajes nuevos y descartar los repetidos.'''
+
+    def __init__(self, path: str = 'sync_state.json'):
+        self.path = path
+        self.devices: dict[str, dict] = {}
+        self.load()
+
+    def load(self):
+        self.devices = {}
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, 'r') as file:
+                self.devices = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.error('Sync state "%s" could not be read, starting from scratch: %s', self.path, e)
+
+    def save(self):
+        '''Escribe el estado en un archivo temporal y lo reemplaza, así nunca queda un archivo a medias'''
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(self.devices, file)
+        os.replace(temp_path, self.path)
+
+    def watermark(self, device_id) -> datetime | None:
+        '''Último hiveRxTime procesado del dispositivo'''
+        item = self.devices.get(str(device_id))
+        return None if item is None else parse_hive_time(item['hiveRxTime'])
+
+    def start_date(self, device_id=None) -> datetime | None:
+        '''Fecha desde la cual pedir mensajes: la marca del dispositivo, o la menor de todas si no se indica'''
+        if device_id is not None:
+            return self.watermark(device_id)
+        watermarks = [self.watermark(key) for key in self.devices]
+        return min(watermarks, default=None)
+
+    def is_new(self, message: dict) -> bool:
+        '''Retorna True si el paquete es posterior a la marca del dispositivo o no fue procesado en ese instante'''
+        item = self.devices.get(str(message['deviceId']))
+        if item is None:
+            return True
+        rx_time = parse_hive_time(message['hiveRxTime'])
+        watermark = parse_hive_time(item['hiveRxTime'])
+        if rx_time != watermark:
+            return rx_time > watermark
+        return message['packetId'] not in item['packetIds']
+
+    def update(self, message: dict):
+        '''Avanza la marca del dispositivo con un paquete procesado'''
+        key = str(message['deviceId'])
+        item = self.devices.get(key)
+        rx_time = parse_hive_time(message['hiveRxTime'])
+        if item is None or rx_time > parse_hive_time(item['hiveRxTime']):
+            self.devices[key] = {'hiveRxTime': message['hiveRxTime'], 'packetIds': [message['packetId']]}
+        elif rx_time == parse_hive_time(item['hiveRxTime']) and message['packetId'] not in item['packetIds']:
+            item['packetIds'].append(message['packetId'])
@@ -1,12 +1,38 @@
 import base64
 
-from datetime import datetime, timedelta, date, time
+import math
 
-from models.message_encode_model import MessageEncodeModel, MessageDecodeValueModel
+import os
+
+from collections import deque
+
+from itertools import islice
+
+from datetime import datetime, date, time
+
+from typing import TYPE_CHECKING, Iterable, Iterator
+
+from models.message_encode_model import MessageEncodeModel, MessageDecodeValueModel, MessageValuesView
 
 from models.device_model import DeviceModel
 
-import swarm_provider
+from models.decoded_batch_model import DecodedBatchModel, epoch_to_datetime
+
+import pseudo_codec
+
+import batch_decode
+
+import metrics
+
+import json_stream
+
+from sync_state import SyncState
+
+from column_store import VARIABLE_NAMES, csv_header
+
+from device_registry import DeviceRegistry
+
+from quarantine import STAGE_CALIBRATION, STAGE_DECODE, STAGE_MESSAGE, STAGE_PAYLOAD, Quarantine
 
 import app_config
 
@@ -14,17 +40,28 @@ import json
 
 import csv
 
+if TYPE_CHECKING:
+    # solo los comandos en línea importan swarm_provider (y requests)
+    import swarm_provider
+
+    from coverage_index import CoverageIndex
+    from frame_archive import FrameArchive
+
 logger = app_config.CustomLogger('decode_util')
 
-device_config = app_config.DeviceConfig()
+device_config = app_config.DeviceConfig(lazy=True)
+
+# paquetes que no se pudieron decodificar, la decodificación sigue con el resto
+quarantine = Quarantine()
 
 def get_device_mult_offset_list(device_name: str) -> list[tuple[float, float]]:
     '''Retorna la lista con los valores mult y offset a partir del nombre del dispositivo'''
-    try:
-        return device_config.data[device_name]
-    except Exception:
-        return []
+    return device_config.get_mult_offset(device_name)
 
+def device_config_snapshot() -> dict[str, list[tuple[float, float]]]:
+    '''Copia de la calibración actual (revisando cambios en los archivos) para enviar a los workers'''
+    device_config.reload_if_changed()
+    return dict(device_config.data)
 
 def find_device_by_id(device_list: list[DeviceModel], target_id) -> DeviceModel | None:
     '''Busca el dispositivo a partir de una lista de dispositivos por el device_id'''
@@ -40,113 +77,60 @@ def get_mult_offset(values: list[tuple[float, float]], index: int) -> tuple[floa
             return values[index]
     return (1.0, 0.0)
 
-def convert_pseudo_to_int(pseudo: str) -> int:
-    '''Decodifica un str de n bytes y lo convierte a int'''
-    string_array = [''] * len(pseudo)
-    result = ''
-    ii = 0
-
-    if len(pseudo) > 0:
-        ii = len(pseudo) - 1
-
-    for c in pseudo:
-        int_c = ord(c)
-        if int_c == 63:
-            int_c = 127  # '?' represents a value of 127 in decimal
-        binary = bin(int_c)[2:].zfill(8)[2:]
-        string_array[ii] = binary
-        ii -= 1
-        result += binary
-
-    n = int(result, 2)
-    if n > 131071:
-        n = -n + 131072
-    return n
+def convert_pseudo_to_int(pseudo: str | bytes) -> int:
+    '''Decodifica un str (o bytes) de n bytes y lo convierte a int'''
+    if isinstance(pseudo, str):
+        pseudo = pseudo.encode('latin-1')
+    return pseudo_codec.decode_pseudo_int(pseudo, 0, len(pseudo))
 
 def int_to_date(date_int: int) -> date:
     '''Retorna un objecto date a partir de la fecha con valor entero. 
     El entero debe seguir el formato juliano YYDDD, siendo YY el año y DDD el día juliano'''
-    value_str = str(round(date_int / 1000.0, 3))
-    value_split = value_str.split('.')
-    if len(value_split) != 2:
-        raise ValueError('int_to_date >> Value not follows the format make sure are using YYDDD')
-    year = int(value_split[0]) + 2000
-    julian_days = int(value_split[1])
-    dt = datetime(year, 1, 1) + timedelta(days=julian_days - 1)
-    return dt.date()
+    return pseudo_codec.julian_date(date_int)
 
 def int_to_datetime(date_int: int, time_int: int) -> datetime:
     '''Retorna un objeto datetime a partir de la fecha y tiempo con valor entero. 
     La fecha debe tener el formato juliano.
     El tiempo se basa en HHMMSS, en el caso de que sea negativo se suma 12 horas'''
-    date_result = int_to_date(date_int)
-    is_pm = False
-    
-    if (time_int < 0):
-        is_pm = True
-
-    time_int = abs(time_int)
-    hour_split = str(round(time_int / 10000.0, 4)).split('.')
-
-    if len(hour_split) != 2:
-        raise ValueError('int_to_datetime >> Hour not follows the format')
-    
-    hour = int(hour_split[0])
-    if is_pm:
-        hour += 12
-
-    minute_split = str(round(float(hour_split[1]) / 100.0, 2)).split('.')
-
-    if (len(minute_split) != 2):
-        raise ValueError('int_to_datetime >> Minute not follows the format')
-
-    minute = int(minute_split[0])
-    second = int(minute_split[1])
-
-    desired_time = time(hour, minute, second)
-
-    return datetime.combine(date_result, desired_time)
+    return datetime.combine(pseudo_codec.julian_date(date_int), time(*pseudo_codec.split_time(time_int)))
 
 def int_to_minutes_n_vars(value: int) -> tuple[int, int]:
     '''Retorna una tupla con los valores (minutos, n variables) a partir de un entero'''
-    value = abs(value)
-    value_str = str(round(value / 100.0, 2))
-    value_split = value_str.split('.')
-    if len(value_split) != 2:
-        raise ValueError('int_to_minutes_n_vars >> value not follows the format, make sure the frame has 000 format to get minutes and n vars')
-    return (int(value_split[0]), int(value_split[1]))
-
-def int_to_measure(value: int, mult: float, offset: float, round_digits: int = app_config.ROUND_DIGITS) -> float:
+    return pseudo_codec.split_minutes_n_vars(value)
+
+def int_to_measure(value: int, mult: float, offset: float, round_digits: int | None = None) -> float:
     '''Retorna el valor aplicando la formula: value * mult + offset. Aplica redondeo al resultado.'''
+    if round_digits is None:
+        round_digits = app_config.ROUND_DIGITS
     return round((float(value) * mult) + offset, round_digits)
 
-def data_to_date_minutes_n_vars(data: str, n_bytes = app_config.N_BYTES):
+def data_to_date_minutes_n_vars(data: bytes | str, n_bytes = None):
     '''Retorna los valores (fecha inicial, minutos, n variables) a partir de la trama. 
     La trama debe ser mayor a 3 * n_bytes caracteres.'''
+    if n_bytes is None:
+        n_bytes = app_config.N_BYTES
     if len(data) < (3 * n_bytes):
         raise ValueError(f'data_to_date_minutes_n_vars >> Min data lenght is {3 * n_bytes}, current is {len(data)}')
     
-    date_int = convert_pseudo_to_int(data[0:int(n_bytes)])
-    time_int = convert_pseudo_to_int(data[int(n_bytes):int(n_bytes * 2)])
-    vars_int = convert_pseudo_to_int(data[int(n_bytes * 2):int(n_bytes * 3)])
-    datetime_value = int_to_datetime(date_int, time_int)
-    (minutes, n_vars) = int_to_minutes_n_vars(vars_int)
-    return datetime_value, minutes, n_vars
-
-def decode_message_values(message: MessageEncodeModel, n_bytes = app_config.N_BYTES) -> list[MessageDecodeValueModel]:
+    if isinstance(data, str):
+        data = data.encode('latin-1')
+
+    (start_epoch, minutes, n_vars) = pseudo_codec.decode_header(data, 0, n_bytes)
+    return epoch_to_datetime(start_epoch), minutes, n_vars
+
+def decode_message_values(message: MessageEncodeModel, n_bytes = None) -> list[MessageDecodeValueModel]:
     '''Decodifica los valores de la trama (data) del objecto MessageEncodeModel.
     La trama (data) debe ser mayor a 0.
     La cantidad de variables (n_vars) debe ser mayor 0.
     La fecha (initial_date) debe estar establecida.
     \nImportante: en el caso de que el valor pertenezca a los valores NaN, se establece como None.'''
-
-    decode_values: list[MessageDecodeValueModel] = []
+    if n_bytes is None:
+        n_bytes = app_config.N_BYTES
 
     data = message.data
     date = message.initial_date
     minutes = message.minutes
     n_vars = message.n_vars
-    mult_offset_list = message.mult_offset
 
     if len(data) == 0:
         raise ValueError('decode_message_values >> Message data is empty')
@@ -155,34 +139,18 @@ def decode_message_values(message: MessageEncodeModel, n_bytes = app_config.N_BY
         raise ValueError('decode_message_values >> Number of variables is 0')
     
     if (date is None):
-        return ValueError('decode_message_values >> Initial date is None')
-
-    new_datetime = date
-
-    for i in range(int(3 * n_bytes), len(data), int(n_vars * n_bytes)):
-        values: list[float] = []
-        index: int = 0
-        for j in range(i, i + (n_vars * n_bytes), n_bytes):
-            end_index = j + n_bytes
-            if end_index <= len(data):
-                chunk = data[j:end_index]
-                value_int = convert_pseudo_to_int(chunk)
-                if value_int in app_config.NAN_VALUES: # check if value is in NAN_VALUES to set None
-                    values.append(None)
-                else:
-                    (mult, offset) = get_mult_offset(mult_offset_list, index)
-                    measure = int_to_measure(value_int, mult, offset)
-                    values.append(measure)
-            index += 1
-        
-        decode_values.append(MessageDecodeValueModel(new_datetime, values))
-        new_datetime = new_datetime + timedelta(minutes=minutes)
-    return decode_values
-
-def decode_message(message: MessageEncodeModel, device_name: str | None, n_bytes=app_config.N_BYTES):
+        raise ValueError('decode_message_values >> Initial date is None')
+
+    # las fechas de las filas se calculan a partir de la fecha inicial al leerlas
+    batch = batch_decode.decode_frame(data, date, minutes, n_vars, message.mult_offset, n_bytes)
+    return list(MessageValuesView(batch, 0))
+
+def decode_message(message: MessageEncodeModel, device_name: str | None, n_bytes=None):
     '''Decodifica el objecto MessageEncodeModel.
     Valida que la fecha inicial (initial_date), la cantidad de variables (n_vars), minutos (minutes) y 
     los valores (mult_offset) se encuentren establecidos'''
+    if n_bytes is None:
+        n_bytes = app_config.N_BYTES
     if message.initial_date is None or message.n_vars == 0:
         (initial_date, minutes, n_vars) = data_to_date_minutes_n_vars(message.data, n_bytes)
 
@@ -196,74 +164,281 @@ def decode_message(message: MessageEncodeModel, device_name: str | None, n_bytes
     values = decode_message_values(message, n_bytes)
     message.message_values = values
 
-def decode_messages(json_data, devices: list[DeviceModel], n_bytes = app_config.N_BYTES) -> list[MessageEncodeModel]:
-    '''Retorna la respuesta JSON del servicio en una lista de objectos MessageEncodeModel con los valores decodificados'''
-    result: list[MessageEncodeModel] = []
+def decode_payload(data: str) -> bytes:
+    '''Decodifica el base64 de la trama. La trama solo puede contener caracteres ASCII'''
+    decoded_bytes = base64.b64decode(data)
+    if not decoded_bytes.isascii():
+        raise ValueError('decode_payload >> Message data is not ASCII')
+    return decoded_bytes
+
+def message_payload(message: dict) -> bytes:
+    '''Trama sin base64: payload en los paquetes leídos del FrameArchive, data decodificado en los del servicio'''
+    payload = message.get('payload')
+    return payload if payload is not None else decode_payload(message['data'])
+
+def decode_messages(json_data, devices: list[DeviceModel] | DeviceRegistry, n_bytes = None, workers: int = 1,
+                    archive: 'FrameArchive | None' = None) -> list[MessageEncodeModel]:
+    '''Retorna la respuesta JSON del servicio en una lista de objectos MessageEncodeModel con los valores decodificados.
+    Con workers > 1 la decodificación se reparte en varios procesos, el resultado es el mismo.
+    Con archive los paquetes se guardan también en el archivo local antes de decodificarlos.'''
+    if n_bytes is None:
+        n_bytes = app_config.N_BYTES
+    if archive is not None and isinstance(json_data, list):
+        archive.append(json_data)
+    registry = devices if isinstance(devices, DeviceRegistry) else DeviceRegistry.from_devices(devices)
+    items: list[tuple[dict, str | None]] = []
     if isinstance(json_data, list):
       for message in json_data: 
          if (isinstance(message, dict)):
-            id = message['packetId']
-            data = message['data']
-            device_type = message['deviceType']
-            device_id = message['deviceId']
-            status = message['status']
-            if (data is not None):
-                device = find_device_by_id(devices, device_id)
-
-                # decode base64 data
-                decoded_bytes = base64.b64decode(data)
-                decoded_string = decoded_bytes.decode('utf-8')
-
-                device_name = None if device is None else device.get_device_name_without_prefix()
-
-                message_model = MessageEncodeModel(id, decoded_string, device_type, device_id, device_name, status)
-                decode_message(message_model, device_name, n_bytes)
-                
-                result.append(message_model)
-
-    return result
+            if (message.get('data') is not None):
+                device_name = registry.device_name(message.get('deviceId'))
+                items.append((message, device_name))
+
+    return _decode_items(items, n_bytes, workers)
+
+def _decode_items(items: list[tuple[dict, str | None]], n_bytes: int, workers: int) -> list[MessageEncodeModel]:
+    '''Decodifica los pares (mensaje JSON, nombre del dispositivo) en serie o en paralelo'''
+    chunk_size = max(1, min(1000, math.ceil(len(items) / (workers * 4))))
+    return list(_iter_decode_items(items, n_bytes, workers, chunk_size))
+
+def _iter_decode_items(items: Iterable[tuple[dict, str | None]], n_bytes: int, workers: int,
+                       chunk_size: int = 1000) -> Iterator[MessageEncodeModel]:
+    '''Decodifica los pares (mensaje JSON, nombre del dispositivo) a medida que llegan, en serie o en paralelo.
+    Los paquetes que no se pueden decodificar se guardan en quarantine y no detienen al resto'''
+    if workers > 1:
+        import parallel_decode
+
+        # pares enviados a los workers que aún no tienen resultado, los registros llegan en el mismo orden
+        submitted: deque[tuple[dict, str | None]] = deque()
+
+        def packets():
+            for (message, device_name) in items:
+                payload = message.get('payload')
+                if payload is None and 'data' not in message:
+                    # mismo error que message_payload en serie, el base64 lo decodifica el worker
+                    quarantine.add(message, device_name, STAGE_PAYLOAD, KeyError('data'))
+                    continue
+                submitted.append((message, device_name))
+                yield (payload if payload is not None else message['data'], device_name)
+
+        for decoded in parallel_decode.iter_decode_packets(packets(), device_config_snapshot(), workers, n_bytes, chunk_size):
+            (message, device_name) = submitted.popleft()
+            if isinstance(decoded, parallel_decode.PacketError):
+                quarantine.add(message, device_name, decoded.stage, decoded.error)
+                continue
+            message_model = _attach_message(message, None, device_name, decoded)
+            if message_model is not None:
+                metrics.incr('messages_decoded_total')
+                yield message_model
+        return
+
+    iterator = iter(items)
+    while True:
+        block = list(islice(iterator, chunk_size))
+        if len(block) == 0:
+            return
+        # decode base64 data, the frame is kept as bytes
+        with metrics.timer('decode_base64_seconds'):
+            payloads = [_safe_payload(message, device_name) for (message, device_name) in block]
+        device_names = [device_name for (_, device_name) in block]
+        with metrics.timer('decode_seconds'):
+            decoded = batch_decode.decode_device_groups(payloads, device_names, get_device_mult_offset_list, n_bytes,
+                                                        packet_ids=[message.get('packetId') for (message, _) in block],
+                                                        device_ids=[message.get('deviceId') for (message, _) in block])
+        count = 0
+        for (message, device_name), payload, item in zip(block, payloads, decoded):
+            if isinstance(payload, Exception):
+                continue
+            if isinstance(item, Exception):
+                quarantine.add(message, device_name, STAGE_DECODE, item)
+                continue
+            message_model = _attach_message(message, payload, device_name, item)
+            if message_model is not None:
+                count += 1
+                yield message_model
+        metrics.incr('messages_decoded_total', count)
+
+def _safe_payload(message: dict, device_name: str | None) -> bytes | Exception:
+    '''Trama del mensaje, o el error (ya guardado en quarantine) si el base64 o los campos no son válidos'''
+    try:
+        return message_payload(message)
+    except (KeyError, TypeError, ValueError) as e:
+        quarantine.add(message, device_name, STAGE_PAYLOAD, e)
+        return e
+
+def _attach_message(message: dict, payload: bytes | None, device_name: str | None,
+                    decoded: tuple[DecodedBatchModel, int]) -> MessageEncodeModel | None:
+    '''MessageEncodeModel del mensaje asociado a su trama del lote, None (y el mensaje en quarantine) si le faltan campos'''
+    try:
+        message_model = _message_model(message, message_payload(message) if payload is None else payload, device_name)
+    except (KeyError, TypeError, ValueError) as e:
+        quarantine.add(message, device_name, STAGE_MESSAGE, e)
+        return None
+    message_model.mult_offset = get_device_mult_offset_list(device_name)
+    message_model.attach(*decoded)
+    return message_model
+
+def _message_model(message: dict, decoded_bytes: bytes, device_name: str | None) -> MessageEncodeModel:
+    return MessageEncodeModel(message['packetId'], decoded_bytes, message['deviceType'], message['deviceId'],
+                              device_name, message['status'], message.get('hiveRxTime'))
 
 def get_messages(start_date: datetime | None = None,
                  end_date: datetime | None = None,
-                 device_id: str | None = None,) -> list[MessageEncodeModel]:
+                 device_id: str | None = None,
+                 client: 'swarm_provider.SwarmClient | None' = None,
+                 registry: DeviceRegistry | None = None) -> list[MessageEncodeModel]:
     '''Retorna los mensajes decodificados del servicio de swarm'''
-    token = swarm_provider.login()
-    if token:
-        devices = swarm_provider.get_devices(token)
-        messages = swarm_provider.get_messages(token, start_date=start_date, end_date=end_date, device_id=device_id)
-        if messages is not None:
-            return decode_messages(messages, devices)
-        swarm_provider.logout(token)
+    import swarm_provider
+
+    client = client or swarm_provider.get_client()
+    devices = registry or DeviceRegistry(client)
+    messages = client.get_messages(start_date=start_date, end_date=end_date, device_id=device_id)
+    if messages is not None:
+        return decode_messages(messages, devices)
     return []
 
-def process_json_message(n_bytes = app_config.N_BYTES):
-    result: list[MessageEncodeModel] = []
-    #response_1713907924096.json
-    # Opening JSON file
-    f = open('response_1713907924096.json')
-    
-    # returns JSON object as 
-    # a dictionary
-    json_data = json.load(f)
-    print(f'numero de mensajes= {len(json_data)}')
+def get_new_messages(state: SyncState,
+                     start_date: datetime | None = None,
+                     device_id: str | None = None,
+                     workers: int = 1,
+                     client: 'swarm_provider.SwarmClient | None' = None,
+                     registry: DeviceRegistry | None = None,
+                     archive: 'FrameArchive | None' = None) -> tuple[list[MessageEncodeModel], list[dict]]:
+    '''Retorna solo los mensajes que no fueron procesados en ejecuciones anteriores, decodificados y sin decodificar.
+    Pide al servicio desde el último hiveRxTime guardado en state (start_date se usa en la primera ejecución)
+    y descarta los paquetes ya vistos. La marca no se avanza: el que llama usa commit_messages con los mensajes
+    sin decodificar después de escribirlos en el almacenamiento, así una falla no pierde paquetes.'''
+    import swarm_provider
+
+    client = client or swarm_provider.get_client()
+    devices = registry or DeviceRegistry(client)
+    new_messages = fetch_new_messages(state, start_date, device_id, client)
+    return decode_messages(new_messages, devices, workers=workers, archive=archive), new_messages
+
+def fetch_new_messages(state: SyncState,
+                       start_date: datetime | None,
+                       device_id: str | None,
+                       client: 'swarm_provider.SwarmClient') -> list[dict]:
+    '''Pide al servicio los mensajes desde la marca de state y retorna los que no fueron procesados (sin decodificar)'''
+    watermark = state.start_date(device_id)
+    messages = client.get_messages(start_date=watermark or start_date, device_id=device_id)
+
+    if not isinstance(messages, list):
+        return []
 
-    for message in json_data:
-        if (isinstance(message, dict)):
-            id = message['packetId']
-            data = message['data']
-            device_type = message['deviceType']
-            device_id = message['deviceId']
-            status = message['status']
-            hiveRxTime =message['hiveRxTime']
-            decoded_bytes = base64.b64decode(data)
-            decoded_string = decoded_bytes.decode('utf-8')
-            device_name= "032e1"
-            message_model = MessageEncodeModel(id, decoded_string, device_type, device_id, device_name, status, hiveRxTime)
-            decode_message(message_model, device_name, n_bytes)
-            result.append(message_model)
-    return result
+    new_messages = [message for message in messages if isinstance(message, dict) and state.is_new(message)]
+    logger.info('get_new_messages received=%s new=%s', len(messages), len(new_messages))
+    return new_messages
 
+def commit_messages(state: SyncState, messages: list[dict]):
+    '''Avanza la marca de state con los mensajes ya procesados y la guarda'''
+    for message in messages:
+        state.update(message)
+    state.save()
+
+def backfill_messages(start_date: datetime,
+                      end_date: datetime,
+                      device_ids: list[str] | None = None,
+                      concurrency: int = 4,
+                      workers: int = 1,
+                      client: 'swarm_provider.SwarmClient | None' = None,
+                      registry: DeviceRegistry | None = None,
+                      archive: 'FrameArchive | None' = None) -> list[MessageEncodeModel]:
+    '''Retorna los mensajes decodificados de un rango de fechas de cualquier largo.
+    El rango se divide en ventanas de 30 días (y por dispositivo) que se consultan en paralelo.'''
+    import swarm_fetch
+    import swarm_provider
+
+    client = client or swarm_provider.get_client()
+    devices = registry or DeviceRegistry(client)
+    messages = swarm_fetch.fetch_messages(client, start_date, end_date, device_ids, concurrency)
+    return decode_messages(messages, devices, workers=workers, archive=archive)
+
+def refetch_gaps(coverage: 'CoverageIndex',
+                 start_date: datetime | None = None,
+                 end_date: datetime | None = None,
+                 device_ids: list[str] | None = None,
+                 concurrency: int = 4,
+                 workers: int = 1,
+                 client: 'swarm_provider.SwarmClient | None' = None,
+                 registry: DeviceRegistry | None = None,
+                 archive: 'FrameArchive | None' = None) -> list[MessageEncodeModel]:
+    '''Retorna los mensajes decodificados de los huecos de coverage (solo las ventanas de plan_refetch,
+    el tráfico depende de las muestras faltantes y no del largo del historial)'''
+    import swarm_fetch
+    import swarm_provider
+
+    from coverage_index import plan_refetch
+
+    requests = plan_refetch(coverage, device_ids, start_date, end_date)
+    logger.info('Refetch plan: %s requests for %s devices', len(requests), len({request.device_id for request in requests}))
+    metrics.incr('refetch_requests_total', len(requests))
+    if len(requests) == 0:
+        return []
+    client = client or swarm_provider.get_client()
+    devices = registry or DeviceRegistry(client)
+    messages = swarm_fetch.fetch_windows(client, requests, concurrency)
+    return decode_messages(messages, devices, workers=workers, archive=archive)
+
+def process_json_message(file_path: str = 'response_1713907924096.json', device_name: str | None = '032e1',
+                         n_bytes = None, workers: int = 1):
+    '''Decodifica un archivo JSON con la respuesta del servicio de mensajes. Carga todo el archivo en memoria,
+    para archivos grandes usar stream_json_messages'''
+    if n_bytes is None:
+        n_bytes = app_config.N_BYTES
+    # Opening JSON file
+    with open(file_path) as f:
+        # returns JSON object as 
+        # a dictionary
+        json_data = json.load(f)
+    print(f'numero de mensajes= {len(json_data)}')
 
+    items = [(message, device_name) for message in json_data if isinstance(message, dict)]
+    return _decode_items(items, n_bytes, workers)
+
+def stream_json_messages(file_path: str = 'response_1713907924096.json', device_name: str | None = '032e1',
+                         n_bytes = None, workers: int = 1,
+                         archive: 'FrameArchive | None' = None) -> Iterator[MessageEncodeModel]:
+    '''Decodifica un archivo JSON con la respuesta del servicio de mensajes leyendo un paquete a la vez.
+    La memoria usada no depende del tamaño del archivo. Con archive los paquetes se guardan en el archivo local.'''
+    if n_bytes is None:
+        n_bytes = app_config.N_BYTES
+    with open(file_path) as f:
+        messages = json_stream.iter_json_array(f)
+        if archive is not None:
+            messages = archive.record(messages)
+        items = ((message, device_name) for message in messages if isinstance(message, dict))
+        yield from _iter_decode_items(items, n_bytes, workers)
+
+def redecode_archive(archive: 'FrameArchive',
+                     registry: DeviceRegistry | None = None,
+                     device_id=None,
+                     start: datetime | None = None,
+                     end: datetime | None = None,
+                     device_name: str | None = None,
+                     n_bytes = None,
+                     workers: int = 1) -> Iterator[MessageEncodeModel]:
+    '''Decodifica de nuevo los paquetes del archivo local con hiveRxTime en [start, end), sin consultar el servicio.
+    El nombre de cada dispositivo (calibración) sale de registry, o de device_name si se indica.
+    Los paquetes sin calibración van a quarantine: sin ella los valores serían los enteros crudos'''
+    if n_bytes is None:
+        n_bytes = app_config.N_BYTES
+    calibrated: dict[str | None, bool] = {}
+
+    def items():
+        for message in archive.iter_messages(device_id, start, end):
+            name = device_name
+            if name is None and registry is not None:
+                name = registry.device_name(message['deviceId'])
+            if name not in calibrated:
+                calibrated[name] = name is not None and len(get_device_mult_offset_list(name)) > 0
+            if not calibrated[name]:
+                quarantine.add(message, name, STAGE_CALIBRATION,
+                               ValueError(f'redecode_archive >> No calibration for device {message["deviceId"]} (name {name})'))
+                continue
+            yield (message, name)
+
+    yield from _iter_decode_items(items(), n_bytes, workers)
 
 def print_decode_messages(messages: list[MessageEncodeModel]):
     '''Imprime los mensajes decodificados ordenados por la fecha inicial'''
@@ -282,31 +457,46 @@ def print_decode_messages(messages: list[MessageEncodeModel]):
         index += 1
 
 
-def save_messages_csv(messages: list[MessageEncodeModel]):
+class MessagesCsvWriter:
+    '''Escribe los mensajes decodificados en messages_decode.csv y datatime_compare.csv a medida que llegan'''
+
+    def __init__(self, values_path: str = 'messages_decode.csv', times_path: str = 'datatime_compare.csv', append: bool = False):
+        '''Con append=True se agregan filas a los archivos existentes (la cabecera solo se escribe en archivos nuevos)'''
+        mode = 'a' if append else 'w'
+        self.write_values_header = not append or not os.path.isfile(values_path) or os.path.getsize(values_path) == 0
+        write_times_header = not append or not os.path.isfile(times_path) or os.path.getsize(times_path) == 0
+        self.values_file = open(values_path, mode, newline='')
+        self.times_file = open(times_path, mode, newline='')
+        self.values_writer = csv.writer(self.values_file)
+        self.times_writer = csv.writer(self.times_file)
+        if write_times_header:
+            self.times_writer.writerow(["Fecha Inicial Dato", "Fecha registro mensaje", "idMessage"])
+        self.count = 0
+
+    def write(self, message: MessageEncodeModel):
+        if self.write_values_header:
+            # la cabecera depende de la cantidad de variables de la primera trama
+            self.values_writer.writerow(csv_header(message.n_vars))
+            self.write_values_header = False
+        self.times_writer.writerow([message.initial_date, message.hiveRxTime, message.id])
+        self.values_writer.writerows([message_value.date] + message_value.values for message_value in message.message_values)
+        self.count += 1
+
+    def close(self):
+        if self.write_values_header:
+            self.values_writer.writerow(csv_header(len(VARIABLE_NAMES)))
+            self.write_values_header = False
+        self.values_file.close()
+        self.times_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def save_messages_csv(messages: Iterable[MessageEncodeModel]):
     #sorted_messages: list[MessageEncodeModel] = sorted(messages, key=lambda t: t.initial_date)
-    data = []
-    data_time = []
-    for message in messages:
-        element = [message.initial_date, message.hiveRxTime, message.id]
-        data_time.append(element)
-        for message_value in message.message_values:
-            element = [message_value.date]+message_value.values
-            data.append(element)
-            
-    
-    with open('messages_decode.csv','w', newline='') as file:
-    # Create a CSV writer object
-        csv_writer = csv.writer(file)
-        csv_writer.writerow(["Fecha", "Nivel de agua", "Temperatura de agua", "Conductividad Eléctrica", "Nivel de bateria"])
-        csv_writer.writerows(data)
-
-
-    with open('datatime_compare.csv','w', newline='') as file:
-    # Create a CSV writer object
-        csv_writer = csv.writer(file)
-        csv_writer.writerow(["Fecha Inicial Dato", "Fecha registro mensaje", "idMessage"])
-        csv_writer.writerows(data_time)
-
-
-
-
+    with MessagesCsvWriter() as writer:
+        for message in messages:
+            writer.write(message)